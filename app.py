@@ -1,15 +1,189 @@
-from flask import Flask, request, jsonify, make_response
-from datetime import datetime
+from flask import Flask, Response, request, jsonify, make_response
+from base64 import b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+import json
+import os
 import uuid
-from data_manager import data_manager
+from engines import create_data_manager
+from persistence_manager import DuplicateKeyError, Version, VersionConflictError
 
 app = Flask(__name__)
+app.config.from_mapping(
+    STORAGE_ENGINE=os.environ.get('HBNB_STORAGE_ENGINE', 'json'),
+    STORAGE_PATH=os.environ.get('HBNB_STORAGE_PATH'),
+    STORAGE_DURABILITY=os.environ.get('HBNB_STORAGE_DURABILITY', 'batch'),
+    STORAGE_GROUP_WINDOW_MS=float(os.environ.get('HBNB_STORAGE_GROUP_WINDOW_MS', '0')),
+    STORAGE_FORMAT=os.environ.get('HBNB_STORAGE_FORMAT', 'json'),
+    STORAGE_SPLIT=os.environ.get('HBNB_STORAGE_SPLIT', '') == '1',
+    STORAGE_MEMORY_BUDGET=os.environ.get('HBNB_STORAGE_MEMORY_BUDGET'),
+)
+
+data_manager = create_data_manager(
+    app.config['STORAGE_ENGINE'],
+    app.config['STORAGE_PATH'],
+    durability=app.config['STORAGE_DURABILITY'],
+    group_window=app.config['STORAGE_GROUP_WINDOW_MS'] / 1000,
+    storage_format=app.config['STORAGE_FORMAT'],
+    split=app.config['STORAGE_SPLIT'],
+    memory_budget=int(app.config['STORAGE_MEMORY_BUDGET']) if app.config['STORAGE_MEMORY_BUDGET'] else None,
+)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_BYTES = 64 * 1024
+NDJSON = 'application/x-ndjson'
+
+def encode_cursor(entity_id):
+    return urlsafe_b64encode(entity_id.encode()).decode()
+
+def decode_cursor(cursor):
+    return b64decode(cursor.encode(), altchars=b'-_', validate=True).decode()
+
+def json_response(body, status=200):
+    """Respond with an already serialized JSON body."""
+    return Response(body, status=status, mimetype='application/json')
+
+def not_modified(version):
+    """Whether the client's cached copy, named by If-None-Match or If-Modified-Since, is current.
+
+    If-None-Match wins when both are sent, as ETags are exact while
+    Last-Modified only has a one-second resolution.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(version.tag)
+    if request.if_modified_since:
+        return int(version.modified_at) <= request.if_modified_since.timestamp()
+    return False
+
+def conditional(version, respond, variant=None):
+    """Answer 304 if the client's copy is current, otherwise respond() with validators.
+
+    version is read before the body, so a body is never older than its
+    ETag. Nothing is fetched or serialized for a 304. variant names the
+    representation when one resource has several, such as NDJSON or a
+    page, and is appended to the tag so each gets an ETag of its own.
+    """
+    if version is None:
+        return respond()
+    if variant:
+        version = version._replace(tag=f"{version.tag}-{variant}")
+    response = Response(status=304) if not_modified(version) else respond()
+    if response.status_code in (200, 304):
+        response.set_etag(version.tag)
+        response.last_modified = datetime.fromtimestamp(version.modified_at, timezone.utc)
+    return response
+
+def expected_version(entity_type, entity_id):
+    """The version tag a PUT or DELETE must still find, from If-Match, or None if unconditional.
+
+    Raises VersionConflictError right away if no tag matches; otherwise the
+    storage engine checks the tag again atomically with the write.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    version = data_manager.get_version(entity_type, entity_id)
+    if version is None or not request.if_match.contains(version.tag):
+        raise VersionConflictError(entity_type, entity_id)
+    return version.tag
+
+def get_entity(entity_type, entity_id, not_found):
+    """Respond with one entity, or with a 404 carrying not_found if there is none."""
+    def respond():
+        body = data_manager.get_json(entity_type, entity_id)
+        if body is None:
+            return make_response(jsonify({'error': not_found}), 404)
+        return json_response(body)
+    return conditional(data_manager.get_version(entity_type, entity_id), respond)
+
+def find_entities(entity_type, **criteria):
+    return conditional(data_manager.get_version(entity_type),
+                       lambda: jsonify(data_manager.find(entity_type, **criteria)))
+
+def buffered(pieces):
+    """Join small string pieces into chunks of about STREAM_CHUNK_BYTES."""
+    chunk, size = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_BYTES:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+def json_array(entities):
+    yield '['
+    separator = ''
+    for entity in entities:
+        yield separator + json.dumps(entity)
+        separator = ','
+    yield ']\n'
+
+def snapshot_entities(entity_type):
+    """Yield a whole collection as of the moment the stream starts."""
+    with data_manager.snapshot() as view:
+        yield from view.iter_all(entity_type)
+
+def stream_collection(entity_type, ndjson):
+    """Stream a whole collection as one JSON array, or as NDJSON (one entity per line)."""
+    entities = snapshot_entities(entity_type)
+    if ndjson:
+        return Response(buffered(json.dumps(entity) + '\n' for entity in entities), mimetype=NDJSON)
+    return Response(buffered(json_array(entities)), mimetype='application/json')
+
+def list_collection(entity_type):
+    """Respond with a whole collection, or with one page of it if limit or cursor is given.
+
+    Pages look like {"items": [...], "next": cursor}, where next is an opaque
+    cursor for the following page, or null on the last one. A client that
+    accepts application/x-ndjson, or passes stream=1, gets the whole
+    collection streamed instead of built in memory first. Every variant is
+    validated against the collection's version, under an ETag of its own.
+    """
+    response = collection_response(entity_type)
+    response.vary.add('Accept')
+    return response
+
+def collection_response(entity_type):
+    version = data_manager.get_version(entity_type)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        ndjson = request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+        if ndjson:
+            return conditional(version, lambda: stream_collection(entity_type, True), 'ndjson')
+        if request.args.get('stream') in ('1', 'true'):
+            return conditional(version, lambda: stream_collection(entity_type, False), 'stream')
+        return conditional(version, lambda: json_response(data_manager.get_all_json(entity_type)))
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return make_response(jsonify({'error': f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400)
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return make_response(jsonify({'error': 'Invalid cursor'}), 400)
+
+    def page():
+        items, next_after = data_manager.get_page(entity_type, limit, after)
+        return jsonify({'items': items, 'next': encode_cursor(next_after) if next_after is not None else None})
+    return conditional(version, page, f"page-{limit}-{request.args.get('cursor', '')}")
+
+@app.errorhandler(DuplicateKeyError)
+def handle_duplicate_key(error):
+    return make_response(jsonify({'error': f"{error.field.capitalize()} already exists"}), 409)
+
+@app.errorhandler(VersionConflictError)
+def handle_version_conflict(error):
+    return make_response(jsonify({'error': 'Resource has been modified'}), 412)
 
 # User endpoints
 @app.route('/users', methods=['GET', 'POST'], strict_slashes=False)
 def manage_users():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('users'))
+        return list_collection('users')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -22,31 +196,31 @@ def manage_users():
 
 @app.route('/users/<user_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_user(user_id):
-    user = data_manager.get('users', user_id)
-    if not user:
-        return make_response(jsonify({'error': 'User not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(user)
+        return get_entity('users', user_id, 'User not found')
 
     if request.method == 'PUT':
+        expected = expected_version('users', user_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = user_id
         data['updated_at'] = datetime.now().isoformat()
-        data_manager.update('users', user_id, data)
+        if not data_manager.update('users', user_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'User not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('users', user_id)
+        expected = expected_version('users', user_id)
+        if not data_manager.delete('users', user_id, expected_version=expected):
+            return make_response(jsonify({'error': 'User not found'}), 404)
         return make_response('', 204)
 
 # Country endpoints
 @app.route('/countries', methods=['GET', 'POST'], strict_slashes=False)
 def manage_countries():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('countries'))
+        return list_collection('countries')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -58,40 +232,47 @@ def manage_countries():
 
 @app.route('/countries/<country_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_country(country_id):
-    country = data_manager.get('countries', country_id)
-    if not country:
-        return make_response(jsonify({'error': 'Country not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(country)
+        return get_entity('countries', country_id, 'Country not found')
 
     if request.method == 'PUT':
+        expected = expected_version('countries', country_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = country_id
-        data_manager.update('countries', country_id, data)
+        if not data_manager.update('countries', country_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'Country not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('countries', country_id)
+        expected = expected_version('countries', country_id)
+        if not data_manager.delete('countries', country_id, expected_version=expected):
+            return make_response(jsonify({'error': 'Country not found'}), 404)
         return make_response('', 204)
 
 @app.route('/countries/<country_id>/cities', methods=['GET'], strict_slashes=False)
 def get_country_cities(country_id):
-    country = data_manager.get('countries', country_id)
-    if not country:
-        return make_response(jsonify({'error': 'Country not found'}), 404)
-
-    cities = data_manager.get_all('cities')
-    country_cities = [city for city in cities if city['country_code'] == country['code']]
-    return jsonify(country_cities)
+    country_version = data_manager.get_version('countries', country_id)
+    cities_version = data_manager.get_version('cities')
+    version = None
+    if country_version and cities_version:
+        version = Version(f"{country_version.tag}.{cities_version.tag}",
+                          max(country_version.modified_at, cities_version.modified_at))
+
+    def country_cities():
+        with data_manager.snapshot() as view:
+            country = view.get('countries', country_id)
+            if not country:
+                return make_response(jsonify({'error': 'Country not found'}), 404)
+            return jsonify(view.find('cities', country_code=country['code']))
+    return conditional(version, country_cities)
 
 # City endpoints
 @app.route('/cities', methods=['GET', 'POST'], strict_slashes=False)
 def manage_cities():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('cities'))
+        return list_collection('cities')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -103,30 +284,30 @@ def manage_cities():
 
 @app.route('/cities/<city_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_city(city_id):
-    city = data_manager.get('cities', city_id)
-    if not city:
-        return make_response(jsonify({'error': 'City not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(city)
+        return get_entity('cities', city_id, 'City not found')
 
     if request.method == 'PUT':
+        expected = expected_version('cities', city_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = city_id
-        data_manager.update('cities', city_id, data)
+        if not data_manager.update('cities', city_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'City not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('cities', city_id)
+        expected = expected_version('cities', city_id)
+        if not data_manager.delete('cities', city_id, expected_version=expected):
+            return make_response(jsonify({'error': 'City not found'}), 404)
         return make_response('', 204)
 
 # Amenity endpoints
 @app.route('/amenities', methods=['GET', 'POST'], strict_slashes=False)
 def manage_amenities():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('amenities'))
+        return list_collection('amenities')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -138,31 +319,31 @@ def manage_amenities():
 
 @app.route('/amenities/<amenity_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_amenity(amenity_id):
-    amenity = data_manager.get('amenities', amenity_id)
-    if not amenity:
-        return make_response(jsonify({'error': 'Amenity not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(amenity)
+        return get_entity('amenities', amenity_id, 'Amenity not found')
 
     if request.method == 'PUT':
+        expected = expected_version('amenities', amenity_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = amenity_id
         data['updated_at'] = datetime.now().isoformat()
-        data_manager.update('amenities', amenity_id, data)
+        if not data_manager.update('amenities', amenity_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'Amenity not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('amenities', amenity_id)
+        expected = expected_version('amenities', amenity_id)
+        if not data_manager.delete('amenities', amenity_id, expected_version=expected):
+            return make_response(jsonify({'error': 'Amenity not found'}), 404)
         return make_response('', 204)
 
 # Place endpoints
 @app.route('/places', methods=['GET', 'POST'], strict_slashes=False)
 def manage_places():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('places'))
+        return list_collection('places')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -175,31 +356,31 @@ def manage_places():
 
 @app.route('/places/<place_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_place(place_id):
-    place = data_manager.get('places', place_id)
-    if not place:
-        return make_response(jsonify({'error': 'Place not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(place)
+        return get_entity('places', place_id, 'Place not found')
 
     if request.method == 'PUT':
+        expected = expected_version('places', place_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = place_id
         data['updated_at'] = datetime.now().isoformat()
-        data_manager.update('places', place_id, data)
+        if not data_manager.update('places', place_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'Place not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('places', place_id)
+        expected = expected_version('places', place_id)
+        if not data_manager.delete('places', place_id, expected_version=expected):
+            return make_response(jsonify({'error': 'Place not found'}), 404)
         return make_response('', 204)
 
 # Review endpoints
 @app.route('/reviews', methods=['GET', 'POST'], strict_slashes=False)
 def manage_reviews():
     if request.method == 'GET':
-        return jsonify(data_manager.get_all('reviews'))
+        return list_collection('reviews')
 
     if request.method == 'POST':
         data = request.get_json()
@@ -212,43 +393,37 @@ def manage_reviews():
 
 @app.route('/reviews/<review_id>', methods=['GET', 'PUT', 'DELETE'], strict_slashes=False)
 def manage_review(review_id):
-    review = data_manager.get('reviews', review_id)
-    if not review:
-        return make_response(jsonify({'error': 'Review not found'}), 404)
-
     if request.method == 'GET':
-        return jsonify(review)
+        return get_entity('reviews', review_id, 'Review not found')
 
     if request.method == 'PUT':
+        expected = expected_version('reviews', review_id)
         data = request.get_json()
         if not data:
             return make_response(jsonify({'error': 'No data provided'}), 400)
         data['id'] = review_id
         data['updated_at'] = datetime.now().isoformat()
-        data_manager.update('reviews', review_id, data)
+        if not data_manager.update('reviews', review_id, data, expected_version=expected):
+            return make_response(jsonify({'error': 'Review not found'}), 404)
         return jsonify(data)
 
     if request.method == 'DELETE':
-        data_manager.delete('reviews', review_id)
+        expected = expected_version('reviews', review_id)
+        if not data_manager.delete('reviews', review_id, expected_version=expected):
+            return make_response(jsonify({'error': 'Review not found'}), 404)
         return make_response('', 204)
 
 @app.route('/reviews/user/<user_id>', methods=['GET'], strict_slashes=False)
 def get_user_reviews(user_id):
-    reviews = data_manager.get_all('reviews')
-    user_reviews = [review for review in reviews if review['user_id'] == user_id]
-    return jsonify(user_reviews)
+    return find_entities('reviews', user_id=user_id)
 
 @app.route('/reviews/place/<place_id>', methods=['GET'], strict_slashes=False)
 def get_place_reviews(place_id):
-    reviews = data_manager.get_all('reviews')
-    place_reviews = [review for review in reviews if review['place_id'] == place_id]
-    return jsonify(place_reviews)
+    return find_entities('reviews', place_id=place_id)
 
 @app.route('/places/<place_id>/reviews', methods=['GET'], strict_slashes=False)
 def get_reviews_for_place(place_id):
-    reviews = data_manager.get_all('reviews')
-    place_reviews = [review for review in reviews if review['place_id'] == place_id]
-    return jsonify(place_reviews)
+    return find_entities('reviews', place_id=place_id)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
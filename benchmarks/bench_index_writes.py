@@ -0,0 +1,74 @@
+"""Write latency of DataManager before and after its indexes are built.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.bench_index_writes --count 500000
+
+Seeds an in-memory DataManager with --count places, then times saves,
+updates and deletes of places three times: before any index exists, after
+a page request has built the KeyIndex, and after find() calls have built
+every declared index on places (hash postings on a few hot cities and
+hosts included). Each write should cost about the same in all three
+phases, as indexes copy only a chunk of their sorted runs per update.
+"""
+import argparse
+import random
+import time
+import uuid
+from benchmarks.bench_persistence import make_place
+from data_manager import DataManager
+
+PHASES = ('no indexes', 'key index', 'all indexes')
+OPERATIONS = ('save', 'update', 'delete')
+
+
+def seeded_places(count):
+    """Places over 10 cities and 100 hosts, so postings grow long."""
+    cities, hosts = [str(uuid.uuid4()) for _ in range(10)], [str(uuid.uuid4()) for _ in range(100)]
+    for _ in range(count):
+        place = make_place(str(uuid.uuid4()))
+        place['city_id'], place['host_id'] = random.choice(cities), random.choice(hosts)
+        yield place
+
+
+def time_writes(manager, places, ops):
+    """Return {operation: milliseconds per call} over ops saves, updates and deletes."""
+    new_places = list(seeded_places(ops))
+    updates = [dict(place, price_per_night=random.randint(20, 500)) for place in random.sample(places, ops)]
+    timings = {}
+    for operation, call, arguments in (
+            ('save', lambda place: manager.save('places', place['id'], place), new_places),
+            ('update', lambda place: manager.update('places', place['id'], place), updates),
+            ('delete', lambda place: manager.delete('places', place['id']), new_places)):
+        start = time.perf_counter()
+        for argument in arguments:
+            call(argument)
+        timings[operation] = (time.perf_counter() - start) / len(arguments) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=500000, help='places to seed')
+    parser.add_argument('--ops', type=int, default=1000, help='calls per operation and phase')
+    args = parser.parse_args()
+
+    manager = DataManager(None)
+    places = list(seeded_places(args.count))
+    manager.save_many('places', ((place['id'], place) for place in places))
+
+    print(f"{'phase':<14}" + ''.join(f"{operation + ' ms':>12}" for operation in OPERATIONS))
+    for phase in PHASES:
+        if phase == 'key index':
+            manager.get_page('places', 10)
+        elif phase == 'all indexes':
+            place = places[0]
+            manager.find('places', city_id=place['city_id'])
+            manager.find('places', host_id=place['host_id'])
+            manager.find('places', price_per_night__lte=100)
+        timings = time_writes(manager, places, args.ops)
+        print(f"{phase:<14}" + ''.join(f"{timings[operation]:>12.3f}" for operation in OPERATIONS), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Memory benchmark of model records against the dicts the API saves.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.bench_memory --count 1000000
+
+Builds --count places and as many reviews, decoding each from JSON as
+loading a snapshot does, and keeps them first as dicts and then as the
+records of models.RECORD_TYPES. It reports the bytes allocated per entity,
+as measured by tracemalloc, values included: records also share interned
+foreign keys, and store timestamps as ints. Places have --count // 20
+hosts among 1000 cities, reviews are spread over --count // 10 places.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from benchmarks.bench_persistence import make_place
+from models import RECORD_TYPES
+
+
+def ids(count):
+    return [str(uuid.uuid4()) for _ in range(max(1, count))]
+
+
+def make_places(count):
+    hosts, cities = ids(count // 20), ids(1000)
+    for _ in range(count):
+        place = make_place(str(uuid.uuid4()))
+        place['host_id'], place['city_id'] = random.choice(hosts), random.choice(cities)
+        place['created_at'] = place['updated_at'] = '2024-06-14T09:30:12.345678'
+        yield place
+
+
+def make_reviews(count):
+    places, users = ids(count // 10), ids(count // 5)
+    for _ in range(count):
+        yield {
+            'id': str(uuid.uuid4()),
+            'place_id': random.choice(places),
+            'user_id': random.choice(users),
+            'rating': random.randint(1, 5),
+            'comment': 'Great stay',
+            'created_at': '2024-06-14T09:30:12.345678',
+            'updated_at': '2024-06-14T09:30:12.345678',
+        }
+
+
+def measure(build, bodies):
+    """Return the bytes per entity that holding build(body) for every JSON body costs."""
+    gc.collect()
+    tracemalloc.start()
+    built = [build(body) for body in bodies]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Less the list holding them, which is the same size either way.
+    return (allocated - len(built) * 8) / len(bodies)
+
+
+def timed(convert, values):
+    start = time.perf_counter()
+    for value in values:
+        convert(value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000000, help='entities of each type')
+    args = parser.parse_args()
+
+    print(f"{'type':<10}{'dict B':>10}{'record B':>10}{'saved':>8}{'from_dict s':>13}{'to_dict s':>11}")
+    for entity_type, make in (('places', make_places), ('reviews', make_reviews)):
+        record = RECORD_TYPES[entity_type]
+        bodies = [json.dumps(entity) for entity in make(args.count)]
+        dict_bytes = measure(json.loads, bodies)
+        record_bytes = measure(lambda body: record.from_dict(json.loads(body)), bodies)
+        entities = [json.loads(body) for body in bodies]
+        from_seconds = timed(record.from_dict, entities)
+        records = [record.from_dict(entity) for entity in entities]
+        to_seconds = timed(record.to_dict, records)
+        print(f"{entity_type:<10}{dict_bytes:>10.0f}{record_bytes:>10.0f}{1 - record_bytes / dict_bytes:>8.0%}"
+              f"{from_seconds:>13.2f}{to_seconds:>11.2f}", flush=True)
+        del bodies, entities, records
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Micro-benchmarks for every storage engine in engines.ENGINES.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.bench_persistence --sizes 1000 100000 1000000
+
+Each engine is seeded with the given number of places, then every
+operation runs over a random sample until it has done --ops calls or used
+--budget seconds, and the rate is reported in operations per second.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from engines import ENGINES, create_data_manager
+
+OPERATIONS = ('get', 'save', 'update', 'delete', 'get_all')
+
+
+def make_place(place_id):
+    return {
+        'id': place_id,
+        'name': 'Cozy loft',
+        'description': 'A place to stay',
+        'address': '1 Main St',
+        'city_id': str(uuid.uuid4()),
+        'host_id': str(uuid.uuid4()),
+        'latitude': random.uniform(-90, 90),
+        'longitude': random.uniform(-180, 180),
+        'number_of_rooms': random.randint(1, 6),
+        'number_of_bathrooms': random.randint(1, 3),
+        'price_per_night': random.randint(20, 500),
+        'max_guests': random.randint(1, 10),
+        'created_at': '2024-06-14T00:00:00',
+        'updated_at': '2024-06-14T00:00:00',
+    }
+
+
+def timed(operation, arguments, budget):
+    """Call operation for each argument until budget seconds are used; return (calls, seconds)."""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    for argument in arguments:
+        operation(argument)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            break
+    return calls, elapsed
+
+
+def bench_engine(engine, size, ops, budget):
+    """Return {operation: ops/sec} for engine seeded with size places."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = create_data_manager(engine, os.path.join(tmpdir, f"bench.{engine}"))
+        ids = [str(uuid.uuid4()) for _ in range(size)]
+        manager.save_many('places', ((place_id, make_place(place_id)) for place_id in ids))
+        sample = random.sample(ids, min(ops, size))
+        updates = [(place_id, make_place(place_id)) for place_id in sample]
+        new_places = [(place_id, make_place(place_id)) for place_id in (str(uuid.uuid4()) for _ in range(ops))]
+
+        timings = {
+            'get': timed(lambda place_id: manager.get('places', place_id), sample, budget),
+            'save': timed(lambda place: manager.save('places', *place), new_places, budget),
+        }
+        saved = [place_id for place_id, _ in new_places[:timings['save'][0]]]
+        timings['update'] = timed(lambda place: manager.update('places', *place), updates, budget)
+        timings['delete'] = timed(lambda place_id: manager.delete('places', place_id), saved, budget)
+        timings['get_all'] = timed(lambda _: manager.get_all('places'), range(max(1, ops // 100)), budget)
+
+        if hasattr(manager, 'close'):
+            manager.close()
+        elif getattr(manager, 'journal', None):
+            manager.journal.close()
+    return {operation: calls / seconds if seconds else float('inf')
+            for operation, (calls, seconds) in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 100000, 1000000])
+    parser.add_argument('--ops', type=int, default=1000, help='calls per operation')
+    parser.add_argument('--budget', type=float, default=5.0, help='seconds per operation')
+    args = parser.parse_args()
+
+    print(f"{'engine':<10}{'entities':>10}" + ''.join(f"{operation:>12}" for operation in OPERATIONS))
+    for size in args.sizes:
+        for engine in args.engines:
+            rates = bench_engine(engine, size, args.ops, args.budget)
+            print(f"{engine:<10}{size:>10}" + ''.join(f"{rates[operation]:>12.1f}" for operation in OPERATIONS),
+                  flush=True)
+
+
+if __name__ == '__main__':
+    main()
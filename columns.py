@@ -0,0 +1,148 @@
+import math
+import time
+from persistence_manager import LOOKUPS, is_number
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - numpy is optional
+    numpy = None
+
+# Whether ColumnStore can be used; without numpy, DataManager filters and
+# aggregates in Python instead.
+HAVE_NUMPY = numpy is not None
+
+# Rows a vectorized scan gets through in about the time find() takes to
+# fetch and filter one candidate entity in Python.
+ROWS_PER_CANDIDATE = 256
+
+# dead_at of a row no version has deleted.
+_ALIVE = 2 ** 63 - 1
+
+
+def _number(value):
+    if not is_number(value):
+        return math.nan
+    try:
+        return float(value)
+    except OverflowError:
+        return math.nan
+
+
+class ColumnStore:
+    """Numeric fields of one collection as NumPy columns, for vectorized filters and aggregates.
+
+    Every row holds the values of one version of an entity, row_ids names
+    its entity and rows maps the id of every live entity to its row. Rows
+    are only ever appended: a write marks the entity's old row dead as of
+    the store's next version, in dead_at, and appends a new one. A reader
+    holding an older version reads its own number of rows and takes rows
+    dead after its version as alive, so, as with indexes, a shallow copy
+    is a frozen version. Only writers use rows. Once dead rows outnumber
+    live ones, the columns are rebuilt from the live rows alone.
+
+    Values that are not numbers, or missing, are NaN, which no comparison
+    matches, as find() skips them. Values are float64, so ints beyond 2**53
+    compare approximately.
+    """
+
+    def __init__(self, fields):
+        if numpy is None:
+            raise RuntimeError('ColumnStore needs numpy, which is not installed')
+        self.fields = tuple(fields)
+        self.built = False
+        self.build_seconds = None
+        self._load([], {field: [] for field in self.fields})
+
+    def build(self, entities):
+        """(Re)build the columns from an {entity_id: entity_data} mapping."""
+        started_at = time.perf_counter()
+        row_ids, values = [], {field: [] for field in self.fields}
+        for entity_id, entity_data in entities.items():
+            row_ids.append(entity_id)
+            for field in self.fields:
+                values[field].append(_number(entity_data.get(field)))
+        self._load(row_ids, values)
+        self.built = True
+        self.build_seconds = time.perf_counter() - started_at
+
+    def update(self, entity_id, old_data, new_data):
+        """Reflect a mutation; None for old_data/new_data means absent/deleted."""
+        if old_data is not None and new_data is not None and all(
+                old_data.get(field) == new_data.get(field) for field in self.fields):
+            return
+        version = self.version + 1
+        row = self.rows.pop(entity_id, None)
+        if row is not None:
+            self.dead_at[row] = version
+        if new_data is not None:
+            if self.size == len(self.dead_at):
+                self._grow(max(16, 2 * self.size))
+            row = self.size
+            for field in self.fields:
+                self.columns[field][row] = _number(new_data.get(field))
+            self.dead_at[row] = _ALIVE
+            self.row_ids.append(entity_id)
+            self.rows[entity_id] = row
+            self.size = row + 1
+        self.version = version
+        if self.size - len(self.rows) > max(len(self.rows), 1024):
+            self._compact()
+
+    def select(self, conditions):
+        """The ids of the live entities matching every (field, lookup, value) condition, in row order."""
+        rows = numpy.flatnonzero(self._mask(conditions)).tolist()
+        row_ids = self.row_ids
+        return [row_ids[row] for row in rows]
+
+    def aggregate(self, field, function, conditions):
+        """Aggregate field over the live entities matching conditions (see IPersistenceManager.aggregate)."""
+        values = self.columns[field][:self.size][self._mask(conditions)]
+        values = values[~numpy.isnan(values)]
+        if function == 'count':
+            return int(values.size)
+        if function == 'sum':
+            return float(values.sum())
+        if not values.size:
+            return None
+        return float({'mean': numpy.mean, 'min': numpy.min, 'max': numpy.max}[function](values))
+
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values()) + self.dead_at.nbytes
+
+    def stats(self):
+        return {
+            'kind': 'columns',
+            'built': self.built,
+            'build_seconds': self.build_seconds,
+            'keys': len(self.rows),
+            'bytes': self.nbytes(),
+        }
+
+    def _mask(self, conditions):
+        mask = self.dead_at[:self.size] > self.version
+        for field, lookup, value in conditions:
+            mask &= LOOKUPS[lookup](self.columns[field][:self.size], value)
+        return mask
+
+    def _load(self, row_ids, values):
+        self.columns = {field: numpy.array(values[field], dtype=numpy.float64) for field in self.fields}
+        self.dead_at = numpy.full(len(row_ids), _ALIVE, dtype=numpy.int64)
+        self.row_ids = row_ids
+        self.rows = {entity_id: row for row, entity_id in enumerate(row_ids)}
+        self.size = len(row_ids)
+        self.version = 0
+
+    def _grow(self, capacity):
+        """Move to arrays of capacity rows; older versions keep the arrays they have."""
+        columns = {}
+        for field, column in self.columns.items():
+            columns[field] = numpy.empty(capacity, dtype=numpy.float64)
+            columns[field][:self.size] = column[:self.size]
+        dead_at = numpy.empty(capacity, dtype=numpy.int64)
+        dead_at[:self.size] = self.dead_at[:self.size]
+        self.columns, self.dead_at = columns, dead_at
+
+    def _compact(self):
+        live = sorted(self.rows.values())
+        self._load([self.row_ids[row] for row in live],
+                   {field: self.columns[field][live] for field in self.fields})
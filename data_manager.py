@@ -1,54 +1,904 @@
-import json
 import os
-from persistence_manager import IPersistenceManager
+import threading
+import time
+import uuid
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from copy import copy
+from itertools import count, groupby
+from operator import itemgetter
+from columns import HAVE_NUMPY, ROWS_PER_CANDIDATE, ColumnStore
+from file_lock import FileLock
+from indexes import DEFAULT_INDEXES, INDEX_KINDS, KeyIndex
+from journal import Journal
+from models import RECORD_TYPES
+from json_cache import JSONCache, encode_json
+from persistence_manager import (AGGREGATES, IPersistenceManager, Version, VersionConflictError, is_number,
+                                 matches, parse_criteria)
+from persistent import LayeredMap, PersistentMap
+from region import Region, collection_json, write_region
+from snapshot import BackgroundSaver, iter_snapshot, read_snapshot, write_snapshot
+from tiered import TieredMap, TieredStore
+
+# One published version of a collection: its entities, frozen copies of its
+# built indexes by field, and its frozen KeyIndex and ColumnStore (or None
+# until needed).
+Collection = namedtuple('Collection', ['entities', 'indexes', 'keys', 'columns'])
+
+EMPTY_COLLECTION = Collection(PersistentMap(), {}, None, None)
+
+# Snapshot identity of a shared manager that has not loaded anything yet.
+_UNLOADED = object()
+
+STORAGE_FORMATS = ('json', 'region')
+
+
+def _as_dict(entity):
+    """An entity as callers get it: a record becomes a new dict, a dict is returned as is."""
+    return entity if entity is None or type(entity) is dict else entity.to_dict()
+
+
+class StorageView:
+    """A read-only view of every collection as it was at one moment.
+
+    Taking a view copies one reference. Reads through it take no lock and
+    never see a write made after it was taken, so several reads in a row
+    (or a long export) agree with each other. It is also a context manager,
+    to match IPersistenceManager.snapshot().
+
+    A collection still on disk when the view was taken is loaded when the
+    view first reads it, and seen as it is then.
+
+    Indexes, KeyIndexes and ColumnStores a reader needs that were not built
+    when the view was taken are built once per view and reused.
+    """
+
+    def __init__(self, manager, collections, unloaded=frozenset()):
+        self._manager = manager
+        self._collections = collections
+        self._unloaded = unloaded
+        # {key: (entities, structure)}, structures built for this view.
+        self._built = {}
+
+    def _collection(self, entity_type):
+        collection = self._collections.get(entity_type)
+        if collection is None and entity_type in self._unloaded:
+            collection = self._manager._collection(entity_type)
+        return collection or EMPTY_COLLECTION
+
+    def _frozen(self, key, entities, build, *args):
+        """Return build(*args, entities), built once for this version of entities."""
+        built = self._built.get(key)
+        if built is None or built[0] is not entities:
+            built = self._built[key] = (entities, build(*args, entities))
+        return built[1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def get(self, entity_type, entity_id):
+        return _as_dict(self._collection(entity_type).entities.get(entity_id))
+
+    def get_all(self, entity_type):
+        return [_as_dict(entity) for entity in self._collection(entity_type).entities.values()]
+
+    def find(self, entity_type, **criteria):
+        """Retrieve all entities matching the given criteria.
+
+        Takes the same criteria as IPersistenceManager.find. Of the indexes
+        that can answer a criterion, the one expecting the fewest candidates
+        is used and only those candidates are filtered; without one the
+        collection is scanned. Hash index results come in id order, sorted
+        index results in value order.
+
+        With numpy, numeric criteria on a collection's COLUMNS can instead
+        be filtered in one vectorized pass over the columns, which is used
+        when it costs less than the best index; its results come in the
+        order entities were last written.
+        """
+        conditions = parse_criteria(criteria)
+        collection = self._collection(entity_type)
+        entities = collection.entities
+        best = None
+        for field, lookup, value in conditions:
+            index = collection.indexes.get(field)
+            if index is None:
+                index = self._frozen(
+                    ('index', entity_type, field), entities, self._manager._frozen_index, entity_type, field)
+            estimate = index.estimate(lookup, value) if index else None
+            if estimate is not None and (best is None or estimate < best[0]):
+                best = (estimate, index, lookup, value)
+        column_conditions = self._manager._column_conditions(entity_type, conditions)
+        if column_conditions and len(entities) >= ROWS_PER_CANDIDATE and (
+                best is None or best[0] > len(entities) // ROWS_PER_CANDIDATE):
+            store = collection.columns or self._frozen(
+                ('columns', entity_type), entities, self._manager._frozen_columns, entity_type)
+            return self._filter(entities, store.select(column_conditions), conditions)
+        if best is None:
+            return [_as_dict(entity) for entity in entities.values() if matches(entity, conditions)]
+        _, index, lookup, value = best
+        return self._filter(entities, index.lookup(lookup, value), conditions)
+
+    @staticmethod
+    def _filter(entities, entity_ids, conditions):
+        """The entities named by entity_ids that match conditions; ids no longer present are skipped."""
+        candidates = (entities.get(entity_id) for entity_id in entity_ids)
+        return [_as_dict(entity) for entity in candidates if entity is not None and matches(entity, conditions)]
+
+    def aggregate(self, entity_type, field, function, **criteria):
+        """Aggregate a field over the entities matching criteria (see IPersistenceManager.aggregate).
+
+        With numpy, when field is one of the collection's COLUMNS and every
+        criterion compares one with a number, it is computed over the
+        columns without reading an entity; otherwise over find() in Python.
+        """
+        if function not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {function!r}")
+        conditions = parse_criteria(criteria)
+        column_conditions = self._manager._column_conditions(entity_type, conditions)
+        if field in self._manager.COLUMNS.get(entity_type, ()) and HAVE_NUMPY and (
+                len(column_conditions) == len(conditions)):
+            collection = self._collection(entity_type)
+            store = collection.columns or self._frozen(
+                ('columns', entity_type), collection.entities, self._manager._frozen_columns, entity_type)
+            return store.aggregate(field, function, column_conditions)
+        return IPersistenceManager.aggregate(self, entity_type, field, function, **criteria)
+
+    def get_page(self, entity_type, limit, after=None):
+        """Retrieve up to limit entities ordered by id (see IPersistenceManager.get_page).
+
+        Ids are kept sorted per collection from the first page request on, so
+        each page is a binary search plus a slice.
+        """
+        collection = self._collection(entity_type)
+        keys = collection.keys or self._frozen(
+            ('keys', entity_type), collection.entities, self._manager._frozen_keys, entity_type)
+        entity_ids, more = keys.page(after, limit)
+        return [_as_dict(collection.entities[entity_id]) for entity_id in entity_ids], entity_ids[-1] if more else None
+
+    # Paging through a view is exactly what the interface's default does.
+    iter_all = IPersistenceManager.iter_all
+
 
 class DataManager(IPersistenceManager):
-    def __init__(self, storage_file):
+    # Secondary indexes as {entity_type: {field: kind}}, kind being one of
+    # indexes.INDEX_KINDS. They are built the first time they are needed.
+    INDEXES = DEFAULT_INDEXES
+    # Record type (see models.base) stored for each entity type; other
+    # types are stored as the dicts they are saved as.
+    RECORDS = RECORD_TYPES
+    # Numeric fields kept as NumPy columns (see ColumnStore) for
+    # vectorized find() and aggregate(), built the first time they are
+    # needed. Without numpy they are not kept.
+    COLUMNS = {
+        'places': ('price_per_night', 'latitude', 'longitude', 'number_of_rooms', 'number_of_bathrooms',
+                   'max_guests'),
+    }
+
+    def __init__(self, storage_file, journal_file=None, compact_min_records=1000,
+                 background_snapshots=False, durability='batch', group_window=0.0, flush_interval=0.1,
+                 json_cache_bytes=64 * 1024 * 1024, shared=False, sync_interval=0.1, mapped=False,
+                 storage_format='json', split=False, memory_budget=None):
+        """Create a manager backed by a JSON snapshot file, or held in memory if storage_file is None.
+
+        journal_file appends every write to a journal, folded back into the
+        snapshot once it outgrows it and holds compact_min_records; durability,
+        group_window and flush_interval pick how it is fsynced (see Journal).
+        background_snapshots writes snapshots with bgsave(), shared lets
+        several processes use the same files, mapped and storage_format
+        'region' map snapshots instead of reading them, split keeps a file per
+        collection, and memory_budget tiers entities (see tiered.py). The
+        README's Storage Engines section describes each mode. json_cache_bytes
+        caps the LRU of serialized JSON behind get_json() and get_all_json().
+        """
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format: {storage_format}")
+        if split and shared:
+            raise ValueError('split storage does not work in shared mode')
+        if shared and (storage_file is None or not journal_file or background_snapshots):
+            raise ValueError('shared mode needs a storage_file and a journal_file, without background_snapshots')
+        if mapped and not shared:
+            raise ValueError('mapped storage needs shared mode')
+        if memory_budget is not None and (storage_file is None or mapped or storage_format != 'json'):
+            raise ValueError('tiered storage needs a storage_file with JSON snapshots, not mapped')
         self.storage_file = storage_file
-        self.storage = self.load_storage()
+        self.shared = shared
+        self.storage_format = storage_format
+        self.split = split and storage_file is not None
+        self.mapped = mapped or storage_format == 'region'
+        self.region_file = None
+        if storage_format == 'region':
+            self.region_file = storage_file
+        elif mapped:
+            self.region_file = f"{storage_file}.region"
+        self.sync_interval = sync_interval
+        self.journal = None
+        if journal_file:
+            self.journal = Journal(journal_file, durability=durability, group_window=group_window,
+                                   flush_interval=flush_interval, shared=shared)
+        self.compact_min_records = compact_min_records
+        self.background_snapshots = background_snapshots
+        self.tiers = None
+        if memory_budget is not None:
+            self.tiers = TieredStore(f"{storage_file}.cold", memory_budget)
+        # A forked child could find the tiered store's lock taken for good.
+        self.snapshots = BackgroundSaver(on_complete=self._bgsave_done, use_fork=self.tiers is None,
+                                         write=self._write_storage)
+        self._snapshot_pending = False
+        self._saving = None
+        self._persist_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.json_cache = JSONCache(json_cache_bytes)
+        self._collections = {}
+        self._unloaded = frozenset()
+        self._dirty = set()
+        if shared:
+            if self._collection_files():
+                raise ValueError('split storage files are left; start once without shared mode to merge them')
+            self._snapshot_identity = _UNLOADED
+            self._file_lock = FileLock(f"{journal_file}.lock", on_acquire=self._sync)
+            with self._file_lock:
+                pass
+            self._closed = threading.Event()
+            self._follower = threading.Thread(target=self._follow, daemon=True)
+            self._follower.start()
+        elif self.split:
+            self._load({}, uuid.uuid4().hex[:8], time.time())
+            if os.path.isfile(self.storage_file):
+                self._split_storage_file()
+            self._unloaded = frozenset(self._collection_files())
+            if self.journal:
+                for entity_type, entity_id, entity_data in self.journal.replay():
+                    self._apply(entity_type, entity_id, entity_data)
+        else:
+            entity_types = storage_file and self._collection_files()
+            if entity_types:
+                self._merge_collection_files(entity_types)
+            self._load(self._read_collections(), uuid.uuid4().hex[:8], time.time())
+            if self.journal:
+                for entity_type, entity_id, entity_data in self.journal.replay():
+                    self._apply(entity_type, entity_id, entity_data)
+
+    @property
+    def storage(self):
+        """Every loaded collection as {entity_type: {entity_id: entity_data}}, frozen as of this call."""
+        return {entity_type: collection.entities for entity_type, collection in self._collections.items()}
+
+    def snapshot(self):
+        """Return a StorageView of the current version of every collection."""
+        return StorageView(self, self._collections, self._unloaded)
 
     def save(self, entity_type, entity_id, entity_data):
         """Save an entity to the storage."""
-        if entity_type not in self.storage:
-            self.storage[entity_type] = {}
-        self.storage[entity_type][entity_id] = entity_data
-        self.save_storage()
+        with self._lock(entity_type):
+            self._check(entity_type, entity_id, entity_data)
+            seq = self._record(entity_type, entity_id, entity_data)
+        self._persist(seq)
+
+    def save_many(self, entity_type, entities):
+        """Save (entity_id, entity_data) pairs with a single snapshot or journal commit.
+
+        If one of them breaks a unique index, the ones before it are kept.
+        """
+        seq = None
+        try:
+            for entity_id, entity_data in entities:
+                with self._lock(entity_type):
+                    self._check(entity_type, entity_id, entity_data)
+                    seq = self._record(entity_type, entity_id, entity_data)
+        finally:
+            self._persist(seq)
 
     def get(self, entity_type, entity_id):
         """Retrieve an entity by ID from the storage."""
-        return self.storage.get(entity_type, {}).get(entity_id)
+        return _as_dict(self._collection(entity_type).entities.get(entity_id))
 
-    def update(self, entity_type, entity_id, entity_data):
-        """Update an entity in the storage."""
-        if entity_type in self.storage and entity_id in self.storage[entity_type]:
-            self.storage[entity_type][entity_id] = entity_data
-            self.save_storage()
-            return True
-        return False
+    def update(self, entity_type, entity_id, entity_data, expected_version=None):
+        """Update an entity in the storage (see IPersistenceManager.update)."""
+        with self._lock(entity_type):
+            if entity_id not in self._collection(entity_type).entities:
+                return False
+            self._check_version(entity_type, entity_id, expected_version)
+            self._check(entity_type, entity_id, entity_data)
+            seq = self._record(entity_type, entity_id, entity_data)
+        self._persist(seq)
+        return True
 
-    def delete(self, entity_type, entity_id):
-        """Delete an entity from the storage."""
-        if entity_type in self.storage and entity_id in self.storage[entity_type]:
-            del self.storage[entity_type][entity_id]
-            self.save_storage()
-            return True
-        return False
+    def delete(self, entity_type, entity_id, expected_version=None):
+        """Delete an entity from the storage (see IPersistenceManager.delete)."""
+        with self._lock(entity_type):
+            if entity_id not in self._collection(entity_type).entities:
+                return False
+            self._check_version(entity_type, entity_id, expected_version)
+            seq = self._record(entity_type, entity_id, None)
+        self._persist(seq)
+        return True
 
     def get_all(self, entity_type):
         """Retrieve all entities of a specific type from the storage."""
-        return list(self.storage.get(entity_type, {}).values())
+        return self.snapshot().get_all(entity_type)
+
+    def get_json(self, entity_type, entity_id):
+        """Retrieve an entity as serialized JSON bytes, from the cache when possible.
+
+        Mapped entities unchanged since the last snapshot are sent straight
+        from the region file, without decoding or caching them.
+        """
+        entities = self._collection(entity_type).entities
+        if isinstance(entities, LayeredMap):
+            body = entities.get_json(entity_id)
+            if body is not None:
+                return body
+        if entity_id not in entities:
+            return None
+        return self.json_cache.get_or_build(
+            (entity_type, entity_id), lambda: self._encode_entity(entity_type, entity_id))
+
+    def get_all_json(self, entity_type):
+        """Retrieve a whole collection as one JSON array, rebuilt only after it changes."""
+        return self.json_cache.get_or_build((entity_type, None), lambda: self._encode_collection(entity_type))
+
+    def get_version(self, entity_type, entity_id=None):
+        """Return the Version of an entity or collection (see IPersistenceManager.get_version).
+
+        Entities and collections untouched since startup share version 0 and
+        the load time. Counts start over in every process, so tags carry a
+        random epoch; in shared mode the epoch comes from the snapshot file,
+        so every process hands out the same tags.
+        """
+        if entity_id is None:
+            version, modified_at = self._collection_versions.get(entity_type, (0, self.loaded_at))
+        elif entity_id not in self._collection(entity_type).entities:
+            return None
+        else:
+            version, modified_at = self._entity_versions.get(entity_type, {}).get(
+                entity_id, (0, self.loaded_at))
+        return Version(f"{self.epoch}-{version}", modified_at)
+
+    def find(self, entity_type, **criteria):
+        """Retrieve all entities matching the given criteria (see StorageView.find)."""
+        return self.snapshot().find(entity_type, **criteria)
+
+    def aggregate(self, entity_type, field, function, **criteria):
+        """Aggregate a field over the entities matching criteria (see StorageView.aggregate)."""
+        return self.snapshot().aggregate(entity_type, field, function, **criteria)
+
+    def get_page(self, entity_type, limit, after=None):
+        """Retrieve up to limit entities ordered by id (see StorageView.get_page)."""
+        return self.snapshot().get_page(entity_type, limit, after)
+
+    def index_stats(self):
+        """Kind, build time (seconds), key count and approximate bytes of every index and column store."""
+        stats = {f"{entity_type}.{field}": index.stats()
+                 for entity_type, fields in self.indexes.items() for field, index in fields.items()}
+        stats.update((f"{entity_type}.columns", store.stats()) for entity_type, store in self.column_stores.items())
+        return stats
+
+    def checkpoint(self):
+        """Fold the journal into a fresh snapshot and empty it."""
+        if self.shared:
+            with self._file_lock, self._snapshot_lock():
+                self._checkpoint()
+        else:
+            with self._snapshot_lock():
+                self._checkpoint()
+
+    def bgsave(self):
+        """Start a snapshot in the background; returns False if one is already running.
+
+        A request made while a snapshot is running is remembered and started
+        as soon as the current one finishes. Without a journal, a write made
+        with background_snapshots is only on disk once the next one completes.
+        """
+        with self._persist_lock:
+            return self._start_bgsave()
+
+    def wait_bgsave(self):
+        """Block until background snapshots have finished."""
+        self.snapshots.wait()
+
+    def close(self):
+        """Stop following other processes, and flush and close the files."""
+        if self.shared:
+            self._closed.set()
+            self._follower.join()
+            self._file_lock.close()
+        if self.journal:
+            self.journal.close()
+        if self.tiers:
+            self.tiers.close()
+
+    @property
+    def tier_stats(self):
+        """Budget, resident bytes and entities, cold entities, evictions and faults of tiered storage."""
+        return self.tiers.stats if self.tiers else None
+
+    @property
+    def snapshot_stats(self):
+        """Counters and timings (seconds) of background snapshots."""
+        return self.snapshots.stats
 
     def save_storage(self):
         """Save the storage to the file."""
-        with open(self.storage_file, 'w') as f:
-            json.dump(self.storage, f, indent=4)
+        if self.storage_file is not None:
+            with self._snapshot_lock():
+                self._write_storage(self.storage_file, self.storage)
 
     def load_storage(self):
-        """Load the storage from the file."""
-        if os.path.exists(self.storage_file):
-            with open(self.storage_file, 'r') as f:
-                return json.load(f)
-        return {}
-
-# Initialize DataManager instance
-data_manager = DataManager('data/storage.json')
\ No newline at end of file
+        """Load the storage from the file; a region file is mapped rather than read."""
+        if self.storage_file is None or not os.path.exists(self.storage_file):
+            return {}
+        if self.storage_format == 'region':
+            return Region(self.storage_file).collections
+        return read_snapshot(self.storage_file)
+
+    def _write_storage(self, path, storage):
+        if self.split:
+            for entity_type, entities in storage.items():
+                self._write_collection_file(entity_type, entities)
+        elif self.storage_format == 'region':
+            write_region(path, storage)
+        else:
+            write_snapshot(path, storage)
+
+    def _collection_file(self, entity_type):
+        root, extension = os.path.splitext(self.storage_file)
+        return f"{root}.{entity_type}{extension}"
+
+    def _collection_files(self):
+        """The entity types that have a snapshot file of their own."""
+        root, extension = os.path.splitext(self.storage_file)
+        directory, prefix = os.path.split(root)
+        prefix += '.'
+        journal = self.journal and os.path.basename(self.journal.journal_file)
+        names = (name[len(prefix):-len(extension) or None] for name in os.listdir(directory or '.')
+                 if name.startswith(prefix) and name.endswith(extension) and name != journal)
+        return [name for name in names if name and '.' not in name]
+
+    def _write_collection_file(self, entity_type, entities):
+        path = self._collection_file(entity_type)
+        if self.storage_format == 'region':
+            write_region(path, {entity_type: entities})
+        else:
+            write_snapshot(path, entities, nested=False)
+
+    def _read_collection_file(self, entity_type):
+        """Read one collection's snapshot file, mapped or into memory."""
+        path = self._collection_file(entity_type)
+        if not os.path.exists(path):
+            return self._entities(entity_type)
+        if self.storage_format == 'region':
+            return LayeredMap(Region(path).collections[entity_type])
+        return self._entities(entity_type, iter_snapshot(path, nested=False))
+
+    def _split_storage_file(self):
+        """Split a single snapshot file, left from before split storage, into one per collection."""
+        storage = self.load_storage()
+        for entity_type, entities in storage.items():
+            self._write_collection_file(entity_type, entities)
+        os.remove(self.storage_file)
+
+    def _merge_collection_files(self, entity_types):
+        """Merge the snapshot files left by split storage back into a single one.
+
+        A single file found beside them was already written from them, by a
+        split or a merge that did not finish, so only the leftovers go.
+        """
+        paths = [self._collection_file(entity_type) for entity_type in entity_types]
+        if not os.path.isfile(self.storage_file):
+            if self.storage_format == 'region':
+                storage = {entity_type: Region(path).collections[entity_type]
+                           for entity_type, path in zip(entity_types, paths)}
+            else:
+                storage = {entity_type: read_snapshot(path) for entity_type, path in zip(entity_types, paths)}
+            self._write_storage(self.storage_file, storage)
+        for path in paths:
+            os.remove(path)
+
+    def _collection(self, entity_type):
+        """Return the current version of a collection, loading it on first use."""
+        collection = self._collections.get(entity_type)
+        if collection is None:
+            if entity_type not in self._unloaded:
+                return EMPTY_COLLECTION
+            # Not the collection's lock, which writers already hold when
+            # they first touch it.
+            with self._load_lock:
+                collection = self._collections.get(entity_type)
+                if collection is None:
+                    collection = Collection(self._read_collection_file(entity_type), {}, None, None)
+                    self._publish(entity_type, collection)
+                    self._unloaded = self._unloaded - {entity_type}
+        return collection
+
+    def _read_collections(self, epoch=None):
+        """The snapshot's collections as {entity_type: entities}, mapped or in memory."""
+        if self.storage_format == 'region':
+            return {entity_type: LayeredMap(entities) for entity_type, entities in self.load_storage().items()}
+        if self.mapped and os.path.exists(self.storage_file):
+            return self._map_region(epoch)
+        if self.storage_file is None or not os.path.exists(self.storage_file):
+            return {}
+        # Entities are read and stored one at a time, each collection in turn.
+        return {entity_type: self._entities(entity_type, (item[1:] for item in items))
+                for entity_type, items in groupby(iter_snapshot(self.storage_file), key=itemgetter(0))}
+
+    def _entities(self, entity_type, items=()):
+        """A new map of a collection's entities as records, tiered when there is a memory budget."""
+        record = self.RECORDS.get(entity_type)
+        if record is not None:
+            items = ((entity_id, record.from_dict(entity_data)) for entity_id, entity_data in items)
+        if self.tiers:
+            return TieredMap(self.tiers, items, decode=record and record.from_dict)
+        return PersistentMap(items)
+
+    def _remap(self, storage):
+        """Move collections unchanged since storage was written to a region file onto its mapping.
+
+        Their writes were folded into the file, so the new mapping holds them
+        without the memory of their changes. Collections written meanwhile
+        keep their version until the next snapshot.
+        """
+        if self.split:
+            mapped = {entity_type: Region(self._collection_file(entity_type)).collections[entity_type]
+                      for entity_type in storage}
+        else:
+            mapped = Region(self.storage_file).collections
+        with self._publish_lock:
+            collections = dict(self._collections)
+            for entity_type, entities in mapped.items():
+                collection = collections.get(entity_type)
+                if collection is not None and collection.entities is storage.get(entity_type):
+                    collections[entity_type] = collection._replace(entities=LayeredMap(entities))
+            self._collections = collections
+
+    def _load(self, collections, epoch, loaded_at):
+        """Replace every collection, with collections as {entity_type: entities}.
+
+        Indexes start over unbuilt and the version counters start over from
+        epoch. The collections are published before the versions change, so
+        a version is never newer than the data a reader finds after it.
+        """
+        self.indexes = {entity_type: {field: INDEX_KINDS[kind](field) for field, kind in fields.items()}
+                        for entity_type, fields in self.INDEXES.items()}
+        self.key_indexes = {}
+        self.column_stores = {}
+        with self._publish_lock:
+            self._collections = {entity_type: Collection(entities, {}, None, None)
+                                 for entity_type, entities in collections.items()}
+        self.json_cache.clear()
+        self._reset_versions(epoch, loaded_at)
+
+    def _map_region(self, epoch):
+        """Map the region file of the JSON snapshot named by epoch, writing it first if missing, stale or damaged."""
+        try:
+            region = Region(self.region_file)
+        except (OSError, ValueError):
+            region = None
+        if region is None or region.epoch != epoch:
+            write_region(self.region_file, self.load_storage(), epoch)
+            region = Region(self.region_file)
+        return {entity_type: LayeredMap(entities) for entity_type, entities in region.collections.items()}
+
+    def _reset_versions(self, epoch, loaded_at):
+        self._counters = {}
+        self._collection_versions = {}
+        self._entity_versions = {}
+        self.epoch = epoch
+        self.loaded_at = loaded_at
+
+    def _snapshot_stamp(self):
+        """Identify the snapshot file as (epoch, modification time), alike in every process."""
+        try:
+            stat = os.stat(self.storage_file)
+        except FileNotFoundError:
+            return '0', 0.0
+        identity = f"{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}".encode()
+        return f"{zlib.crc32(identity):08x}", stat.st_mtime
+
+    def _sync(self):
+        """Catch up with the writes of other processes; runs whenever the file lock is taken."""
+        stamp = self._snapshot_stamp()
+        if stamp != self._snapshot_identity:
+            self._snapshot_identity = stamp
+            self.journal.rewind()
+            self._load(self._read_collections(stamp[0]), *stamp)
+        for entity_type, entity_id, entity_data, modified_at in self.journal.tail():
+            self._apply(entity_type, entity_id, entity_data, modified_at)
+
+    def _follow(self):
+        """Runs on a thread, taking the file lock to catch up whenever the files change.
+
+        Other processes' writes are thus picked up within sync_interval
+        seconds; a snapshot one of them wrote is reloaded in full.
+        """
+        while not self._closed.wait(self.sync_interval):
+            try:
+                if self.journal.pending() or self._snapshot_stamp() != self._snapshot_identity:
+                    with self._file_lock:
+                        pass
+            except (OSError, ValueError):
+                # Writers hit and report the same error; keep following.
+                continue
+
+    def _apply(self, entity_type, entity_id, entity_data, modified_at=None):
+        """Build and publish the collection's next version with a mutation applied; None deletes."""
+        collection = self._collection(entity_type)
+        entities = collection.entities if collection is not EMPTY_COLLECTION else self._entities(entity_type)
+        old_data = entities.get(entity_id)
+        if entity_data is None:
+            if old_data is None:
+                return
+            entities = entities.delete(entity_id)
+        else:
+            record = self.RECORDS.get(entity_type)
+            entities = entities.set(entity_id, record.from_dict(entity_data) if record else entity_data)
+        indexes = {}
+        for field, index in self.indexes.get(entity_type, {}).items():
+            if index.built:
+                index.update(entity_id, old_data, entity_data)
+                indexes[field] = copy(index)
+        keys = None
+        key_index = self.key_indexes.get(entity_type)
+        if key_index is not None:
+            key_index.update(entity_id, old_data, entity_data)
+            keys = copy(key_index)
+        store = self.column_stores.get(entity_type)
+        if store is not None:
+            store.update(entity_id, old_data, entity_data)
+            store = copy(store)
+        self._publish(entity_type, Collection(entities, indexes, keys, store))
+        if self.split:
+            # After publishing, so a snapshot that clears the mark has the write.
+            self._dirty.add(entity_type)
+        self.json_cache.invalidate(entity_type, entity_id)
+        self._bump_version(entity_type, entity_id, entity_data is None, modified_at)
+
+    def _publish(self, entity_type, collection):
+        """Make collection the current version; the root dict is replaced, never changed."""
+        with self._publish_lock:
+            collections = dict(self._collections)
+            collections[entity_type] = collection
+            self._collections = collections
+
+    def _bump_version(self, entity_type, entity_id, deleted, modified_at=None):
+        """Record a write after it is applied, so a version never runs ahead of the data."""
+        counter = self._counters.get(entity_type) or self._counters.setdefault(entity_type, count(1))
+        stamp = (next(counter), modified_at or time.time())
+        self._collection_versions[entity_type] = stamp
+        versions = self._entity_versions.setdefault(entity_type, {})
+        if deleted:
+            versions.pop(entity_id, None)
+        else:
+            versions[entity_id] = stamp
+
+    def _encode_collection(self, entity_type):
+        entities = self._collection(entity_type).entities
+        if isinstance(entities, LayeredMap):
+            return collection_json(entities)
+        # Records are serialized through their to_dict() by encode_json.
+        return encode_json(entities.values())
+
+    def _encode_entity(self, entity_type, entity_id):
+        entity = self.get(entity_type, entity_id)
+        return None if entity is None else encode_json(entity)
+
+    def _check(self, entity_type, entity_id, entity_data):
+        """Raise DuplicateKeyError if entity_data would break a unique index."""
+        for field, index in self.indexes.get(entity_type, {}).items():
+            if index.constraint:
+                self._built_index(entity_type, field).check(entity_id, entity_data)
+
+    def _check_version(self, entity_type, entity_id, expected_version):
+        if expected_version is not None and self.get_version(entity_type, entity_id).tag != expected_version:
+            raise VersionConflictError(entity_type, entity_id)
+
+    def _lock(self, entity_type):
+        """Return the write lock of a collection, creating it on first use.
+
+        In shared mode every collection uses the file lock, as all processes
+        append to one journal.
+        """
+        if self.shared:
+            return self._file_lock
+        lock = self._locks.get(entity_type)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(entity_type, threading.Lock())
+        return lock
+
+    def _record(self, entity_type, entity_id, entity_data):
+        """Apply a mutation and append it to the journal, returning its sequence number.
+
+        Called with the collection's lock held, so the journal lists the
+        writes to an entity in the order they were applied.
+        """
+        # Shared journals carry the time, so all processes agree on versions.
+        modified_at = time.time() if self.shared else None
+        self._apply(entity_type, entity_id, entity_data, modified_at)
+        if self.journal and self.storage_file is not None:
+            with self._persist_lock:
+                return self.journal.append(entity_type, entity_id, entity_data, modified_at)
+        return None
+
+    def _built_index(self, entity_type, field):
+        """Return the live index on entity_type.field, building it on first use, or None.
+
+        Called with the collection's lock held. A newly built index is
+        published with the current version of the collection.
+        """
+        index = self.indexes.get(entity_type, {}).get(field)
+        if index is not None and not index.built:
+            collection = self._collection(entity_type)
+            index.build(collection.entities)
+            if collection is not EMPTY_COLLECTION:
+                self._publish(entity_type, collection._replace(
+                    indexes={**collection.indexes, field: copy(index)}))
+        return index
+
+    def _frozen_index(self, entity_type, field, entities):
+        """Return an index on field matching the version entities belongs to, or None.
+
+        Builds the live index if needed. Should the collection have moved on
+        since the reader's version, that version gets a private index instead.
+        """
+        if field not in self.indexes.get(entity_type, {}):
+            return None
+        with self._lock(entity_type):
+            index = self._built_index(entity_type, field)
+            collection = self._collection(entity_type)
+            if collection.entities is entities:
+                return copy(index)
+        index = INDEX_KINDS[self.INDEXES[entity_type][field]](field)
+        index.build(entities)
+        return index
+
+    def _frozen_keys(self, entity_type, entities):
+        """Return a KeyIndex matching the version entities belongs to, like _frozen_index."""
+        with self._lock(entity_type):
+            collection = self._collection(entity_type)
+            if collection is not EMPTY_COLLECTION and collection.entities is entities:
+                if collection.keys is None:
+                    key_index = self.key_indexes[entity_type] = KeyIndex()
+                    key_index.build(entities)
+                    collection = collection._replace(keys=copy(key_index))
+                    self._publish(entity_type, collection)
+                return collection.keys
+        key_index = KeyIndex()
+        key_index.build(entities)
+        return key_index
+
+    def _column_conditions(self, entity_type, conditions):
+        """The conditions a ColumnStore can answer: numbers compared with a column. Empty without numpy."""
+        fields = self.COLUMNS.get(entity_type, ()) if HAVE_NUMPY else ()
+        return [(field, lookup, value) for field, lookup, value in conditions
+                if field in fields and is_number(value)]
+
+    def _frozen_columns(self, entity_type, entities):
+        """Return a ColumnStore matching the version entities belongs to, like _frozen_keys."""
+        with self._lock(entity_type):
+            collection = self._collection(entity_type)
+            if collection is not EMPTY_COLLECTION and collection.entities is entities:
+                if collection.columns is None:
+                    store = self.column_stores[entity_type] = ColumnStore(self.COLUMNS[entity_type])
+                    store.build(entities)
+                    collection = collection._replace(columns=copy(store))
+                    self._publish(entity_type, collection)
+                return collection.columns
+        store = ColumnStore(self.COLUMNS[entity_type])
+        store.build(entities)
+        return store
+
+    def _persist(self, seq):
+        """Make recorded mutations durable, up to journal record seq or with a full snapshot."""
+        if self.storage_file is None:
+            return
+        if self.background_snapshots:
+            with self._persist_lock:
+                if self._compact_due():
+                    self._start_bgsave()
+        elif not self.shared:
+            with self._snapshot_lock():
+                if self._compact_due():
+                    self._checkpoint()
+        elif self._compact_due():
+            # The file lock comes first, and another process may have
+            # compacted the journal by the time it is ours.
+            with self._file_lock, self._snapshot_lock():
+                if self._compact_due():
+                    self._checkpoint()
+        if seq is not None:
+            # Outside every lock, so concurrent writers can share one fsync.
+            self.journal.commit(seq)
+
+    @contextmanager
+    def _snapshot_lock(self):
+        """Hold _persist_lock once no background snapshot is running.
+
+        A snapshot written meanwhile would otherwise be replaced by the
+        older background one when that one finished.
+        """
+        while True:
+            self.snapshots.wait()
+            self._persist_lock.acquire()
+            if self.snapshots.idle:
+                break
+            self._persist_lock.release()
+        try:
+            yield
+        finally:
+            self._persist_lock.release()
+
+    def _compact_due(self):
+        if not self.journal:
+            return True
+        entity_count = sum(len(collection.entities) for collection in self._collections.values())
+        return self.journal.records >= max(self.compact_min_records, entity_count)
+
+    def _storage_to_save(self):
+        """The collections a snapshot must write: all of them, or those written since the last one when split."""
+        if not self.split:
+            return self.storage
+        storage = {}
+        while self._dirty:
+            # pop() rather than a copy, as writers may add to the set meanwhile.
+            entity_type = self._dirty.pop()
+            storage[entity_type] = self._collections[entity_type].entities
+        return storage
+
+    def _checkpoint(self):
+        # Every journaled write was published before it was appended, so
+        # the version taken here under _persist_lock holds all of them.
+        storage = self._storage_to_save()
+        try:
+            self._write_storage(self.storage_file, storage)
+        except BaseException:
+            # The journal still holds these writes; keep them marked so the
+            # next snapshot writes them before it empties the journal.
+            if self.split:
+                self._dirty.update(storage)
+            raise
+        if self.journal:
+            self.journal.truncate()
+        if self.shared:
+            # Other processes reload the new snapshot and start their
+            # versions over from it; do the same, reloading only to map it.
+            stamp = self._snapshot_identity = self._snapshot_stamp()
+            if self.mapped:
+                if self.storage_format == 'json':
+                    write_region(self.region_file, storage, stamp[0])
+                self._load(self._read_collections(stamp[0]), *stamp)
+            else:
+                self._reset_versions(*stamp)
+        elif self.storage_format == 'region':
+            self._remap(storage)
+
+    def _start_bgsave(self):
+        if not self.snapshots.idle:
+            self._snapshot_pending = True
+            return False
+        self._snapshot_pending = False
+        if self.journal:
+            self.journal.rotate()
+        self._saving = self._storage_to_save()
+        return self.snapshots.start(self.storage_file, self._saving)
+
+    def _bgsave_done(self, ok):
+        """Runs on the snapshot watcher thread once a background snapshot ends."""
+        with self._persist_lock:
+            if ok and self.journal:
+                self.journal.discard_rotated()
+            if ok and self.storage_format == 'region':
+                self._remap(self._saving)
+            elif not ok and self.split:
+                self._dirty.update(self._saving)
+            self._saving = None
+            if self._snapshot_pending:
+                self._start_bgsave()
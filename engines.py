@@ -0,0 +1,65 @@
+import inspect
+from data_manager import DataManager
+from sqlite_manager import SQLiteManager
+
+
+def _json_engine(path, **options):
+    return DataManager(path, **options)
+
+
+def _journal_engine(path, **options):
+    return DataManager(path, journal_file=f"{path}.journal", **options)
+
+
+def _shared_engine(path, **options):
+    return DataManager(path, journal_file=f"{path}.journal", shared=True, mapped=True, **options)
+
+
+def _sqlite_engine(path, **options):
+    _reject_options('sqlite', options)
+    return SQLiteManager(path)
+
+
+def _memory_engine(path, **options):
+    _reject_options('memory', options)
+    return DataManager(None)
+
+
+def _reject_options(engine, options):
+    """Raise ValueError for DataManager options engine cannot honour; their defaults are let through."""
+    parameters = inspect.signature(DataManager).parameters
+    unsupported = sorted(name for name, value in options.items()
+                         if name not in parameters or value != parameters[name].default)
+    if unsupported:
+        raise ValueError(f"The {engine} engine does not support: {', '.join(unsupported)}")
+
+
+# Every IPersistenceManager the app can run on; the conformance tests and
+# benchmarks iterate over this too.
+ENGINES = {
+    'json': _json_engine,
+    'journal': _journal_engine,
+    'shared': _shared_engine,
+    'sqlite': _sqlite_engine,
+    'memory': _memory_engine,
+}
+
+DEFAULT_PATHS = {
+    'json': 'data/storage.json',
+    'journal': 'data/storage.json',
+    'shared': 'data/storage.json',
+    'sqlite': 'data/storage.db',
+    'memory': None,
+}
+
+
+def create_data_manager(engine='json', path=None, **options):
+    """Build the storage engine named by engine.
+
+    path defaults to the engine's file under data/. Extra options, such as
+    durability, are passed to the DataManager-based engines; the sqlite and
+    memory engines raise ValueError for any not left at its default.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    return ENGINES[engine](path or DEFAULT_PATHS[engine], **options)
@@ -0,0 +1,54 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+
+class FileLock:
+    """A lock shared by the threads of this process and every process using the same path.
+
+    Threads are serialized by a threading.Lock and processes by flock() on
+    path, which the kernel releases should the holder die. on_acquire, if
+    given, is called every time the lock is taken, with the lock held, for
+    instance to catch up with what other processes wrote meanwhile.
+    """
+
+    def __init__(self, path, on_acquire=None):
+        if fcntl is None:
+            raise RuntimeError('FileLock needs fcntl, which this platform lacks')
+        self.path = path
+        self.on_acquire = on_acquire
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if self.on_acquire is not None:
+                    self.on_acquire()
+            except BaseException:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+        return False
+
+    def close(self):
+        """Close the lock file; the next acquisition reopens it."""
+        with self._thread_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
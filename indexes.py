@@ -0,0 +1,269 @@
+import sys
+import time
+from bisect import bisect_left
+from persistence_manager import DuplicateKeyError, is_number
+from persistent import CHUNK_SIZE, PersistentMap, PersistentSortedList
+
+
+class _Bound:
+    """Sorts before (LOW) or after (HIGH) every entity id in a sorted-index key."""
+
+    def __init__(self, high):
+        self.high = high
+
+    def __lt__(self, other):
+        return not self.high
+
+    def __gt__(self, other):
+        return self.high
+
+
+LOW, HIGH = _Bound(False), _Bound(True)
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+# Indexes never change a container in place: update() replaces it with a
+# new one sharing what it can. A shallow copy of an index is therefore a
+# frozen version of it, which is what DataManager hands to readers. Sorted
+# runs of keys are PersistentSortedLists, so an update copies one chunk of
+# them rather than all of them.
+
+
+def _add_id(ids, entity_id):
+    """Postings with entity_id added: a sorted tuple while short, a PersistentSortedList beyond CHUNK_SIZE."""
+    if type(ids) is tuple:
+        if len(ids) < CHUNK_SIZE:
+            position = bisect_left(ids, entity_id)
+            return ids[:position] + (entity_id,) + ids[position:]
+        ids = PersistentSortedList(ids)
+    return ids.add(entity_id)
+
+
+def _remove_id(ids, entity_id):
+    """Postings without entity_id, or ids itself if it is not there."""
+    if type(ids) is not tuple:
+        return ids.remove(entity_id)
+    position = bisect_left(ids, entity_id)
+    if position < len(ids) and ids[position] == entity_id:
+        return ids[:position] + ids[position + 1:]
+    return ids
+
+
+def _postings(ids):
+    ids.sort()
+    return tuple(ids) if len(ids) <= CHUNK_SIZE else PersistentSortedList(ids)
+
+
+class HashIndex:
+    """Maps each value of a field to the ids of the entities holding it.
+
+    Ids are kept sorted, so lookups return entities in id order, which does
+    not depend on the order of writes or on when the index was built.
+    """
+
+    kind = 'hash'
+    lookups = ('eq',)
+    constraint = False
+
+    def __init__(self, field):
+        self.field = field
+        self.built = False
+        self.build_seconds = None
+        self.postings = PersistentMap()
+
+    def build(self, entities):
+        """(Re)build the index from an {entity_id: entity_data} mapping."""
+        started_at = time.perf_counter()
+        postings = {}
+        for entity_id, entity_data in entities.items():
+            value = entity_data.get(self.field)
+            if _hashable(value):
+                postings.setdefault(value, []).append(entity_id)
+        self.postings = PersistentMap((value, _postings(ids)) for value, ids in postings.items())
+        self.built = True
+        self.build_seconds = time.perf_counter() - started_at
+
+    def update(self, entity_id, old_data, new_data):
+        """Reflect a mutation; None for old_data/new_data means absent/deleted."""
+        old_value = None if old_data is None else old_data.get(self.field)
+        new_value = None if new_data is None else new_data.get(self.field)
+        if old_data is not None and new_data is not None and old_value == new_value:
+            return
+        if old_data is not None:
+            self._remove(entity_id, old_value)
+        if new_data is not None:
+            self._add(entity_id, new_value)
+
+    def check(self, entity_id, entity_data):
+        """Raise if storing entity_data under entity_id would violate the index."""
+
+    def estimate(self, op, value):
+        """Number of ids lookup() would return, or None if it cannot serve op."""
+        if op not in self.lookups or not _hashable(value):
+            return None
+        return len(self.postings.get(value, ()))
+
+    def lookup(self, op, value):
+        return self.postings.get(value, ())
+
+    def nbytes(self):
+        """Approximate size of the index containers, not counting the ids and values."""
+        return self.postings.nbytes() + sum(sys.getsizeof(ids) if type(ids) is tuple else ids.nbytes()
+                                            for ids in self.postings.values())
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'built': self.built,
+            'build_seconds': self.build_seconds,
+            'keys': len(self.postings),
+            'bytes': self.nbytes(),
+        }
+
+    def _add(self, entity_id, value):
+        if _hashable(value):
+            self.postings = self.postings.set(value, _add_id(self.postings.get(value, ()), entity_id))
+
+    def _remove(self, entity_id, value):
+        if not _hashable(value):
+            return
+        ids = self.postings.get(value)
+        if ids is not None:
+            ids = _remove_id(ids, entity_id)
+            self.postings = self.postings.set(value, ids) if ids else self.postings.delete(value)
+
+
+class UniqueIndex(HashIndex):
+    """A hash index that rejects a second entity with the same non-null value."""
+
+    kind = 'unique'
+    constraint = True
+
+    def check(self, entity_id, entity_data):
+        value = entity_data.get(self.field)
+        if value is None or not _hashable(value):
+            return
+        if any(other_id != entity_id for other_id in self.postings.get(value, ())):
+            raise DuplicateKeyError(self.field, value)
+
+
+class SortedIndex:
+    """Keeps (value, entity_id) pairs sorted by value for equality and range lookups.
+
+    Only numbers are indexed, and only lookups of a number are served.
+    Other values, and NaN, which compares false with everything and would
+    break the order, are left out, as find() would not match them against
+    a number either.
+    """
+
+    kind = 'sorted'
+    lookups = ('eq', 'lt', 'lte', 'gt', 'gte')
+    constraint = False
+
+    def __init__(self, field):
+        self.field = field
+        self.built = False
+        self.build_seconds = None
+        self.keys = PersistentSortedList()
+
+    def build(self, entities):
+        started_at = time.perf_counter()
+        self.keys = PersistentSortedList((entity_data.get(self.field), entity_id)
+                                         for entity_id, entity_data in entities.items()
+                                         if is_number(entity_data.get(self.field)))
+        self.built = True
+        self.build_seconds = time.perf_counter() - started_at
+
+    def update(self, entity_id, old_data, new_data):
+        old_value = None if old_data is None else old_data.get(self.field)
+        new_value = None if new_data is None else new_data.get(self.field)
+        if old_data is not None and new_data is not None and old_value == new_value:
+            return
+        keys = self.keys
+        if old_data is not None and is_number(old_value):
+            keys = keys.remove((old_value, entity_id))
+        if new_data is not None and is_number(new_value):
+            keys = keys.add((new_value, entity_id))
+        self.keys = keys
+
+    def check(self, entity_id, entity_data):
+        pass
+
+    def estimate(self, op, value):
+        if op not in self.lookups or not is_number(value):
+            return None
+        start, stop = self._range(op, value)
+        return stop - start
+
+    def lookup(self, op, value):
+        start, stop = self._range(op, value)
+        return [entity_id for _, entity_id in self.keys[start:stop]]
+
+    def nbytes(self):
+        return self.keys.nbytes() + len(self.keys) * sys.getsizeof((None, None))
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'built': self.built,
+            'build_seconds': self.build_seconds,
+            'keys': len(self.keys),
+            'bytes': self.nbytes(),
+        }
+
+    def _range(self, op, value):
+        keys = self.keys
+        if op == 'eq':
+            return keys.bisect_left((value, LOW)), keys.bisect_right((value, HIGH))
+        if op == 'lt':
+            return 0, keys.bisect_left((value, LOW))
+        if op == 'lte':
+            return 0, keys.bisect_right((value, HIGH))
+        if op == 'gt':
+            return keys.bisect_right((value, HIGH)), len(keys)
+        return keys.bisect_left((value, LOW)), len(keys)
+
+
+class KeyIndex:
+    """The entity ids of one collection in sorted order, for keyset pagination."""
+
+    def __init__(self):
+        self.built = False
+        self.keys = PersistentSortedList()
+
+    def build(self, entities):
+        self.keys = PersistentSortedList(entities)
+        self.built = True
+
+    def update(self, entity_id, old_data, new_data):
+        if old_data is None and new_data is not None:
+            self.keys = self.keys.add(entity_id)
+        elif old_data is not None and new_data is None:
+            self.keys = self.keys.remove(entity_id)
+
+    def page(self, after, limit):
+        """Return up to limit ids greater than after, and whether more follow."""
+        start = 0 if after is None else self.keys.bisect_right(after)
+        return self.keys[start:start + limit], start + limit < len(self.keys)
+
+
+INDEX_KINDS = {
+    'hash': HashIndex,
+    'unique': UniqueIndex,
+    'sorted': SortedIndex,
+}
+
+# Indexes declared per entity type as {field: kind}. Every engine builds these.
+DEFAULT_INDEXES = {
+    'users': {'email': 'unique'},
+    'cities': {'country_code': 'hash'},
+    'places': {'city_id': 'hash', 'host_id': 'hash', 'price_per_night': 'sorted'},
+    'reviews': {'place_id': 'hash', 'user_id': 'hash'},
+}
@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+import time
+
+DURABILITY_MODES = ('always', 'batch', 'interval')
+
+
+class Journal:
+    """Append-only log of storage mutations, one JSON record per line.
+
+    Writers append() under their own lock and then commit() outside it, which
+    is where durability is paid for:
+
+    - 'always': every commit takes its turn to write what is queued and
+      fsync, even when another commit's fsync already covered its record.
+    - 'batch': group commit. One committer becomes the leader and writes and
+      fsyncs everything appended so far; commits that arrive meanwhile wait
+      and are covered by the leader's sync or form the next group. An
+      optional group_window lets the leader wait for more followers.
+    - 'interval': commits return at once and a background thread writes and
+      fsyncs every flush_interval seconds.
+
+    A shared journal is written by several processes, each holding a file
+    lock around its appends. append() then writes the record to the file at
+    once, so the file lists writes in the order they were made, and commit()
+    only pays for the fsync. tail() reads what the other processes appended.
+    """
+
+    def __init__(self, journal_file, durability='batch', group_window=0.0, flush_interval=0.1,
+                 shared=False):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.journal_file = journal_file
+        self.rotated_file = f"{journal_file}.1"
+        self.durability = durability
+        self.group_window = group_window
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.records = 0
+        self.syncs = 0
+        self._file = None
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._appended = 0
+        self._durable = 0
+        self._flushing = False
+        self._flusher = None
+        self._offset = 0
+
+    def append(self, entity_type, entity_id, entity_data, timestamp=None):
+        """Queue a mutation and return its sequence number for commit().
+
+        entity_data of None records a delete. A timestamp is stored with the
+        record and returned by tail().
+        """
+        if entity_data is None:
+            record = {'op': 'del', 'type': entity_type, 'id': entity_id}
+        else:
+            record = {'op': 'put', 'type': entity_type, 'id': entity_id, 'data': entity_data}
+        if timestamp is not None:
+            record['ts'] = timestamp
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        with self._cond:
+            if self.shared:
+                if self._file is None:
+                    self._file = open(self.journal_file, 'ab')
+                self._file.write(line)
+                self._file.flush()
+                self._offset += len(line)
+            else:
+                self._buffer.append(line)
+            self._appended += 1
+            self.records += 1
+            return self._appended
+
+    def commit(self, seq):
+        """Return once record seq is as durable as the durability mode promises."""
+        if self.durability == 'interval':
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+            return
+        if self.durability == 'always':
+            self._sync_own()
+            return
+        self._sync(seq, self.group_window)
+
+    def flush(self):
+        """Write and fsync everything appended so far."""
+        with self._cond:
+            seq = self._appended
+        self._sync(seq, 0.0)
+
+    def _sync(self, seq, delay):
+        with self._cond:
+            while self._durable < seq:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                self._cond.release()
+                try:
+                    if delay:
+                        time.sleep(delay)
+                    self._write_batch()
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def _sync_own(self):
+        """Write and fsync as the only writer, whatever earlier syncs covered."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._flushing = True
+        try:
+            self._write_batch(force=True)
+        finally:
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+
+    def _write_batch(self, force=False):
+        """Write the queued records; only ever run by the current leader."""
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+            upto = self._appended
+        if upto > self._durable or force:
+            if self._file is None:
+                self._file = open(self.journal_file, 'ab')
+            self._file.write(b''.join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+        with self._cond:
+            self._durable = upto
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def replay(self):
+        """Yield (entity_type, entity_id, entity_data) for every logged mutation.
+
+        Records set aside by rotate() come first. A torn record at the end of
+        a file (a crash mid-append) is dropped and truncated away so later
+        appends start on a clean line.
+        """
+        for path in (self.rotated_file, self.journal_file):
+            yield from self._replay_file(path)
+
+    def tail(self):
+        """Return (entity_type, entity_id, entity_data, timestamp) for records not yet seen.
+
+        For shared journals, with the file lock held: these are the records
+        other processes appended since the last tail(). A torn record at the
+        end, left by a process that died mid-append, is truncated away.
+        """
+        if not os.path.exists(self.journal_file):
+            self._offset = 0
+            return []
+        with open(self.journal_file, 'rb') as f:
+            f.seek(self._offset)
+            lines = f.read().splitlines(keepends=True)
+        records = []
+        for number, line in enumerate(lines, 1):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('incomplete record')
+                record = json.loads(line)
+            except ValueError:
+                if number < len(lines):
+                    raise ValueError(f"Corrupt record in {self.journal_file} at offset {self._offset}")
+                with open(self.journal_file, 'r+b') as f:
+                    f.truncate(self._offset)
+                break
+            self._offset += len(line)
+            self.records += 1
+            records.append((record['type'], record['id'], record.get('data'), record.get('ts')))
+        return records
+
+    def pending(self):
+        """Whether the file has changed since this journal last read or wrote it."""
+        try:
+            return os.path.getsize(self.journal_file) != self._offset
+        except FileNotFoundError:
+            return self._offset != 0
+
+    def rewind(self):
+        """Make the next tail() start from the beginning of the file."""
+        self._offset = 0
+        self.records = 0
+
+    def rotate(self):
+        """Set the current records aside and start a fresh journal.
+
+        Used while a background snapshot is being written: the rotated records
+        stay replayable until discard_rotated() confirms the snapshot landed.
+        If an earlier rotation was never discarded, the current records are
+        appended to it so nothing is lost.
+        """
+        self.close()
+        if not os.path.exists(self.journal_file):
+            return
+        if os.path.exists(self.rotated_file):
+            with open(self.rotated_file, 'ab') as dst, open(self.journal_file, 'rb') as src:
+                dst.write(src.read())
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, self.rotated_file)
+        self.records = 0
+
+    def discard_rotated(self):
+        """Drop the records set aside by rotate()."""
+        if os.path.exists(self.rotated_file):
+            os.remove(self.rotated_file)
+
+    def _replay_file(self, path):
+        if not os.path.exists(path):
+            return
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete record')
+                    record = json.loads(line)
+                except ValueError:
+                    if f.read(1):
+                        raise ValueError(f"Corrupt record in {path} at offset {valid_size}")
+                    break
+                valid_size += len(line)
+                self.records += 1
+                yield record['type'], record['id'], record.get('data')
+        if valid_size != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def truncate(self):
+        """Discard all records, typically after they were folded into a snapshot."""
+        self.close()
+        with open(self.journal_file, 'wb'):
+            pass
+        self.discard_rotated()
+        self.rewind()
+
+    def close(self):
+        """Flush pending records and close the file; later appends reopen it."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,74 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+def _to_dict(value):
+    # Model records (see models.base) are sent as their to_dict().
+    to_dict = getattr(value, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def encode_json(value):
+    """Serialize value the way API responses are sent: compact JSON plus a newline."""
+    return json.dumps(value, separators=(',', ':'), default=_to_dict).encode() + b'\n'
+
+
+class JSONCache:
+    """LRU cache of serialized JSON bodies, capped at max_bytes of payload.
+
+    Keys are (entity_type, entity_id) for single entities and
+    (entity_type, None) for a whole collection. A body built while any key
+    was being invalidated is returned but not stored, so a concurrent write
+    can never leave a stale body behind.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0, 'entries': 0}
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """Return the cached body for key, or store and return build()'s body."""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return body
+            self.stats['misses'] += 1
+            generation = self._generation
+        body = build()
+        if body is None or len(body) > self.max_bytes:
+            return body
+        with self._lock:
+            if generation == self._generation and key not in self._entries:
+                self._entries[key] = body
+                self.stats['bytes'] += len(body)
+                while self.stats['bytes'] > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.stats['bytes'] -= len(evicted)
+                    self.stats['evictions'] += 1
+                self.stats['entries'] = len(self._entries)
+        return body
+
+    def invalidate(self, entity_type, entity_id):
+        """Forget an entity's body and its collection's body."""
+        with self._lock:
+            self._generation += 1
+            for key in ((entity_type, entity_id), (entity_type, None)):
+                body = self._entries.pop(key, None)
+                if body is not None:
+                    self.stats['bytes'] -= len(body)
+            self.stats['entries'] = len(self._entries)
+
+    def clear(self):
+        """Forget every body."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.stats['bytes'] = self.stats['entries'] = 0
@@ -1,6 +1,17 @@
+from .base import BaseModel
 from .user import User
 from .place import Place
 from .review import Review
 from .amenity import Amenity
 from .city import City
 from .country import Country
+
+# The record type stored for each entity type of the API.
+RECORD_TYPES = {
+    'users': User,
+    'places': Place,
+    'reviews': Review,
+    'amenities': Amenity,
+    'cities': City,
+    'countries': Country,
+}
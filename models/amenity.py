@@ -3,6 +3,9 @@ from models.base import BaseModel
 
 
 class Amenity(BaseModel):
+    FIELDS = ('name',)
+    __slots__ = FIELDS
+
     def __init__(self, name):
         super().__init__()
-        self.name = name
\ No newline at end of file
+        self.name = name
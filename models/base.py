@@ -1,13 +1,167 @@
 #!/usr/bin/python3
+import sys
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+# Value of a field the record was built without; to_dict() leaves it out.
+MISSING = _Missing()
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def micros(moment):
+    """A naive datetime as an int of microseconds since the epoch."""
+    seconds = (moment.toordinal() - EPOCH_ORDINAL) * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
+    return seconds * 1000000 + moment.microsecond
+
+
+def to_micros(value):
+    """Return a stored timestamp field: micros() of a naive ISO timestamp as isoformat() writes it.
+
+    Other strings and values are kept as they are, except ints, which
+    would read back as timestamps; for those MISSING is returned, and
+    from_dict() keeps the int with the extra keys instead.
+    """
+    if type(value) is int:
+        return MISSING
+    if type(value) is not str:
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    # Only what isoformat() writes back: YYYY-MM-DDTHH:MM:SS, with
+    # .ffffff when there are microseconds.
+    if (moment.tzinfo is None and len(value) == (26 if moment.microsecond else 19) and value[10] == 'T'
+            and value[4] == value[7] == '-' and value[13] == value[16] == ':' and value[19:20] in ('', '.')):
+        return micros(moment)
+    return value
+
+
+def from_micros(value):
+    """Undo to_micros(): an int becomes its ISO timestamp again."""
+    return (EPOCH + ONE_MICROSECOND * value).isoformat() if type(value) is int else value
+
+
+def intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _compile(name, source, namespace):
+    exec(source, namespace)
+    return namespace[name]
+
+
+def _inherited(cls, name):
+    """The names a class attribute such as FIELDS lists in cls and its bases, bases first."""
+    return tuple(dict.fromkeys(field for base in reversed(cls.__mro__) for field in base.__dict__.get(name, ())))
+
+
+def _compile_codecs(cls):
+    """Give a record class to_dict() and from_dict() methods for its FIELDS."""
+    fields = cls.FIELDS = _inherited(cls, 'FIELDS')
+    interned, timestamps = _inherited(cls, 'INTERNED'), _inherited(cls, 'TIMESTAMPS')
+    cls._field_set = frozenset(fields)
+    cls._timestamp_set = frozenset(timestamps)
+    namespace = {'MISSING': MISSING, 'new': object.__new__, 'fields': cls._field_set,
+                 'intern': intern, 'to_micros': to_micros, 'from_micros': from_micros}
+    lines = ['def to_dict(self):', '    data = {}']
+    for field in fields:
+        value = f"from_micros(self.{field})" if field in timestamps else f"self.{field}"
+        lines.append(f"    if self.{field} is not MISSING: data[{field!r}] = {value}")
+    lines += ['    if self._extra: data.update(self._extra)', '    return data']
+    to_dict = _compile('to_dict', '\n'.join(lines), namespace)
+    to_dict.__doc__ = 'The stored fields and extra keys as a new dict, with timestamps as ISO strings.'
+    lines = ['def from_dict(cls, data):', '    self = new(cls)', '    get = data.get']
+    for field in fields:
+        value = f"get({field!r}, MISSING)"
+        if field in interned:
+            value = f"intern({value})"
+        elif field in timestamps:
+            value = f"to_micros({value})"
+        lines.append(f"    self.{field} = {value}")
+    lines += ['    self._extra = None if fields.issuperset(data) else '
+              '{key: value for key, value in data.items() if key not in fields}']
+    for field in timestamps:
+        lines += [f"    if self.{field} is MISSING and {field!r} in data:",
+                  f"        self._extra = {{**(self._extra or {{}}), {field!r}: data[{field!r}]}}"]
+    lines.append('    return self')
+    from_dict = _compile('from_dict', '\n'.join(lines), namespace)
+    from_dict.__doc__ = 'Build a record from a dict such as to_dict() returns.'
+    cls.to_dict = to_dict
+    cls.from_dict = classmethod(from_dict)
 
 
 class BaseModel:
+    """Base of the model records, which keep their attributes in __slots__.
+
+    FIELDS names the attributes that are stored, a subclass's own after
+    those of its bases. Every subclass gets a to_dict() and a from_dict()
+    compiled for its fields, as namedtuple does, so converting a record is
+    a run of attribute loads and stores. Keys outside FIELDS are kept in a
+    dict of their own, so any dict survives a round trip unchanged.
+
+    Values of the fields in INTERNED, foreign keys that many records
+    repeat, are interned so the records share one string. Fields in
+    TIMESTAMPS hold naive ISO timestamps, such as datetime.isoformat()
+    returns, as ints of microseconds since the epoch (see to_micros()):
+    an int sorts and compares faster than the string and takes less than
+    half its memory. to_dict() and get() turn them back into the same ISO
+    strings.
+    """
+
+    __slots__ = ('id', 'created_at', 'updated_at', '_extra')
+    FIELDS = ('id', 'created_at', 'updated_at')
+    TIMESTAMPS = ('created_at', 'updated_at')
+
     def __init__(self):
         self.id = str(uuid.uuid4())
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
+        self.created_at = self.updated_at = micros(datetime.now())
+        self._extra = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _compile_codecs(cls)
+
+    def get(self, field, default=None):
+        """A field's value like dict.get, so indexes and find() read records as they read dicts."""
+        if field in self._field_set:
+            value = getattr(self, field)
+            if value is not MISSING:
+                return from_micros(value) if field in self._timestamp_set else value
+        return self._extra.get(field, default) if self._extra else default
+
+    def __getitem__(self, field):
+        value = self.get(field, MISSING)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if isinstance(other, BaseModel):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
 
     def save(self):
-        self.updated_at = datetime.now()
\ No newline at end of file
+        self.updated_at = micros(datetime.now())
+
+
+_compile_codecs(BaseModel)
@@ -1,10 +1,15 @@
-import uuid
-from datetime import datetime
+#!/usr/bin/python3
+from models.base import BaseModel
+
+
+class City(BaseModel):
+    FIELDS = ('name', 'country_code')
+    INTERNED = ('country_code',)
+    # country links the in-memory objects and is not stored.
+    __slots__ = FIELDS + ('country',)
 
-class City:
     def __init__(self, name, country):
-        self.id = str(uuid.uuid4())
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
+        super().__init__()
         self.name = name
         self.country = country
+        self.country_code = country.code
@@ -1,7 +1,12 @@
 #!/usr/bin/python3
-import uuid
+from models.base import BaseModel
 
-class Country:
-    def __init__(self, name):
-        self.id = str(uuid.uuid4())
+
+class Country(BaseModel):
+    FIELDS = ('name', 'code')
+    __slots__ = FIELDS
+
+    def __init__(self, name, code=None):
+        super().__init__()
         self.name = name
+        self.code = code
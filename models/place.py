@@ -1,22 +1,30 @@
-import uuid
-from datetime import datetime
+#!/usr/bin/python3
+from models.base import BaseModel
 
-class Place:
-    def __init__(self, name, host, description="", address="", city=None, latitude=0.0, longitude=0.0, 
+
+class Place(BaseModel):
+    FIELDS = ('name', 'description', 'address', 'city_id', 'latitude', 'longitude', 'host_id',
+              'number_of_rooms', 'number_of_bathrooms', 'price_per_night', 'max_guests', 'amenity_ids')
+    INTERNED = ('city_id', 'host_id')
+    # host, city, amenities and reviews link the in-memory objects and are not stored.
+    __slots__ = FIELDS + ('host', 'city', 'amenities', 'reviews')
+
+    def __init__(self, name, host, description="", address="", city=None, latitude=0.0, longitude=0.0,
                  number_of_rooms=0, bathrooms=0, price_per_night=0.0, max_guests=0, amenities=None, reviews=None):
-        self.id = str(uuid.uuid4())
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
+        super().__init__()
         self.name = name
         self.description = description
         self.address = address
         self.city = city
+        self.city_id = city.id if city is not None else None
         self.latitude = latitude
         self.longitude = longitude
         self.host = host
+        self.host_id = host.id
         self.number_of_rooms = number_of_rooms
-        self.bathrooms = bathrooms
+        self.number_of_bathrooms = bathrooms
         self.price_per_night = price_per_night
         self.max_guests = max_guests
         self.amenities = amenities or []
+        self.amenity_ids = [amenity.id for amenity in self.amenities]
         self.reviews = reviews or []
@@ -1,12 +1,18 @@
-import uuid
-from datetime import datetime
+#!/usr/bin/python3
+from models.base import BaseModel
+
+
+class Review(BaseModel):
+    FIELDS = ('place_id', 'user_id', 'rating', 'comment')
+    INTERNED = ('place_id', 'user_id')
+    # user and place link the in-memory objects and are not stored.
+    __slots__ = FIELDS + ('user', 'place')
 
-class Review:
     def __init__(self, user, place, rating, comment=""):
-        self.id = str(uuid.uuid4())
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
+        super().__init__()
         self.user = user
         self.place = place
+        self.user_id = user.id
+        self.place_id = place.id
         self.rating = rating
-        self.comment = comment
\ No newline at end of file
+        self.comment = comment
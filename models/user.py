@@ -1,16 +1,15 @@
-import uuid
+#!/usr/bin/python3
+from models.base import BaseModel
 
-class User:
-    _existing_emails = set()
 
-    def __init__(self, email, password):
-        if email in User._existing_emails:
-            raise ValueError("Email already exists")
-        User._existing_emails.add(email)
+class User(BaseModel):
+    # Email uniqueness is enforced by the unique users.email index in storage.
+    FIELDS = ('email', 'first_name', 'last_name', 'password')
+    __slots__ = FIELDS
+
+    def __init__(self, email, password, first_name=None, last_name=None):
+        super().__init__()
         self.email = email
         self.password = password
-        self.id = str(uuid.uuid4())
-
-    @classmethod
-    def clear_existing_emails(cls):
-        cls._existing_emails.clear()
+        self.first_name = first_name
+        self.last_name = last_name
@@ -1,18 +1,186 @@
+import operator
 from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from json_cache import encode_json
+
+LOOKUPS = {
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'mean')
+
+# What get_version() returns: tag is an opaque string that changes on every
+# write, modified_at the time of the last write in seconds since the epoch.
+Version = namedtuple('Version', ['tag', 'modified_at'])
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when a write would break a unique index."""
+
+    def __init__(self, field, value=None):
+        super().__init__(f"{field} already exists" if value is None else f"{field} already exists: {value}")
+        self.field = field
+        self.value = value
+
+
+class VersionConflictError(ValueError):
+    """Raised when a conditional write finds the entity at another version than expected."""
+
+    def __init__(self, entity_type, entity_id):
+        super().__init__(f"{entity_type} {entity_id} has been modified since it was read")
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+
+
+def parse_criteria(criteria):
+    """Turn find() keywords such as price_per_night__lte=100 into (field, lookup, value)."""
+    conditions = []
+    for key, value in criteria.items():
+        field, _, lookup = key.partition('__')
+        lookup = lookup or 'eq'
+        if lookup not in LOOKUPS:
+            raise ValueError(f"Unknown lookup in {key!r}")
+        conditions.append((field, lookup, value))
+    return conditions
+
+
+def matches(entity, conditions):
+    """Whether entity satisfies every (field, lookup, value) condition."""
+    for field, lookup, value in conditions:
+        try:
+            if not LOOKUPS[lookup](entity.get(field), value):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def is_number(value):
+    """Whether aggregate() counts value as a number: an int or float other than NaN."""
+    return isinstance(value, (int, float)) and value == value
+
+
+def aggregate_values(values, function):
+    """Apply one of AGGREGATES to a list of numbers; min, max and mean of none are None."""
+    if function == 'count':
+        return len(values)
+    if function == 'sum':
+        return sum(values)
+    if not values:
+        return None
+    if function == 'mean':
+        return sum(values) / len(values)
+    return min(values) if function == 'min' else max(values)
+
 
 class IPersistenceManager(ABC):
     @abstractmethod
-    def save(self, entity):
+    def save(self, entity_type, entity_id, entity_data):
         pass
 
     @abstractmethod
-    def get(self, entity_id, entity_type):
+    def get(self, entity_type, entity_id):
         pass
 
     @abstractmethod
-    def update(self, entity):
-        pass
+    def update(self, entity_type, entity_id, entity_data, expected_version=None):
+        """Replace an existing entity; returns False if there is none.
+
+        With expected_version, a tag from get_version(), the entity is only
+        replaced if it is still at that version, and VersionConflictError is
+        raised otherwise. The check and the write happen atomically.
+        """
+
+    @abstractmethod
+    def delete(self, entity_type, entity_id, expected_version=None):
+        """Delete an entity; returns False if there is none. expected_version is as for update()."""
 
     @abstractmethod
-    def delete(self, entity_id, entity_type):
-        pass
\ No newline at end of file
+    def get_all(self, entity_type):
+        pass
+
+    def get_json(self, entity_type, entity_id):
+        """Retrieve an entity as serialized JSON bytes, or None if it does not exist."""
+        entity = self.get(entity_type, entity_id)
+        return None if entity is None else encode_json(entity)
+
+    def get_all_json(self, entity_type):
+        """Retrieve all entities of a type as one serialized JSON array."""
+        return encode_json(self.get_all(entity_type))
+
+    def get_version(self, entity_type, entity_id=None):
+        """Return the Version of an entity, or of the whole collection if entity_id is None.
+
+        Returns None for a missing entity. Engines that do not track versions
+        return None for everything, which turns conditional requests off.
+        """
+        return None
+
+    @contextmanager
+    def snapshot(self):
+        """Context manager yielding a read-only view on which reads agree with each other.
+
+        The view offers get, get_all, find, aggregate, get_page and iter_all,
+        all seeing the storage as of one moment. This default yields the
+        manager itself, without that guarantee; engines override it.
+        """
+        yield self
+
+    def save_many(self, entity_type, entities):
+        """Save (entity_id, entity_data) pairs; engines override this to batch the writes."""
+        for entity_id, entity_data in entities:
+            self.save(entity_type, entity_id, entity_data)
+
+    def find(self, entity_type, **criteria):
+        """Retrieve all entities matching the given criteria.
+
+        A criterion is field=value, or field__lookup=value with lookup one of
+        lt, lte, gt or gte. This default scans the whole collection; engines
+        override it with index-backed lookups.
+        """
+        conditions = parse_criteria(criteria)
+        return [entity for entity in self.get_all(entity_type) if matches(entity, conditions)]
+
+    def aggregate(self, entity_type, field, function, **criteria):
+        """Aggregate a field over the entities matching criteria, as for find().
+
+        function is one of AGGREGATES. Entities whose field is not a number
+        are left out, as SQL leaves out NULLs, so count counts the others.
+        This default computes it in Python over find(); engines override it.
+        """
+        if function not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {function!r}")
+        values = [entity.get(field) for entity in self.find(entity_type, **criteria)]
+        return aggregate_values([value for value in values if is_number(value)], function)
+
+    def get_page(self, entity_type, limit, after=None):
+        """Retrieve up to limit entities ordered by id, starting after the id after.
+
+        Returns (entities, next_after), where next_after is the id to pass as
+        after for the following page, or None on the last page. This default
+        sorts the whole collection; engines override it with an ordered key
+        structure so a page costs O(limit).
+        """
+        entities = sorted(self.get_all(entity_type), key=lambda entity: entity['id'])
+        if after is not None:
+            entities = [entity for entity in entities if entity['id'] > after]
+        page = entities[:limit]
+        return page, page[-1]['id'] if len(entities) > limit else None
+
+    def iter_all(self, entity_type, chunk_size=1000):
+        """Yield every entity of a type, ordered by id, one page at a time.
+
+        Only one page is held at once, so memory stays flat however large the
+        collection is, and writes made meanwhile never break the iteration.
+        """
+        after = None
+        while True:
+            page, after = self.get_page(entity_type, chunk_size, after)
+            yield from page
+            if after is None:
+                return
@@ -0,0 +1,363 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Mapping
+from itertools import accumulate, chain
+
+CHUNK_BITS = 8
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+# Items per chunk of a freshly built PersistentSortedList; chunks split at twice this.
+SORTED_CHUNK_SIZE = 512
+
+# Fills the key and value slots of a deleted entry until the map is compacted.
+_HOLE = object()
+
+
+def _bucket_count(size):
+    """Smallest power of two, at least 8, that is about the square root of size."""
+    count = 8
+    while count * count < size:
+        count *= 2
+    return count
+
+
+class PersistentMap(Mapping):
+    """An immutable, insertion-ordered mapping whose updates return a new map.
+
+    Keys and values are kept in insertion order in two parallel lists of
+    fixed-size chunks, and about sqrt(n) hash buckets map each key to its
+    slot. set() and delete() copy at most one bucket, one chunk of each list
+    and the short lists holding them, and share everything else with the map
+    they started from. An update therefore costs O(sqrt(n)) pointer copies
+    instead of O(n), every older version stays valid, and a lookup is still
+    a couple of index operations.
+    """
+
+    __slots__ = ('_buckets', '_keys', '_values', '_size', '_holes')
+
+    def __init__(self, items=()):
+        entries = dict(items)
+        keys, values = list(entries), list(entries.values())
+        buckets = [{} for _ in range(_bucket_count(len(keys)))]
+        mask = len(buckets) - 1
+        for slot, key in enumerate(keys):
+            buckets[hash(key) & mask][key] = slot
+        self._buckets = buckets
+        self._keys = [keys[start:start + CHUNK_SIZE] for start in range(0, len(keys), CHUNK_SIZE)]
+        self._values = [values[start:start + CHUNK_SIZE] for start in range(0, len(values), CHUNK_SIZE)]
+        self._size = len(keys)
+        self._holes = 0
+
+    @classmethod
+    def _make(cls, buckets, keys, values, size, holes):
+        new = object.__new__(cls)
+        new._buckets, new._keys, new._values, new._size, new._holes = buckets, keys, values, size, holes
+        return new
+
+    def _slot(self, key):
+        return self._buckets[hash(key) & (len(self._buckets) - 1)].get(key)
+
+    def __getitem__(self, key):
+        slot = self._slot(key)
+        if slot is None:
+            raise KeyError(key)
+        return self._values[slot >> CHUNK_BITS][slot & CHUNK_MASK]
+
+    def get(self, key, default=None):
+        slot = self._slot(key)
+        return default if slot is None else self._values[slot >> CHUNK_BITS][slot & CHUNK_MASK]
+
+    def __contains__(self, key):
+        return self._slot(key) is not None
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        keys = chain.from_iterable(self._keys)
+        return (key for key in keys if key is not _HOLE) if self._holes else keys
+
+    def values(self):
+        """The values in insertion order, as a list."""
+        values = chain.from_iterable(self._values)
+        return [value for value in values if value is not _HOLE] if self._holes else list(values)
+
+    def items(self):
+        """The (key, value) pairs in insertion order, as a list."""
+        items = zip(chain.from_iterable(self._keys), chain.from_iterable(self._values))
+        return [item for item in items if item[0] is not _HOLE] if self._holes else list(items)
+
+    def __repr__(self):
+        return f"PersistentMap({dict(self.items())!r})"
+
+    def set(self, key, value):
+        """Return a map where key maps to value; an existing key keeps its position."""
+        index = hash(key) & (len(self._buckets) - 1)
+        slot = self._buckets[index].get(key)
+        values = list(self._values)
+        if slot is not None:
+            # Same slot, so only the value chunk changes.
+            chunk = values[slot >> CHUNK_BITS] = list(values[slot >> CHUNK_BITS])
+            chunk[slot & CHUNK_MASK] = value
+            return self._make(self._buckets, self._keys, values, self._size, self._holes)
+        keys = list(self._keys)
+        if keys and len(keys[-1]) < CHUNK_SIZE:
+            keys[-1] = keys[-1] + [key]
+            values[-1] = values[-1] + [value]
+        else:
+            keys.append([key])
+            values.append([value])
+        buckets = list(self._buckets)
+        bucket = buckets[index] = dict(buckets[index])
+        bucket[key] = (len(keys) - 1) * CHUNK_SIZE + len(keys[-1]) - 1
+        result = self._make(buckets, keys, values, self._size + 1, self._holes)
+        if result._size > len(buckets) * len(buckets):
+            return PersistentMap(result.items())
+        return result
+
+    def delete(self, key):
+        """Return a map without key, or this map if key is absent."""
+        index = hash(key) & (len(self._buckets) - 1)
+        slot = self._buckets[index].get(key)
+        if slot is None:
+            return self
+        buckets = list(self._buckets)
+        bucket = buckets[index] = dict(buckets[index])
+        del bucket[key]
+        keys, values = list(self._keys), list(self._values)
+        for chunks in (keys, values):
+            chunk = chunks[slot >> CHUNK_BITS] = list(chunks[slot >> CHUNK_BITS])
+            chunk[slot & CHUNK_MASK] = _HOLE
+        result = self._make(buckets, keys, values, self._size - 1, self._holes + 1)
+        if result._holes >= CHUNK_SIZE and result._holes > result._size:
+            # Mostly holes: close them up, which renumbers every slot.
+            return PersistentMap(result.items())
+        return result
+
+    def nbytes(self):
+        """Approximate size of the containers, not counting the keys and values."""
+        return (sys.getsizeof(self._buckets) + sum(sys.getsizeof(bucket) for bucket in self._buckets)
+                + sys.getsizeof(self._keys) + sys.getsizeof(self._values)
+                + sum(sys.getsizeof(chunk) for chunk in chain(self._keys, self._values)))
+
+
+class PersistentSortedList:
+    """An immutable sorted list whose updates return a new list.
+
+    Items are kept in sorted chunks of at most 2 * SORTED_CHUNK_SIZE, with
+    the last item of every chunk alongside for bisecting. add() and
+    remove() copy one chunk and the two short lists of chunks and maxima,
+    splitting a chunk that grew too large and dropping one that emptied,
+    and share every other chunk with the list they started from. An update
+    therefore costs a few thousand pointer copies at most, however long the
+    list is, and older versions stay valid. Positions are counted over the
+    chunk lengths, so bisect and slicing cost O(n / SORTED_CHUNK_SIZE).
+    """
+
+    __slots__ = ('_chunks', '_maxes', '_size')
+
+    def __init__(self, items=()):
+        items = sorted(items)
+        self._chunks = [items[start:start + SORTED_CHUNK_SIZE] for start in range(0, len(items), SORTED_CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._size = len(items)
+
+    @classmethod
+    def _make(cls, chunks, maxes, size):
+        new = object.__new__(cls)
+        new._chunks, new._maxes, new._size = chunks, maxes, size
+        return new
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunks)
+
+    def __contains__(self, item):
+        index = bisect_left(self._maxes, item)
+        if index == len(self._maxes):
+            return False
+        chunk = self._chunks[index]
+        return chunk[bisect_left(chunk, item)] == item
+
+    def __getitem__(self, index):
+        """An item, or a slice of items as a list."""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            if step != 1:
+                return list(self)[index]
+            return self._slice(start, stop)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        chunk, offset = self._locate(index)
+        return self._chunks[chunk][offset]
+
+    def __eq__(self, other):
+        if isinstance(other, PersistentSortedList):
+            other = list(other)
+        return list(self) == other if isinstance(other, list) else NotImplemented
+
+    def __repr__(self):
+        return f"PersistentSortedList({list(self)!r})"
+
+    def bisect_left(self, item):
+        index = bisect_left(self._maxes, item)
+        if index == len(self._maxes):
+            return self._size
+        return self._offset(index) + bisect_left(self._chunks[index], item)
+
+    def bisect_right(self, item):
+        index = bisect_right(self._maxes, item)
+        if index == len(self._maxes):
+            return self._size
+        return self._offset(index) + bisect_right(self._chunks[index], item)
+
+    def add(self, item):
+        """Return a list with item inserted after any equal items."""
+        if not self._chunks:
+            return self._make([[item]], [item], 1)
+        index = min(bisect_right(self._maxes, item), len(self._maxes) - 1)
+        chunk = list(self._chunks[index])
+        insort(chunk, item)
+        chunks, maxes = list(self._chunks), list(self._maxes)
+        if len(chunk) > 2 * SORTED_CHUNK_SIZE:
+            half = len(chunk) // 2
+            chunks[index:index + 1] = [chunk[:half], chunk[half:]]
+            maxes[index:index + 1] = [chunk[half - 1], chunk[-1]]
+        else:
+            chunks[index] = chunk
+            maxes[index] = chunk[-1]
+        return self._make(chunks, maxes, self._size + 1)
+
+    def remove(self, item):
+        """Return a list without one item equal to item, or this list if there is none."""
+        index = bisect_left(self._maxes, item)
+        if index == len(self._maxes):
+            return self
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, item)
+        if chunk[position] != item:
+            return self
+        chunk = chunk[:position] + chunk[position + 1:]
+        chunks, maxes = list(self._chunks), list(self._maxes)
+        if chunk:
+            chunks[index] = chunk
+            maxes[index] = chunk[-1]
+        else:
+            del chunks[index], maxes[index]
+        return self._make(chunks, maxes, self._size - 1)
+
+    def nbytes(self):
+        """Approximate size of the containers, not counting the items."""
+        return (sys.getsizeof(self._chunks) + sys.getsizeof(self._maxes)
+                + sum(sys.getsizeof(chunk) for chunk in self._chunks))
+
+    def _offset(self, index):
+        """Number of items in the chunks before chunk index."""
+        return sum(map(len, self._chunks[:index]))
+
+    def _locate(self, position):
+        """The chunk holding position, and the offset in it; a position past the end gives (len(chunks), 0)."""
+        ends = list(accumulate(map(len, self._chunks)))
+        index = bisect_right(ends, position)
+        return index, position - (ends[index - 1] if index else 0)
+
+    def _slice(self, start, stop):
+        if start >= stop:
+            return []
+        first, offset = self._locate(start)
+        items, wanted = [], stop - start
+        for chunk in self._chunks[first:]:
+            items.extend(chunk[offset:offset + wanted - len(items)])
+            offset = 0
+            if len(items) == wanted:
+                break
+        return items
+
+
+# In a LayeredMap's changes: the base's entry for this key was deleted.
+_DELETED = object()
+_MISSING = object()
+
+
+class LayeredMap(Mapping):
+    """A read-only base mapping with a PersistentMap of changes on top.
+
+    Updates return a new LayeredMap sharing the base, and only ever grow the
+    changes, so the base can live outside the Python heap, such as in a
+    mapped region file. Iteration follows the base's order, with keys the
+    base lacks after it in the order they were added.
+    """
+
+    __slots__ = ('base', 'changes', '_size')
+
+    def __init__(self, base, changes=PersistentMap(), size=None):
+        self.base = base
+        self.changes = changes
+        self._size = len(base) if size is None else size
+
+    def get(self, key, default=None):
+        value = self.changes.get(key, _MISSING)
+        if value is _MISSING:
+            return self.base.get(key, default)
+        return default if value is _DELETED else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        value = self.changes.get(key, _MISSING)
+        return key in self.base if value is _MISSING else value is not _DELETED
+
+    def get_json(self, key):
+        """Return the base's serialized value for key if it is unchanged, else None."""
+        return None if key in self.changes else self.base.get_json(key)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        changes = self.changes
+        for key in self.base:
+            if changes.get(key) is not _DELETED:
+                yield key
+        for key, value in changes.items():
+            if value is not _DELETED and key not in self.base:
+                yield key
+
+    def items(self):
+        """The (key, value) pairs in iteration order, as a list."""
+        changes = self.changes
+        if not changes:
+            return self.base.items()
+        items = []
+        for key, value in self.base.items():
+            value = changes.get(key, value)
+            if value is not _DELETED:
+                items.append((key, value))
+        items.extend(item for item in changes.items() if item[1] is not _DELETED and item[0] not in self.base)
+        return items
+
+    def values(self):
+        """The values in iteration order, as a list."""
+        if not self.changes:
+            return self.base.values()
+        return [value for _, value in self.items()]
+
+    def set(self, key, value):
+        """Return a map where key maps to value."""
+        size = self._size if key in self else self._size + 1
+        return LayeredMap(self.base, self.changes.set(key, value), size)
+
+    def delete(self, key):
+        """Return a map without key, or this map if key is absent."""
+        if key not in self:
+            return self
+        changes = self.changes.set(key, _DELETED) if key in self.base else self.changes.delete(key)
+        return LayeredMap(self.base, changes, self._size - 1)
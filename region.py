@@ -0,0 +1,225 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections.abc import Mapping
+from json_cache import encode_json
+from persistent import LayeredMap
+from snapshot import fsync_directory, temp_path
+
+MAGIC = b'HBNBMAP2'
+# After the magic: offset and length of the JSON index at the end of the
+# file, and the CRC-32 of those two fields and the index.
+PREAMBLE = struct.Struct('<QII')
+# Before every record: the lengths of its key and of its serialized value,
+# and the CRC-32 of the key and value.
+RECORD = struct.Struct('<III')
+SLOT = struct.Struct('<Q')
+
+
+def _slot_count(count):
+    """Smallest power of two, at least 8, holding count keys at most half full."""
+    slots = 8
+    while slots < 2 * count:
+        slots *= 2
+    return slots
+
+
+def write_region(path, storage, epoch=''):
+    """Write storage, {entity_type: {entity_id: entity_data}}, as a region file at path.
+
+    Each collection is a run of length-prefixed records (key, then value as
+    encode_json() would send it) followed by an open-addressing hash table of
+    record offsets. The header points to an index at the end of the file,
+    which names every collection's offsets.
+    The file is written next to path, fsynced and renamed over it, so
+    processes that mapped the old file keep reading it undisturbed and a
+    crash leaves either file whole.
+
+    Checksums let Region check what it reads without reading the whole
+    file: the preamble covers the index, the index covers each hash table,
+    and every record covers its key and value.
+    """
+    tmp_path = temp_path(path)
+    index = {'epoch': epoch, 'collections': {}}
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + PREAMBLE.pack(0, 0, 0))
+            for entity_type, entities in storage.items():
+                start = f.tell()
+                hashes, offsets = [], []
+                for entity_id, value in serialized_items(entities):
+                    key = entity_id.encode()
+                    hashes.append(zlib.crc32(key))
+                    offsets.append(f.tell())
+                    f.write(RECORD.pack(len(key), len(value), zlib.crc32(value, zlib.crc32(key))) + key + value)
+                f.write(b'\0' * (-f.tell() % SLOT.size))
+                slots = _slot_count(len(offsets))
+                table = array('Q', bytes(SLOT.size * slots))
+                mask = slots - 1
+                for key_hash, offset in zip(hashes, offsets):
+                    slot = key_hash & mask
+                    while table[slot]:
+                        slot = (slot + 1) & mask
+                    table[slot] = offset
+                table_bytes = table.tobytes()
+                index['collections'][entity_type] = [start, len(offsets), f.tell(), slots, zlib.crc32(table_bytes)]
+                f.write(table_bytes)
+            index_offset = f.tell()
+            index_bytes = json.dumps(index).encode()
+            f.write(index_bytes)
+            f.seek(len(MAGIC))
+            f.write(PREAMBLE.pack(index_offset, len(index_bytes), _index_crc(index_offset, index_bytes)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    fsync_directory(os.path.dirname(path) or '.')
+
+
+def _index_crc(index_offset, index_bytes):
+    return zlib.crc32(index_bytes, zlib.crc32(struct.pack('<QI', index_offset, len(index_bytes))))
+
+
+def serialized_items(entities):
+    """Yield (entity_id, encode_json(entity_data)) for every entity, in iteration order.
+
+    Entities of a LayeredMap that are unchanged since its region was written
+    are copied as they are, without decoding and encoding them again.
+    """
+    if not (isinstance(entities, LayeredMap) and isinstance(entities.base, RegionMap)):
+        for entity_id, entity_data in entities.items():
+            yield entity_id, encode_json(entity_data)
+        return
+    base, changes = entities.base, entities.changes
+    for entity_id, body in base.json_items():
+        if entity_id not in changes:
+            yield entity_id, body
+        elif entity_id in entities:
+            yield entity_id, encode_json(entities[entity_id])
+    for entity_id in changes:
+        if entity_id not in base and entity_id in entities:
+            yield entity_id, encode_json(entities[entity_id])
+
+
+def collection_json(entities):
+    """Serialize a collection's entities as one JSON array, as encode_json() would."""
+    return b'[' + b','.join(body[:-1] for _, body in serialized_items(entities)) + b']\n'
+
+
+class Region:
+    """A region file mapped read-only into memory.
+
+    Every process mapping the same file shares one copy of it in the page
+    cache, so entities read from it cost no private memory until decoded.
+    Opening it checks the index only; hash tables and records are checked
+    when first read, so a damaged file raises ValueError then.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a region file")
+        index_offset, index_length, crc = PREAMBLE.unpack_from(self._buffer, len(MAGIC))
+        index_bytes = self._buffer[index_offset:index_offset + index_length]
+        if len(index_bytes) != index_length or _index_crc(index_offset, index_bytes) != crc:
+            raise ValueError(f"Checksum mismatch in region {path}")
+        index = json.loads(index_bytes)
+        self.epoch = index['epoch']
+        self.collections = {entity_type: RegionMap(self._buffer, *layout)
+                            for entity_type, layout in index['collections'].items()}
+
+
+class RegionMap(Mapping):
+    """One collection of a Region, as a read-only mapping decoding entities on access."""
+
+    __slots__ = ('_buffer', '_start', '_count', '_table', '_mask', '_table_crc')
+
+    def __init__(self, buffer, start, count, table, slots, table_crc):
+        self._buffer = buffer
+        self._start = start
+        self._count = count
+        self._table = table
+        self._mask = slots - 1
+        self._table_crc = table_crc
+
+    def _check_table(self):
+        """Check the hash table against its checksum, once, before the first lookup."""
+        end = self._table + SLOT.size * (self._mask + 1)
+        if zlib.crc32(self._buffer[self._table:end]) != self._table_crc:
+            raise ValueError("Checksum mismatch in region hash table")
+        self._table_crc = None
+
+    def _record(self, offset):
+        """Return the key and serialized value of the record at offset, and where it ends."""
+        key_length, value_length, crc = RECORD.unpack_from(self._buffer, offset)
+        offset += RECORD.size
+        value_offset = offset + key_length
+        end = value_offset + value_length
+        key, value = self._buffer[offset:value_offset], self._buffer[value_offset:end]
+        if zlib.crc32(value, zlib.crc32(key)) != crc:
+            raise ValueError("Checksum mismatch in region record")
+        return key, value, end
+
+    def _find(self, key):
+        """Return key's serialized value, or None."""
+        if not isinstance(key, str):
+            return None
+        if self._table_crc is not None:
+            self._check_table()
+        key = key.encode()
+        buffer = self._buffer
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            offset, = SLOT.unpack_from(buffer, self._table + slot * SLOT.size)
+            if not offset:
+                return None
+            key_length, = struct.unpack_from('<I', buffer, offset)
+            start = offset + RECORD.size
+            if buffer[start:start + key_length] == key:
+                return self._record(offset)[1]
+            slot = (slot + 1) & self._mask
+
+    def get_json(self, key):
+        """Return key's value serialized as by encode_json(), or None."""
+        return self._find(key)
+
+    def __getitem__(self, key):
+        body = self.get_json(key)
+        if body is None:
+            raise KeyError(key)
+        return json.loads(body)
+
+    def get(self, key, default=None):
+        body = self.get_json(key)
+        return default if body is None else json.loads(body)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._count
+
+    def json_items(self):
+        """Yield (key, serialized value) in insertion order."""
+        offset = self._start
+        for _ in range(self._count):
+            key, value, offset = self._record(offset)
+            yield key.decode(), value
+
+    def __iter__(self):
+        return (key for key, _ in self.json_items())
+
+    def values(self):
+        """The decoded values in insertion order, as a list."""
+        return [json.loads(body) for _, body in self.json_items()]
+
+    def items(self):
+        """The (key, decoded value) pairs in insertion order, as a list."""
+        return [(key, json.loads(body)) for key, body in self.json_items()]
@@ -0,0 +1,316 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+CHECKSUM_PREFIX = b'#sha256:'
+
+
+def write_snapshot(path, storage, nested=True):
+    """Write storage to path atomically, with a checksum footer.
+
+    The data goes to a temp file next to path, is fsynced and then renamed
+    over path, so readers and crashes only ever see the old or the new file.
+    It is encoded one entity at a time, so writing takes little memory
+    beyond the entities themselves: storage is {entity_type: entities}, or
+    a single collection's entities when not nested.
+    """
+    checksum = hashlib.sha256()
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in _encode(storage, 2 if nested else 1):
+                checksum.update(chunk)
+                f.write(chunk)
+            f.write(b'\n' + CHECKSUM_PREFIX + checksum.hexdigest().encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    fsync_directory(os.path.dirname(path) or '.')
+
+
+def _encode(mapping, depth, batch=1024):
+    """Yield mapping as compact JSON in chunks, encoding the values depth levels down one by one."""
+    pieces = ['{']
+    for position, (key, value) in enumerate(mapping.items()):
+        if position:
+            pieces.append(',')
+        pieces.append(json.dumps(key) + ':')
+        if depth > 1:
+            yield ''.join(pieces).encode()
+            yield from _encode(value, depth - 1, batch)
+            pieces = []
+        else:
+            # Values may be any mapping, such as DataManager's records.
+            pieces.append(json.dumps(value, separators=(',', ':'), default=lambda value: dict(value.items())))
+            if len(pieces) >= batch:
+                yield ''.join(pieces).encode()
+                pieces = []
+    pieces.append('}')
+    yield ''.join(pieces).encode()
+
+
+def read_snapshot(path):
+    """Load a snapshot written by write_snapshot, verifying its checksum.
+
+    Plain JSON files without a footer, such as hand-edited or older
+    snapshots, are still accepted.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    body, sep, footer = content.rstrip(b'\n').rpartition(b'\n')
+    if not sep or not footer.startswith(CHECKSUM_PREFIX):
+        return json.loads(content)
+    expected = footer[len(CHECKSUM_PREFIX):].decode()
+    if hashlib.sha256(body).hexdigest() != expected:
+        raise ValueError(f"Checksum mismatch in snapshot {path}")
+    return json.loads(body)
+
+
+def iter_snapshot(path, nested=True, chunk_size=1 << 20):
+    """Yield the entities of a snapshot one at a time, as (entity_type, entity_id, entity_data).
+
+    Unlike read_snapshot, only about chunk_size bytes of the file are held
+    at once. The checksum is verified once every entity has been read, so a
+    ValueError may come after entities of a damaged file were yielded. A
+    snapshot of a single collection, written without nested, yields
+    (entity_id, entity_data) pairs.
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        f.seek(0)
+        lines, sep, footer = tail.rstrip(b'\n').rpartition(b'\n')
+        expected = None
+        if sep and footer.startswith(CHECKSUM_PREFIX):
+            expected, size = footer[len(CHECKSUM_PREFIX):].decode(), size - len(tail) + len(lines)
+        reader = _Reader(f, size, chunk_size, path)
+        yield from reader.walk((), 2 if nested else 1)
+        reader.finish(expected)
+
+
+class _Reader:
+    """Parses the first size bytes of a JSON file of nested objects, one chunk at a time."""
+
+    def __init__(self, f, size, chunk_size, path):
+        self.f = f
+        self.left = size
+        self.chunk_size = chunk_size
+        self.path = path
+        self.checksum = hashlib.sha256()
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.position = 0
+
+    def walk(self, keys, depth):
+        """Yield (*keys, key, value) for the members of the object at the current position, depth levels down."""
+        for key in self.members():
+            if depth > 1:
+                yield from self.walk((*keys, key), depth - 1)
+            else:
+                yield (*keys, key, self.value())
+
+    def members(self):
+        """Yield the keys of the object at the current position; the caller reads each value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError(f"Malformed snapshot {self.path}")
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number may go on in the next chunk.
+            if end < len(self.text) or not self.fill():
+                self.position = end
+                return value
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end."""
+        while True:
+            text = self.text
+            position = self.position = _WHITESPACE.match(text, self.position).end()
+            if position < len(text) or not self.fill():
+                return text[position:position + 1]
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Malformed snapshot {self.path}")
+        self.position += 1
+        return character
+
+    def fill(self):
+        """Read the next chunk, dropping what was parsed; False at the end."""
+        if not self.left:
+            return False
+        data = self.f.read(min(self.chunk_size, self.left))
+        if not data:
+            raise ValueError(f"Truncated snapshot {self.path}")
+        self.left -= len(data)
+        self.checksum.update(data)
+        self.text = self.text[self.position:] + self.decoder.decode(data, final=not self.left)
+        self.position = 0
+        return True
+
+    def finish(self, expected):
+        if self.peek():
+            raise ValueError(f"Malformed snapshot {self.path}")
+        if expected is not None and self.checksum.hexdigest() != expected:
+            raise ValueError(f"Checksum mismatch in snapshot {self.path}")
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+
+def temp_path(path):
+    """A temp file name next to path, unique to the calling process and thread."""
+    return f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+
+
+def fsync_directory(directory):
+    """Persist a rename; not every platform can open a directory for this."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class BackgroundSaver:
+    """Writes snapshots off the request thread, BGSAVE style.
+
+    The preferred strategy forks a child that serializes the copy-on-write
+    image of the parent's memory, so the parent only pays for the fork itself.
+    Where fork is unavailable or refused, storage is serialized on a worker
+    thread as is, so it must not change afterwards; DataManager hands over
+    an immutable version of its collections.
+
+    Either way a watcher thread waits for the snapshot and then calls
+    on_complete(ok) so the owner can clean up or schedule another run; a
+    snapshot counts as running until on_complete has returned. Snapshots
+    are written by write(path, storage), write_snapshot by default.
+    """
+
+    def __init__(self, on_complete=None, use_fork=True, write=write_snapshot):
+        self.on_complete = on_complete
+        self.write = write
+        self.use_fork = use_fork and hasattr(os, 'fork')
+        self.stats = {
+            'mode': 'fork' if self.use_fork else 'thread',
+            'snapshots': 0,
+            'failures': 0,
+            'in_progress': False,
+            'last_duration': None,
+            'last_pause': None,
+        }
+        self._thread = None
+        # Watcher threads that have not returned from on_complete yet.
+        self._active = set()
+        self._done = threading.Condition()
+
+    @property
+    def in_progress(self):
+        return self._thread is not None
+
+    @property
+    def idle(self):
+        """True if no snapshot is running, or only the one whose on_complete is asking."""
+        with self._done:
+            return not self._active - {threading.current_thread()}
+
+    def start(self, path, storage):
+        """Start a background snapshot; returns False if one is already running."""
+        if self.in_progress:
+            return False
+        started_at = time.monotonic()
+        pid = None
+        if self.use_fork:
+            try:
+                pid = self._fork_child(path, storage)
+            except OSError:
+                self.use_fork = False
+                self.stats['mode'] = 'thread'
+        if pid is not None:
+            target, args = self._wait_child, (pid, started_at)
+        else:
+            target, args = self._write_in_thread, (path, storage, started_at)
+        self.stats['in_progress'] = True
+        self.stats['last_pause'] = time.monotonic() - started_at
+        self._thread = threading.Thread(target=target, args=args, daemon=True)
+        with self._done:
+            self._active.add(self._thread)
+        self._thread.start()
+        return True
+
+    def wait(self):
+        """Block until no snapshot is running, including ones started by on_complete."""
+        current = threading.current_thread()
+        with self._done:
+            while self._active - {current}:
+                self._done.wait()
+
+    def _fork_child(self, path, storage):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.write(path, storage)
+                status = 0
+            finally:
+                os._exit(status)
+        return pid
+
+    def _wait_child(self, pid, started_at):
+        _, status = os.waitpid(pid, 0)
+        self._finish(os.waitstatus_to_exitcode(status) == 0, started_at)
+
+    def _write_in_thread(self, path, storage, started_at):
+        try:
+            self.write(path, storage)
+        except Exception:
+            self._finish(False, started_at)
+        else:
+            self._finish(True, started_at)
+
+    def _finish(self, ok, started_at):
+        self.stats['in_progress'] = False
+        self.stats['last_duration'] = time.monotonic() - started_at
+        self.stats['snapshots' if ok else 'failures'] += 1
+        # Cleared first, so on_complete can start the next snapshot.
+        self._thread = None
+        try:
+            if self.on_complete:
+                self.on_complete(ok)
+        finally:
+            with self._done:
+                self._active.discard(threading.current_thread())
+                self._done.notify_all()
@@ -0,0 +1,301 @@
+import json
+import re
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+from indexes import DEFAULT_INDEXES
+from persistence_manager import (DuplicateKeyError, IPersistenceManager, Version, VersionConflictError,
+                                 parse_criteria)
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Per-collection write counters; entity tables may not start with an underscore.
+COLLECTIONS_TABLE = '_collections'
+NEXT_VERSION = f'SELECT version + 1 FROM {COLLECTIONS_TABLE} WHERE name = ?'
+
+SQL_LOOKUPS = {'eq': '=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+
+
+def _encode(entity_data):
+    return json.dumps(entity_data, separators=(',', ':'))
+
+
+def _identifier(name):
+    """Validate a name before it is spliced into SQL as a table or field."""
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return name
+
+
+class SQLiteManager(IPersistenceManager):
+    """Storage engine keeping each entity type in its own SQLite table.
+
+    Entities are stored as JSON text keyed by id, so rows live on disk rather
+    than in memory. The fields declared in INDEXES get expression indexes
+    over json_extract() (UNIQUE ones for 'unique' indexes), which find()
+    queries with the exact same expression so SQLite answers them with a
+    B-tree search instead of a table scan.
+
+    Each thread gets its own connection, opened lazily in WAL mode so readers
+    never block the writer. Statements are built from a fixed set of
+    templates, which keeps them in sqlite3's per-connection statement cache.
+
+    Every write bumps its collection's counter in the _collections table and
+    stamps the rows it touches with the new count, in the same transaction.
+    A counter starts at the creation time in microseconds, so a recreated
+    database never hands out a version an old one already used.
+    """
+
+    INDEXES = DEFAULT_INDEXES
+
+    def __init__(self, database_file):
+        self.database_file = database_file
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        connection = self._connection()
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {COLLECTIONS_TABLE} '
+            '(name TEXT PRIMARY KEY, version INTEGER NOT NULL, modified REAL NOT NULL)')
+        rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        self._tables = {name for (name,) in rows if not name.startswith(('_', 'sqlite_'))}
+
+    def save(self, entity_type, entity_id, entity_data):
+        """Save an entity to the storage."""
+        table = self._table(entity_type, create=True)
+        with self._write(table) as (connection, modified):
+            connection.execute(self._upsert_sql(table), (entity_id, _encode(entity_data), table, modified))
+            self._bump(connection, table, modified)
+
+    def save_many(self, entity_type, entities):
+        """Save (entity_id, entity_data) pairs in a single transaction.
+
+        If one of them breaks a unique index, the ones before it are kept.
+        """
+        table = self._table(entity_type, create=True)
+        modified = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            with self._unique_violations(table):
+                connection.executemany(
+                    self._upsert_sql(table),
+                    ((entity_id, _encode(entity_data), table, modified) for entity_id, entity_data in entities))
+        except DuplicateKeyError:
+            self._bump(connection, table, modified)
+            connection.execute('COMMIT')
+            raise
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._bump(connection, table, modified)
+        connection.execute('COMMIT')
+
+    def get(self, entity_type, entity_id):
+        """Retrieve an entity by ID from the storage."""
+        table = self._table(entity_type)
+        if table is None:
+            return None
+        row = self._connection().execute(
+            f'SELECT data FROM "{table}" WHERE id = ?', (entity_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_json(self, entity_type, entity_id):
+        """Retrieve an entity as JSON bytes straight from its stored text."""
+        table = self._table(entity_type)
+        if table is None:
+            return None
+        row = self._connection().execute(
+            f'SELECT data FROM "{table}" WHERE id = ?', (entity_id,)).fetchone()
+        return row[0].encode() + b'\n' if row else None
+
+    def get_all_json(self, entity_type):
+        """Retrieve a whole collection as a JSON array assembled from the stored texts."""
+        table = self._table(entity_type)
+        if table is None:
+            return b'[]\n'
+        rows = self._connection().execute(f'SELECT data FROM "{table}" ORDER BY rowid')
+        return ('[' + ','.join(data for (data,) in rows) + ']\n').encode()
+
+    def update(self, entity_type, entity_id, entity_data, expected_version=None):
+        """Update an entity in the storage (see IPersistenceManager.update)."""
+        table = self._table(entity_type)
+        if table is None:
+            return False
+        with self._write(table) as (connection, modified):
+            cursor = connection.execute(
+                f'UPDATE "{table}" SET data = ?, version = ({NEXT_VERSION}), modified = ? '
+                'WHERE id = ? AND (? IS NULL OR version = ?)',
+                (_encode(entity_data), table, modified, entity_id, expected_version, expected_version))
+            self._after_write(connection, table, entity_id, cursor.rowcount, expected_version, modified)
+        return cursor.rowcount > 0
+
+    def delete(self, entity_type, entity_id, expected_version=None):
+        """Delete an entity from the storage (see IPersistenceManager.delete)."""
+        table = self._table(entity_type)
+        if table is None:
+            return False
+        with self._write(table) as (connection, modified):
+            cursor = connection.execute(
+                f'DELETE FROM "{table}" WHERE id = ? AND (? IS NULL OR version = ?)',
+                (entity_id, expected_version, expected_version))
+            self._after_write(connection, table, entity_id, cursor.rowcount, expected_version, modified)
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def snapshot(self):
+        """Run the reads inside in one read transaction, which WAL mode isolates from writers."""
+        connection = self._connection()
+        if connection.in_transaction:
+            yield self
+            return
+        connection.execute('BEGIN')
+        try:
+            yield self
+        finally:
+            connection.execute('COMMIT')
+
+    def get_version(self, entity_type, entity_id=None):
+        """Return the Version of an entity or collection (see IPersistenceManager.get_version)."""
+        table = self._table(entity_type)
+        if table is None:
+            return None if entity_id is not None else Version('0', 0.0)
+        if entity_id is None:
+            row = self._connection().execute(
+                f'SELECT version, modified FROM {COLLECTIONS_TABLE} WHERE name = ?', (table,)).fetchone()
+        else:
+            row = self._connection().execute(
+                f'SELECT version, modified FROM "{table}" WHERE id = ?', (entity_id,)).fetchone()
+        return Version(str(row[0]), row[1]) if row else None
+
+    def get_all(self, entity_type):
+        """Retrieve all entities of a specific type from the storage."""
+        table = self._table(entity_type)
+        if table is None:
+            return []
+        rows = self._connection().execute(f'SELECT data FROM "{table}" ORDER BY rowid')
+        return [json.loads(data) for (data,) in rows]
+
+    def find(self, entity_type, **criteria):
+        """Retrieve all entities matching the given criteria (see IPersistenceManager.find)."""
+        conditions = parse_criteria(criteria)
+        table = self._table(entity_type)
+        if table is None:
+            return []
+        if not conditions:
+            return self.get_all(entity_type)
+        where = ' AND '.join(f"json_extract(data, '$.{_identifier(field)}') {SQL_LOOKUPS[lookup]} ?"
+                             for field, lookup, _ in conditions)
+        rows = self._connection().execute(
+            f'SELECT data FROM "{table}" WHERE {where} ORDER BY rowid',
+            [value for _, _, value in conditions])
+        return [json.loads(data) for (data,) in rows]
+
+    def get_page(self, entity_type, limit, after=None):
+        """Retrieve up to limit entities ordered by id, walking the primary key index."""
+        table = self._table(entity_type)
+        if table is None:
+            return [], None
+        rows = self._connection().execute(
+            f'SELECT id, data FROM "{table}" WHERE id > ? ORDER BY id LIMIT ?',
+            ('' if after is None else after, limit + 1)).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return [json.loads(data) for _, data in rows], rows[-1][0] if more else None
+
+    def close(self):
+        """Close every connection opened by any thread."""
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_file, isolation_level=None,
+                                         check_same_thread=False, cached_statements=256)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _table(self, entity_type, create=False):
+        """Return the table name for entity_type, or None if it does not exist yet."""
+        table = _identifier(entity_type)
+        if table.startswith('_'):
+            raise ValueError(f"Invalid entity type: {entity_type!r}")
+        if table in self._tables:
+            return table
+        connection = self._connection()
+        if not create:
+            # Another process may have created it since we last looked.
+            row = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if row:
+                self._tables.add(table)
+                return table
+            return None
+        with self._lock:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" (id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                'version INTEGER NOT NULL, modified REAL NOT NULL)')
+            now = time.time()
+            connection.execute(
+                f'INSERT OR IGNORE INTO {COLLECTIONS_TABLE} (name, version, modified) VALUES (?, ?, ?)',
+                (table, int(now * 1000000), now))
+            for field, kind in self.INDEXES.get(entity_type, {}).items():
+                unique = 'UNIQUE ' if kind == 'unique' else ''
+                connection.execute(
+                    f'CREATE {unique}INDEX IF NOT EXISTS "{table}_{field}" '
+                    f"ON \"{table}\" (json_extract(data, '$.{field}'))")
+            self._tables.add(table)
+        return table
+
+    @staticmethod
+    def _upsert_sql(table):
+        return (f'INSERT INTO "{table}" (id, data, version, modified) VALUES (?, ?, ({NEXT_VERSION}), ?) '
+                'ON CONFLICT(id) DO UPDATE SET data = excluded.data, '
+                'version = excluded.version, modified = excluded.modified')
+
+    @staticmethod
+    def _bump(connection, table, modified):
+        connection.execute(
+            f'UPDATE {COLLECTIONS_TABLE} SET version = version + 1, modified = ? WHERE name = ?',
+            (modified, table))
+
+    def _after_write(self, connection, table, entity_id, rowcount, expected_version, modified):
+        """Bump the counter after a conditional write, or tell a stale version from a missing row."""
+        if rowcount:
+            self._bump(connection, table, modified)
+        elif expected_version is not None and connection.execute(
+                f'SELECT 1 FROM "{table}" WHERE id = ?', (entity_id,)).fetchone():
+            raise VersionConflictError(table, entity_id)
+
+    @contextmanager
+    def _write(self, table):
+        """Run a write and its counter bump as one transaction, yielding (connection, now)."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            with self._unique_violations(table):
+                yield connection, time.time()
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @contextmanager
+    def _unique_violations(self, table):
+        """Translate a UNIQUE index failure on table into DuplicateKeyError."""
+        try:
+            yield
+        except sqlite3.IntegrityError as error:
+            for field, kind in self.INDEXES.get(table, {}).items():
+                if kind == 'unique' and f"{table}_{field}" in str(error):
+                    raise DuplicateKeyError(field) from error
+            raise
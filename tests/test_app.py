@@ -0,0 +1,160 @@
+import json
+import os
+import unittest
+
+os.environ.setdefault('HBNB_STORAGE_ENGINE', 'memory')
+
+import app as hbnb
+from engines import create_data_manager
+
+class TestApp(unittest.TestCase):
+
+    def setUp(self):
+        hbnb.data_manager = create_data_manager('memory')
+        self.client = hbnb.app.test_client()
+
+    def create_user(self, email):
+        return self.client.post('/users', json={'email': email, 'first_name': 'Ann', 'last_name': 'Lee'})
+
+    def test_duplicate_email_is_rejected_with_conflict(self):
+        self.assertEqual(self.create_user('ann@example.com').status_code, 201)
+        response = self.create_user('ann@example.com')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json(), {'error': 'Email already exists'})
+        self.assertEqual(len(self.client.get('/users').get_json()), 1)
+
+    def test_changing_email_to_a_taken_one_is_rejected(self):
+        self.create_user('ann@example.com')
+        bob = self.create_user('bob@example.com').get_json()
+        response = self.client.put(f"/users/{bob['id']}", json={'email': 'ann@example.com', 'first_name': 'Bob'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(f"/users/{bob['id']}").get_json()['email'], 'bob@example.com')
+        response = self.client.put(f"/users/{bob['id']}", json={'email': 'bob@example.com', 'first_name': 'Rob'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_email_is_free_again_after_delete(self):
+        ann = self.create_user('ann@example.com').get_json()
+        self.client.delete(f"/users/{ann['id']}")
+        self.assertEqual(self.create_user('ann@example.com').status_code, 201)
+
+    def test_conditional_get_on_entity(self):
+        ann = self.create_user('ann@example.com').get_json()
+        response = self.client.get(f"/users/{ann['id']}")
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+        cached = self.client.get(f"/users/{ann['id']}", headers={'If-None-Match': etag})
+        self.assertEqual((cached.status_code, cached.data), (304, b''))
+        self.assertEqual(cached.headers['ETag'], etag)
+        since = self.client.get(f"/users/{ann['id']}",
+                                headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(since.status_code, 304)
+        self.client.put(f"/users/{ann['id']}", json={'email': 'ann@example.com', 'first_name': 'Anna'})
+        response = self.client.get(f"/users/{ann['id']}", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_conditional_get_on_collection(self):
+        self.create_user('ann@example.com')
+        etag = self.client.get('/users').headers['ETag']
+        self.assertEqual(self.client.get('/users', headers={'If-None-Match': etag}).status_code, 304)
+        self.create_user('bob@example.com')
+        response = self.client.get('/users', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertEqual(self.client.get('/users?limit=0', headers={'If-None-Match': '*'}).status_code, 400)
+
+    def test_collection_representations_have_their_own_etags(self):
+        self.create_user('ann@example.com')
+        variants = [('/users', {}), ('/users', {'Accept': 'application/x-ndjson'}), ('/users?stream=1', {}),
+                    ('/users?limit=1', {}), ('/users?limit=2', {})]
+        etags = []
+        for url, headers in variants:
+            response = self.client.get(url, headers=headers)
+            self.assertIn('Accept', response.vary)
+            etags.append(response.headers['ETag'])
+            cached = self.client.get(url, headers={**headers, 'If-None-Match': etags[-1]})
+            self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(set(etags)), len(variants))
+        ndjson = self.client.get('/users', headers={'Accept': 'application/x-ndjson', 'If-None-Match': etags[0]})
+        self.assertEqual(ndjson.status_code, 200)
+
+    def test_if_match_guards_put_and_delete(self):
+        ann = self.create_user('ann@example.com').get_json()
+        url = f"/users/{ann['id']}"
+        etag = self.client.get(url).headers['ETag']
+        update = {'email': 'ann@example.com', 'first_name': 'Anna'}
+        self.assertEqual(self.client.put(url, json=update, headers={'If-Match': etag}).status_code, 200)
+        response = self.client.put(url, json={'email': 'ann@example.com', 'first_name': 'Old'},
+                                   headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.get(url).get_json()['first_name'], 'Anna')
+        self.assertEqual(self.client.delete(url, headers={'If-Match': etag}).status_code, 412)
+        self.assertEqual(self.client.put(url, json=update, headers={'If-Match': '*'}).status_code, 200)
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.delete(url, headers={'If-Match': etag}).status_code, 204)
+
+    def test_missing_entities_are_not_found(self):
+        for url in ('/users/missing', '/countries/missing', '/cities/missing',
+                    '/amenities/missing', '/places/missing', '/reviews/missing'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertEqual(self.client.put(url, json={'name': 'x'}).status_code, 404)
+            self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_entity_deleted_while_read_is_not_found(self):
+        ann = self.create_user('ann@example.com').get_json()
+        get_json = hbnb.data_manager.get_json
+
+        def get_json_after_delete(entity_type, entity_id):
+            hbnb.data_manager.delete(entity_type, entity_id)
+            return get_json(entity_type, entity_id)
+
+        hbnb.data_manager.get_json = get_json_after_delete
+        response = self.client.get(f"/users/{ann['id']}")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json(), {'error': 'User not found'})
+        self.assertNotIn('ETag', response.headers)
+
+    def test_country_cities(self):
+        self.assertEqual(self.client.get('/countries/missing/cities').status_code, 404)
+        country = self.client.post('/countries', json={'name': 'France', 'code': 'FR'}).get_json()
+        self.client.post('/cities', json={'name': 'Lyon', 'country_code': 'FR'})
+        self.client.post('/cities', json={'name': 'Austin', 'country_code': 'US'})
+        response = self.client.get(f"/countries/{country['id']}/cities")
+        self.assertEqual([city['name'] for city in response.get_json()], ['Lyon'])
+        cached = self.client.get(f"/countries/{country['id']}/cities",
+                                 headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_collection_pagination(self):
+        for i in range(5):
+            hbnb.data_manager.save('amenities', f"a{i}", {'id': f"a{i}", 'name': f"Amenity {i}"})
+        seen = []
+        response = self.client.get('/amenities?limit=2').get_json()
+        while True:
+            seen.extend(amenity['id'] for amenity in response['items'])
+            if response['next'] is None:
+                break
+            response = self.client.get(f"/amenities?limit=2&cursor={response['next']}").get_json()
+        self.assertEqual(seen, ['a0', 'a1', 'a2', 'a3', 'a4'])
+        self.assertEqual(len(self.client.get('/amenities').get_json()), 5)
+
+    def test_invalid_pagination_parameters(self):
+        self.assertEqual(self.client.get('/places?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/places?limit=abc').status_code, 400)
+        self.assertEqual(self.client.get('/places?cursor=%%%').status_code, 400)
+        self.assertEqual(self.client.get('/places?limit=10').get_json(), {'items': [], 'next': None})
+
+    def test_streamed_collections(self):
+        for i in range(3):
+            hbnb.data_manager.save('cities', f"c{i}", {'id': f"c{i}", 'name': 'Paris', 'country_code': 'FR'})
+        response = self.client.get('/cities?stream=1')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual([city['id'] for city in response.get_json()], ['c0', 'c1', 'c2'])
+        response = self.client.get('/cities', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], ['c0', 'c1', 'c2'])
+        self.assertEqual(self.client.get('/countries?stream=1').get_json(), [])
+
+if __name__ == '__main__':
+    unittest.main()
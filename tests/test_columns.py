@@ -0,0 +1,109 @@
+import math
+import unittest
+from copy import copy
+from columns import HAVE_NUMPY, ROWS_PER_CANDIDATE, ColumnStore
+from data_manager import DataManager
+from persistence_manager import IPersistenceManager
+
+@unittest.skipUnless(HAVE_NUMPY, 'needs numpy')
+class TestColumnStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ColumnStore(('price', 'rooms'))
+        self.store.build({
+            'p0': {'price': 50, 'rooms': 2},
+            'p1': {'price': 20.5},
+            'p2': {'price': 'fifty', 'rooms': 1},
+            'p3': {'price': 80, 'rooms': 3},
+        })
+
+    def test_select(self):
+        self.assertEqual(self.store.select([('price', 'lte', 50)]), ['p0', 'p1'])
+        self.assertEqual(self.store.select([('price', 'gt', 20), ('rooms', 'gte', 2)]), ['p0', 'p3'])
+        self.assertEqual(self.store.select([('rooms', 'eq', 1)]), ['p2'])
+        self.assertEqual(self.store.select([]), ['p0', 'p1', 'p2', 'p3'])
+
+    def test_aggregate_skips_values_that_are_not_numbers(self):
+        self.assertEqual(self.store.aggregate('price', 'count', []), 3)
+        self.assertEqual(self.store.aggregate('price', 'sum', []), 150.5)
+        self.assertEqual(self.store.aggregate('rooms', 'max', [('price', 'lt', 60)]), 2)
+        self.assertEqual(self.store.aggregate('rooms', 'mean', []), 2)
+        self.assertIsNone(self.store.aggregate('rooms', 'min', [('price', 'gt', 100)]))
+
+    def test_updates_leave_frozen_copies_unchanged(self):
+        frozen = copy(self.store)
+        self.store.update('p0', {'price': 50, 'rooms': 2}, {'price': 90, 'rooms': 2})
+        self.store.update('p1', {'price': 20.5}, None)
+        self.store.update('p4', None, {'price': 10})
+        self.assertEqual(self.store.select([('price', 'lt', 100)]), ['p3', 'p0', 'p4'])
+        self.assertEqual(frozen.select([('price', 'lt', 100)]), ['p0', 'p1', 'p3'])
+        self.assertEqual(frozen.aggregate('price', 'sum', []), 150.5)
+        self.assertEqual(self.store.aggregate('price', 'sum', []), 180)
+
+    def test_unchanged_columns_keep_their_row(self):
+        self.store.update('p0', {'price': 50, 'rooms': 2, 'name': 'A'}, {'price': 50, 'rooms': 2, 'name': 'B'})
+        self.assertEqual(self.store.version, 0)
+        self.assertEqual(self.store.rows['p0'], 0)
+
+    def test_dead_rows_are_compacted(self):
+        store = ColumnStore(('price',))
+        store.build({})
+        frozen = []
+        for i in range(3000):
+            store.update('p0', None if i == 0 else {'price': i - 1}, {'price': i})
+            if i in (10, 2999):
+                frozen.append(copy(store))
+        self.assertLess(store.size, 2100)
+        self.assertEqual(store.select([('price', 'gte', 0)]), ['p0'])
+        self.assertEqual(store.aggregate('price', 'max', []), 2999)
+        self.assertEqual([version.aggregate('price', 'max', []) for version in frozen], [10, 2999])
+
+    def test_numbers_too_large_for_a_float_are_not_numbers(self):
+        store = ColumnStore(('price',))
+        store.build({'p0': {'price': 10 ** 400}, 'p1': {'price': math.nan}, 'p2': {'price': True}})
+        self.assertEqual(store.select([('price', 'gte', 0)]), ['p2'])
+
+
+@unittest.skipUnless(HAVE_NUMPY, 'needs numpy')
+class TestDataManagerColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.data_manager = DataManager(None)
+        self.data_manager.save_many('places', ((f"p{i}", {
+            'id': f"p{i}", 'city_id': f"c{i % 4}", 'price_per_night': i % 500, 'max_guests': i % 7,
+        }) for i in range(4 * ROWS_PER_CANDIDATE)))
+
+    def place_ids(self, **criteria):
+        return sorted(place['id'] for place in self.data_manager.find('places', **criteria))
+
+    def scanned_ids(self, **criteria):
+        return sorted(place['id'] for place in IPersistenceManager.find(self.data_manager, 'places', **criteria))
+
+    def test_find_filters_on_columns_when_no_index_is_selective(self):
+        self.assertNotIn('places', self.data_manager.column_stores)
+        criteria = {'price_per_night__gte': 100, 'max_guests__lt': 3, 'city_id': 'c1'}
+        self.assertEqual(self.place_ids(**criteria), self.scanned_ids(**criteria))
+        self.assertIn('places', self.data_manager.column_stores)
+        self.assertEqual(self.place_ids(max_guests=6), self.scanned_ids(max_guests=6))
+
+    def test_columns_follow_writes_and_snapshots(self):
+        self.assertEqual(self.data_manager.aggregate('places', 'max_guests', 'count', max_guests__gte=6), 146)
+        with self.data_manager.snapshot() as view:
+            self.data_manager.save('places', 'new', {'id': 'new', 'max_guests': 9})
+            self.data_manager.update('places', 'p6', {'id': 'p6', 'max_guests': 1})
+            self.data_manager.delete('places', 'p13')
+            self.assertEqual(view.aggregate('places', 'max_guests', 'count', max_guests__gte=6), 146)
+        self.assertEqual(self.data_manager.aggregate('places', 'max_guests', 'count', max_guests__gte=6), 145)
+        self.assertEqual(self.data_manager.aggregate('places', 'max_guests', 'max'), 9)
+        self.assertEqual(self.place_ids(max_guests__gte=6), self.scanned_ids(max_guests__gte=6))
+        self.assertEqual(self.data_manager.index_stats()['places.columns']['keys'], 4 * ROWS_PER_CANDIDATE)
+
+    def test_aggregate_matches_python(self):
+        for function in ('count', 'sum', 'min', 'max', 'mean'):
+            vectorized = self.data_manager.aggregate('places', 'price_per_night', function, max_guests__lte=3)
+            expected = IPersistenceManager.aggregate(
+                self.data_manager, 'places', 'price_per_night', function, max_guests__lte=3)
+            self.assertAlmostEqual(vectorized, expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import os
+import tempfile
+import unittest
+from engines import ENGINES, create_data_manager
+import threading
+from persistence_manager import DuplicateKeyError, VersionConflictError
+
+class PersistenceConformance:
+    """Behaviour every storage engine in engines.ENGINES must share."""
+
+    engine = None
+    options = {}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, f"storage.{self.engine}")
+        self.manager = self.open_manager()
+
+    def tearDown(self):
+        self.close_manager(self.manager)
+        self.tmpdir.cleanup()
+
+    def open_manager(self):
+        return create_data_manager(self.engine, self.path, **self.options)
+
+    def close_manager(self, manager):
+        if hasattr(manager, 'close'):
+            manager.close()
+        elif getattr(manager, 'journal', None):
+            manager.journal.close()
+
+    def test_save_and_get(self):
+        self.manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        self.assertEqual(self.manager.get('users', 'u1'), {'id': 'u1', 'email': 'a@example.com'})
+        self.assertIsNone(self.manager.get('users', 'missing'))
+        self.assertIsNone(self.manager.get('unknown', 'u1'))
+
+    def test_update_replaces_existing_entity_only(self):
+        self.assertFalse(self.manager.update('users', 'u1', {'id': 'u1'}))
+        self.assertIsNone(self.manager.get('users', 'u1'))
+        self.manager.save('users', 'u1', {'id': 'u1', 'first_name': 'Ann'})
+        self.assertTrue(self.manager.update('users', 'u1', {'id': 'u1', 'first_name': 'Bea'}))
+        self.assertEqual(self.manager.get('users', 'u1')['first_name'], 'Bea')
+
+    def test_delete(self):
+        self.manager.save('amenities', 'a1', {'id': 'a1', 'name': 'Pool'})
+        self.assertTrue(self.manager.delete('amenities', 'a1'))
+        self.assertFalse(self.manager.delete('amenities', 'a1'))
+        self.assertIsNone(self.manager.get('amenities', 'a1'))
+
+    def test_get_all_keeps_insertion_order_across_updates(self):
+        for entity_id in ('c', 'a', 'b'):
+            self.manager.save('cities', entity_id, {'id': entity_id})
+        self.manager.update('cities', 'c', {'id': 'c', 'name': 'Renamed'})
+        self.manager.save('cities', 'a', {'id': 'a', 'name': 'Saved again'})
+        self.assertEqual([city['id'] for city in self.manager.get_all('cities')], ['c', 'a', 'b'])
+        self.assertEqual(self.manager.get_all('unknown'), [])
+
+    def test_save_many(self):
+        self.manager.save_many('places', ((str(i), {'id': str(i)}) for i in range(5)))
+        self.assertEqual(len(self.manager.get_all('places')), 5)
+
+    def test_find(self):
+        for i in range(6):
+            self.manager.save('reviews', str(i), {'id': str(i), 'place_id': f"p{i % 2}", 'rating': i % 3})
+        self.assertEqual([r['id'] for r in self.manager.find('reviews', place_id='p1')], ['1', '3', '5'])
+        self.assertEqual([r['id'] for r in self.manager.find('reviews', place_id='p0', rating=1)], ['4'])
+        self.assertEqual(self.manager.find('reviews', place_id='missing'), [])
+
+    def test_find_with_range_lookups(self):
+        for i, price in enumerate([80, 20, 50, 120]):
+            self.manager.save('places', str(i), {'id': str(i), 'price_per_night': price, 'city_id': 'c1'})
+        cheap = self.manager.find('places', price_per_night__lte=50)
+        self.assertEqual(sorted(place['id'] for place in cheap), ['1', '2'])
+        mid = self.manager.find('places', city_id='c1', price_per_night__gt=20, price_per_night__lt=120)
+        self.assertEqual(sorted(place['id'] for place in mid), ['0', '2'])
+
+    def test_aggregate(self):
+        for i, price in enumerate([80, 20, 50, 120, None]):
+            place = {'id': str(i), 'city_id': 'c1' if i < 3 else 'c2'}
+            if price is not None:
+                place['price_per_night'] = price
+            self.manager.save('places', str(i), place)
+        self.assertEqual(self.manager.aggregate('places', 'price_per_night', 'count'), 4)
+        self.assertEqual(self.manager.aggregate('places', 'price_per_night', 'sum'), 270)
+        self.assertEqual(self.manager.aggregate('places', 'price_per_night', 'max', city_id='c1'), 80)
+        self.assertEqual(self.manager.aggregate('places', 'price_per_night', 'min', price_per_night__gt=20), 50)
+        self.assertAlmostEqual(self.manager.aggregate('places', 'price_per_night', 'mean', price_per_night__gte=50),
+                               250 / 3)
+        self.assertEqual(self.manager.aggregate('places', 'price_per_night', 'count', city_id='missing'), 0)
+        self.assertIsNone(self.manager.aggregate('places', 'price_per_night', 'min', city_id='missing'))
+        self.assertIsNone(self.manager.aggregate('unknown', 'price_per_night', 'mean'))
+        with self.assertRaises(ValueError):
+            self.manager.aggregate('places', 'price_per_night', 'median')
+
+    def test_unique_email_is_enforced(self):
+        self.manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        self.manager.save('users', 'u2', {'id': 'u2', 'email': 'b@example.com'})
+        with self.assertRaises(DuplicateKeyError):
+            self.manager.save('users', 'u3', {'id': 'u3', 'email': 'a@example.com'})
+        with self.assertRaises(DuplicateKeyError):
+            self.manager.update('users', 'u2', {'id': 'u2', 'email': 'a@example.com'})
+        self.assertIsNone(self.manager.get('users', 'u3'))
+        self.assertEqual(self.manager.get('users', 'u2')['email'], 'b@example.com')
+
+    def test_get_page_walks_collection_in_id_order(self):
+        for entity_id in ('d', 'b', 'e', 'a', 'c'):
+            self.manager.save('amenities', entity_id, {'id': entity_id})
+        page, after = self.manager.get_page('amenities', 2)
+        self.assertEqual([entity['id'] for entity in page], ['a', 'b'])
+        self.manager.delete('amenities', 'c')
+        self.manager.save('amenities', 'bb', {'id': 'bb'})
+        page, after = self.manager.get_page('amenities', 2, after)
+        self.assertEqual([entity['id'] for entity in page], ['bb', 'd'])
+        page, after = self.manager.get_page('amenities', 2, after)
+        self.assertEqual(([entity['id'] for entity in page], after), (['e'], None))
+        self.assertEqual(self.manager.get_page('unknown', 2), ([], None))
+
+    def test_iter_all_pages_through_collection(self):
+        self.manager.save_many('reviews', ((f"r{i:02d}", {'id': f"r{i:02d}"}) for i in range(25)))
+        reviews = self.manager.iter_all('reviews', chunk_size=10)
+        self.assertEqual([review['id'] for review in reviews], [f"r{i:02d}" for i in range(25)])
+        self.assertEqual(list(self.manager.iter_all('unknown')), [])
+
+    def test_versions_change_on_every_write(self):
+        self.assertIsNone(self.manager.get_version('users', 'u1'))
+        empty = self.manager.get_version('users')
+        self.manager.save('users', 'u1', {'id': 'u1'})
+        self.manager.save('users', 'u2', {'id': 'u2'})
+        first = self.manager.get_version('users', 'u1')
+        collection = self.manager.get_version('users')
+        self.assertNotEqual(collection.tag, empty.tag)
+        self.assertEqual(self.manager.get_version('users', 'u1'), first)
+        self.manager.update('users', 'u1', {'id': 'u1', 'first_name': 'Ann'})
+        self.assertNotEqual(self.manager.get_version('users', 'u1').tag, first.tag)
+        self.assertGreaterEqual(self.manager.get_version('users', 'u1').modified_at, first.modified_at)
+        self.assertNotEqual(self.manager.get_version('users').tag, collection.tag)
+        collection = self.manager.get_version('users')
+        self.manager.update('users', 'missing', {'id': 'missing'})
+        self.manager.get('users', 'u2')
+        self.assertEqual(self.manager.get_version('users'), collection)
+        self.manager.delete('users', 'u2')
+        self.assertIsNone(self.manager.get_version('users', 'u2'))
+        self.assertNotEqual(self.manager.get_version('users').tag, collection.tag)
+
+    def test_conditional_update_and_delete(self):
+        self.manager.save('places', 'p1', {'id': 'p1', 'name': 'Loft'})
+        seen = self.manager.get_version('places', 'p1').tag
+        self.assertTrue(self.manager.update('places', 'p1', {'id': 'p1', 'name': 'Attic'}, expected_version=seen))
+        with self.assertRaises(VersionConflictError):
+            self.manager.update('places', 'p1', {'id': 'p1', 'name': 'Lost'}, expected_version=seen)
+        with self.assertRaises(VersionConflictError):
+            self.manager.delete('places', 'p1', expected_version=seen)
+        self.assertEqual(self.manager.get('places', 'p1')['name'], 'Attic')
+        current = self.manager.get_version('places', 'p1').tag
+        self.assertFalse(self.manager.update('places', 'missing', {'id': 'missing'}, expected_version=current))
+        self.assertTrue(self.manager.delete('places', 'p1', expected_version=current))
+        self.assertIsNone(self.manager.get('places', 'p1'))
+
+    def test_concurrent_compare_and_set_loses_no_updates(self):
+        self.manager.save('places', 'p1', {'id': 'p1', 'views': 0})
+
+        def increment():
+            for _ in range(20):
+                while True:
+                    version = self.manager.get_version('places', 'p1').tag
+                    views = self.manager.get('places', 'p1')['views']
+                    try:
+                        self.manager.update('places', 'p1', {'id': 'p1', 'views': views + 1},
+                                            expected_version=version)
+                        break
+                    except VersionConflictError:
+                        pass
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.manager.get('places', 'p1')['views'], 80)
+
+    def test_snapshot_reads_ignore_concurrent_writes(self):
+        self.manager.save('cities', 'lyon', {'id': 'lyon', 'country_code': 'FR'})
+        with self.manager.snapshot() as view:
+            self.assertEqual(len(view.get_all('cities')), 1)
+            writer = threading.Thread(target=self.manager.save,
+                                      args=('cities', 'nice', {'id': 'nice', 'country_code': 'FR'}))
+            writer.start()
+            writer.join()
+            self.assertIsNone(view.get('cities', 'nice'))
+            self.assertEqual([city['id'] for city in view.find('cities', country_code='FR')], ['lyon'])
+            self.assertEqual([city['id'] for city in view.iter_all('cities')], ['lyon'])
+        self.assertEqual(len(self.manager.get_all('cities')), 2)
+
+    def test_data_survives_reopen(self):
+        if self.engine == 'memory':
+            self.skipTest('the memory engine does not persist')
+        self.manager.save('users', 'u1', {'id': 'u1'})
+        self.manager.save('users', 'u2', {'id': 'u2'})
+        self.manager.delete('users', 'u2')
+        self.close_manager(self.manager)
+        self.manager = self.open_manager()
+        self.assertEqual(self.manager.get_all('users'), [{'id': 'u1'}])
+
+
+for _engine in ENGINES:
+    _name = f"Test{_engine.capitalize()}EngineConformance"
+    globals()[_name] = type(_name, (PersistenceConformance, unittest.TestCase), {'engine': _engine})
+
+# Region snapshots, compacted often so reads hit both the mapping and the changes on top.
+for _engine in ('json', 'journal', 'shared'):
+    _name = f"Test{_engine.capitalize()}EngineRegionFormatConformance"
+    globals()[_name] = type(_name, (PersistenceConformance, unittest.TestCase), {
+        'engine': _engine, 'options': {'storage_format': 'region', 'compact_min_records': 2}})
+
+# One snapshot file per collection, in both formats.
+for _engine in ('json', 'journal'):
+    for _format in ('json', 'region'):
+        _name = f"Test{_engine.capitalize()}EngineSplit{_format.capitalize()}Conformance"
+        globals()[_name] = type(_name, (PersistenceConformance, unittest.TestCase), {
+            'engine': _engine, 'options': {'split': True, 'storage_format': _format, 'compact_min_records': 2}})
+
+# Tiered storage with room for only a few entities, so most reads fault them back in.
+for _engine in ('json', 'journal'):
+    _name = f"Test{_engine.capitalize()}EngineTieredConformance"
+    globals()[_name] = type(_name, (PersistenceConformance, unittest.TestCase), {
+        'engine': _engine, 'options': {'memory_budget': 1000, 'compact_min_records': 2}})
+
+class TestCreateDataManager(unittest.TestCase):
+
+    def test_engines_reject_options_they_cannot_honour(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'storage.db')
+            for engine in ('sqlite', 'memory'):
+                with self.subTest(engine=engine):
+                    with self.assertRaisesRegex(ValueError, 'memory_budget, split'):
+                        create_data_manager(engine, path, split=True, memory_budget=1000)
+                    with self.assertRaisesRegex(ValueError, 'unknown'):
+                        create_data_manager(engine, path, unknown=1)
+                    create_data_manager(engine, path, durability='batch', storage_format='json', split=False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,22 @@
+import os
+import tempfile
 import unittest
 import json
+import random
+import threading
 import uuid
+from unittest import mock
 from data_manager import DataManager
+from indexes import HashIndex, KeyIndex
+from models import User
+from persistence_manager import DuplicateKeyError
 
 class TestDataManager(unittest.TestCase):
 
     def setUp(self):
-        self.data_manager = DataManager('data/storage.json')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.data_manager = DataManager(os.path.join(self.tmpdir.name, 'storage.json'))
 
     def test_save_and_get_user(self):
         user_id = str(uuid.uuid4())
@@ -54,5 +64,209 @@ class TestDataManager(unittest.TestCase):
         user = self.data_manager.get('users', user_id)
         self.assertIsNone(user)
 
+    def test_users_are_stored_as_records_and_read_as_dicts(self):
+        user_data = {"id": "u1", "email": "testuser@example.com", "nickname": "tess"}
+        self.data_manager.save('users', 'u1', user_data)
+        self.assertIsInstance(self.data_manager.storage['users']['u1'], User)
+        user = self.data_manager.get('users', 'u1')
+        self.assertEqual(user, user_data)
+        user['email'] = "changed@example.com"
+        self.assertEqual(self.data_manager.get('users', 'u1')['email'], "testuser@example.com")
+        self.assertEqual(self.data_manager.find('users', email="testuser@example.com"), [user_data])
+        reopened = DataManager(os.path.join(self.tmpdir.name, 'storage.json'))
+        self.assertIsInstance(reopened.storage['users']['u1'], User)
+        self.assertEqual(reopened.get_json('users', 'u1'), json.dumps(user_data, separators=(',', ':')).encode() + b'\n')
+
+class TestReviewIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.data_manager = DataManager(None)
+        for i in range(6):
+            self.data_manager.save('reviews', f"r{i}", {
+                "id": f"r{i}", "place_id": f"p{i % 2}", "user_id": f"u{i % 3}", "rating": 5
+            })
+
+    def review_ids(self, **criteria):
+        return [review['id'] for review in self.data_manager.find('reviews', **criteria)]
+
+    def test_find_by_indexed_fields(self):
+        self.assertEqual(self.review_ids(place_id='p0'), ['r0', 'r2', 'r4'])
+        self.assertEqual(self.review_ids(user_id='u1'), ['r1', 'r4'])
+        self.assertEqual(self.review_ids(place_id='p0', user_id='u1'), ['r4'])
+        self.assertEqual(self.review_ids(place_id='nowhere'), [])
+
+    def test_index_follows_update_and_delete(self):
+        self.data_manager.update('reviews', 'r0', {"id": "r0", "place_id": "p1", "user_id": "u0"})
+        self.data_manager.delete('reviews', 'r2')
+        self.assertEqual(self.review_ids(place_id='p0'), ['r4'])
+        self.assertIn('r0', self.review_ids(place_id='p1'))
+        self.data_manager.delete('reviews', 'r4')
+        self.assertNotIn('p0', self.data_manager.indexes['reviews']['place_id'].postings)
+
+    def test_find_only_visits_matching_reviews(self):
+        self.data_manager.find('reviews', user_id='u0')
+        collection = self.data_manager._collections['reviews']
+        self.data_manager._collections['reviews'] = collection._replace(entities=ExplodingDict(collection.entities))
+        self.assertEqual(self.review_ids(user_id='u2'), ['r2', 'r5'])
+
+class TestCityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data_manager = DataManager(None)
+        for name, code in (('Boston', 'US'), ('Lyon', 'FR'), ('Austin', 'US'), ('Denver', 'US')):
+            self.data_manager.save('cities', name, {"id": name, "name": name, "country_code": code})
+
+    def city_ids(self, code):
+        return [city['id'] for city in self.data_manager.find('cities', country_code=code)]
+
+    def test_find_cities_by_country_code(self):
+        self.assertEqual(self.city_ids('US'), ['Austin', 'Boston', 'Denver'])
+        self.assertEqual(self.city_ids('FR'), ['Lyon'])
+        self.assertEqual(self.city_ids('JP'), [])
+
+    def test_order_is_stable_across_updates(self):
+        self.data_manager.update('cities', 'Boston', {"id": "Boston", "name": "Boston, MA", "country_code": "US"})
+        self.assertEqual(self.city_ids('US'), ['Austin', 'Boston', 'Denver'])
+        self.data_manager.update('cities', 'Lyon', {"id": "Lyon", "name": "Lyon", "country_code": "US"})
+        self.assertEqual(self.city_ids('US'), ['Austin', 'Boston', 'Denver', 'Lyon'])
+        self.assertEqual(self.city_ids('FR'), [])
+
+    def test_order_does_not_depend_on_when_the_index_was_built(self):
+        self.city_ids('US')
+        self.data_manager.update('cities', 'Lyon', {"id": "Lyon", "name": "Lyon", "country_code": "US"})
+        self.data_manager.save('cities', 'Albany', {"id": "Albany", "name": "Albany", "country_code": "US"})
+        rebuilt = DataManager(None)
+        for city in self.data_manager.get_all('cities'):
+            rebuilt.save('cities', city['id'], city)
+        self.assertEqual([city['id'] for city in rebuilt.find('cities', country_code='US')], self.city_ids('US'))
+
+class TestConcurrentAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+        self.journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+
+    def run_threads(self, target, count):
+        errors = []
+
+        def run(n):
+            try:
+                target(n)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_many_threads_reading_writing_and_snapshotting(self):
+        data_manager = DataManager(self.storage_file, journal_file=self.journal_file, compact_min_records=50)
+
+        def hammer(n):
+            rng = random.Random(n)
+            for i in range(200):
+                entity_type = rng.choice(['places', 'reviews', f"extra{rng.randrange(4)}"])
+                entity_id = f"{n}-{rng.randrange(20)}"
+                action = rng.random()
+                if action < 0.4:
+                    data_manager.save(entity_type, entity_id, {'id': entity_id, 'place_id': f"p{i % 3}"})
+                elif action < 0.5:
+                    data_manager.delete(entity_type, entity_id)
+                elif action < 0.6:
+                    data_manager.find('reviews', place_id='p1')
+                elif action < 0.7:
+                    list(data_manager.iter_all('places', chunk_size=7))
+                elif action < 0.75:
+                    data_manager.checkpoint()
+                else:
+                    data_manager.get_all(entity_type)
+
+        self.run_threads(hammer, 16)
+        expected = {entity_type: dict(entities) for entity_type, entities in data_manager.storage.items()}
+        reviews = data_manager.storage.get('reviews', {}).values()
+        self.assertEqual(sorted(review['id'] for review in data_manager.find('reviews', place_id='p1')),
+                         sorted(review['id'] for review in reviews if review['place_id'] == 'p1'))
+        data_manager.journal.close()
+        reopened = DataManager(self.storage_file, journal_file=self.journal_file)
+        self.assertEqual({entity_type: entities for entity_type, entities in reopened.storage.items() if entities},
+                         {entity_type: entities for entity_type, entities in expected.items() if entities})
+        reopened.journal.close()
+
+    def test_concurrent_saves_keep_emails_unique(self):
+        data_manager = DataManager(None)
+        saved = []
+
+        def register(n):
+            try:
+                data_manager.save('users', f"u{n}", {'id': f"u{n}", 'email': 'same@example.com'})
+                saved.append(n)
+            except DuplicateKeyError:
+                pass
+
+        self.run_threads(register, 16)
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(len(data_manager.get_all('users')), 1)
+
+    def test_reads_never_wait_for_writers(self):
+        data_manager = DataManager(None)
+        data_manager.save('places', 'p1', {'id': 'p1', 'city_id': 'c1'})
+        data_manager.find('places', city_id='c1')
+        data_manager.get_page('places', 10)
+        result = []
+
+        def read():
+            result.append(data_manager.get_all('places'))
+            result.append(data_manager.find('places', city_id='c1'))
+            result.append(data_manager.get_page('places', 10))
+
+        with data_manager._lock('places'):
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join(5)
+        self.assertEqual(result, [[{'id': 'p1', 'city_id': 'c1'}]] * 2 + [([{'id': 'p1', 'city_id': 'c1'}], None)])
+
+    def test_snapshot_ignores_later_writes(self):
+        data_manager = DataManager(None)
+        data_manager.save('countries', 'fr', {'id': 'fr', 'code': 'FR'})
+        data_manager.save('cities', 'lyon', {'id': 'lyon', 'country_code': 'FR'})
+        with data_manager.snapshot() as view:
+            data_manager.save('cities', 'nice', {'id': 'nice', 'country_code': 'FR'})
+            data_manager.delete('countries', 'fr')
+            self.assertEqual(view.get('countries', 'fr'), {'id': 'fr', 'code': 'FR'})
+            self.assertEqual([city['id'] for city in view.find('cities', country_code='FR')], ['lyon'])
+            self.assertEqual([city['id'] for city in view.iter_all('cities', chunk_size=1)], ['lyon'])
+        self.assertEqual(len(data_manager.find('cities', country_code='FR')), 2)
+
+    def test_view_builds_what_it_needs_once(self):
+        data_manager = DataManager(None)
+        for n in range(20):
+            data_manager.save('places', f"p{n:02}", {'id': f"p{n:02}", 'city_id': 'c1'})
+        found = []
+        with data_manager.snapshot() as view, \
+                mock.patch.object(KeyIndex, 'build', autospec=True, side_effect=KeyIndex.build) as key_build, \
+                mock.patch.object(HashIndex, 'build', autospec=True, side_effect=HashIndex.build) as hash_build:
+            for place in view.iter_all('places', chunk_size=2):
+                data_manager.save('places', f"q{place['id']}", {'id': f"q{place['id']}", 'city_id': 'c1'})
+                found.append(len(view.find('places', city_id='c1')))
+        self.assertEqual(found, [20] * 20)
+        # The live KeyIndex, built on the first page, serves this view too;
+        # the view gets one private HashIndex besides the live one.
+        self.assertEqual(key_build.call_count, 1)
+        self.assertEqual(hash_build.call_count, 2)
+
+class ExplodingDict(dict):
+    """A collection that fails if anything tries to scan it."""
+
+    def values(self):
+        raise AssertionError('full scan')
+
+    def __iter__(self):
+        raise AssertionError('full scan')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from data_manager import DataManager
+from indexes import HashIndex, SortedIndex, UniqueIndex
+from persistence_manager import DuplicateKeyError
+
+class TestIndexes(unittest.TestCase):
+
+    def test_sorted_index_ranges(self):
+        index = SortedIndex('price')
+        index.build({str(i): {'price': price} for i, price in enumerate([50, 20, 80, 50, None])})
+        self.assertEqual(index.lookup('eq', 50), ['0', '3'])
+        self.assertEqual(index.lookup('lt', 50), ['1'])
+        self.assertEqual(index.lookup('lte', 50), ['1', '0', '3'])
+        self.assertEqual(index.lookup('gt', 50), ['2'])
+        self.assertEqual(index.lookup('gte', 80), ['2'])
+        self.assertIsNone(index.estimate('gte', 'fifty'))
+        index.update('0', {'price': 50}, {'price': 90})
+        index.update('2', {'price': 80}, None)
+        self.assertEqual(index.lookup('gt', 50), ['0'])
+
+    def test_sorted_index_leaves_out_nan_and_non_numbers(self):
+        index = SortedIndex('price')
+        index.build({'p0': {'price': 30}, 'p1': {'price': float('nan')}, 'p2': {'price': 'cheap'}, 'p3': {'price': 10}})
+        self.assertEqual(index.lookup('lte', 30), ['p3', 'p0'])
+        index.update('p4', None, {'price': float('nan')})
+        index.update('p3', {'price': 10}, {'price': 20})
+        index.update('p0', {'price': 30}, None)
+        self.assertEqual(index.keys, [(20, 'p3')])
+        self.assertIsNone(index.estimate('lt', float('nan')))
+
+    def test_unique_index_allows_same_entity(self):
+        index = UniqueIndex('email')
+        index.build({'u1': {'email': 'a@example.com'}, 'u2': {}})
+        index.check('u1', {'email': 'a@example.com'})
+        index.check('u3', {'email': None})
+        with self.assertRaises(DuplicateKeyError):
+            index.check('u3', {'email': 'a@example.com'})
+
+    def test_hash_index_estimate(self):
+        index = HashIndex('city_id')
+        index.build({'p1': {'city_id': 'c1'}, 'p2': {'city_id': 'c1'}, 'p3': {'city_id': 'c2'}})
+        self.assertEqual(index.estimate('eq', 'c1'), 2)
+        self.assertIsNone(index.estimate('lt', 'c1'))
+        self.assertIsNone(index.estimate('eq', ['unhashable']))
+
+class TestDataManagerIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.data_manager = DataManager(None)
+        for i in range(20):
+            self.data_manager.save('places', f"p{i}", {
+                'id': f"p{i}", 'city_id': f"c{i % 4}", 'host_id': f"h{i % 10}", 'price_per_night': i * 10,
+            })
+
+    def place_ids(self, **criteria):
+        return [place['id'] for place in self.data_manager.find('places', **criteria)]
+
+    def test_indexes_are_built_lazily(self):
+        index = self.data_manager.indexes['places']['host_id']
+        self.assertFalse(index.built)
+        self.assertEqual(self.place_ids(host_id='h3'), ['p13', 'p3'])
+        self.assertTrue(index.built)
+        self.data_manager.save('places', 'p20', {'id': 'p20', 'host_id': 'h3'})
+        self.assertEqual(self.place_ids(host_id='h3'), ['p13', 'p20', 'p3'])
+
+    def test_find_picks_most_selective_index(self):
+        self.assertEqual(self.place_ids(city_id='c1', price_per_night__gte=150), ['p17'])
+        sorted_index = self.data_manager.indexes['places']['price_per_night']
+        sorted_index.lookup = None
+        self.assertEqual(self.place_ids(host_id='h1', city_id='c1', price_per_night__gte=0), ['p1'])
+
+    def test_range_and_unknown_lookups(self):
+        self.assertEqual(self.place_ids(price_per_night__lt=30), ['p0', 'p1', 'p2'])
+        with self.assertRaises(ValueError):
+            self.data_manager.find('places', price_per_night__between=(1, 2))
+
+    def test_unique_email(self):
+        self.data_manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        with self.assertRaises(DuplicateKeyError):
+            self.data_manager.save('users', 'u2', {'id': 'u2', 'email': 'a@example.com'})
+        self.assertIsNone(self.data_manager.get('users', 'u2'))
+        self.assertTrue(self.data_manager.update('users', 'u1', {'id': 'u1', 'email': 'a@example.com'}))
+
+    def test_unique_email_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            storage_file = os.path.join(tmpdir, 'storage.json')
+            journal_file = os.path.join(tmpdir, 'storage.journal')
+            first = DataManager(storage_file, journal_file=journal_file)
+            first.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+            first.journal.close()
+            restarted = DataManager(storage_file, journal_file=journal_file)
+            with self.assertRaises(DuplicateKeyError):
+                restarted.save('users', 'u2', {'id': 'u2', 'email': 'a@example.com'})
+            restarted.journal.close()
+
+    def test_nan_prices_do_not_corrupt_find(self):
+        data_manager = DataManager(None)
+        for i in range(6):
+            data_manager.save('places', f"p{i}", {'id': f"p{i}", 'price_per_night': i * 10})
+        data_manager.find('places', price_per_night__lte=25)
+        data_manager.update('places', 'p3', {'id': 'p3', 'price_per_night': float('nan')})
+        data_manager.delete('places', 'p3')
+        data_manager.delete('places', 'p4')
+        cheap = data_manager.find('places', price_per_night__lte=25)
+        self.assertEqual([place['id'] for place in cheap], ['p0', 'p1', 'p2'])
+
+    def test_index_stats(self):
+        self.place_ids(city_id='c1')
+        stats = self.data_manager.index_stats()
+        self.assertTrue(stats['places.city_id']['built'])
+        self.assertEqual(stats['places.city_id']['keys'], 4)
+        self.assertGreater(stats['places.city_id']['bytes'], 0)
+        self.assertIsNotNone(stats['places.city_id']['build_seconds'])
+        self.assertFalse(stats['reviews.user_id']['built'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+from data_manager import DataManager
+from journal import Journal
+from persistence_manager import DuplicateKeyError, VersionConflictError
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+        self.journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open_manager(self, **kwargs):
+        return DataManager(self.storage_file, journal_file=self.journal_file, **kwargs)
+
+    def test_mutations_append_without_rewriting_snapshot(self):
+        manager = self.open_manager()
+        manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        manager.update('users', 'u1', {'id': 'u1', 'email': 'b@example.com'})
+        manager.save('users', 'u2', {'id': 'u2', 'email': 'c@example.com'})
+        manager.delete('users', 'u2')
+        self.assertFalse(os.path.exists(self.storage_file))
+        self.assertEqual(manager.journal.records, 4)
+
+    def test_replay_rebuilds_storage_on_top_of_snapshot(self):
+        manager = self.open_manager()
+        manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        manager.checkpoint()
+        manager.update('users', 'u1', {'id': 'u1', 'email': 'b@example.com'})
+        manager.save('places', 'p1', {'id': 'p1', 'name': 'Loft'})
+        manager.journal.close()
+
+        reopened = self.open_manager()
+        self.assertEqual(reopened.get('users', 'u1')['email'], 'b@example.com')
+        self.assertEqual(reopened.get('places', 'p1')['name'], 'Loft')
+
+    def test_journal_is_compacted_into_snapshot(self):
+        manager = self.open_manager(compact_min_records=3)
+        for i in range(3):
+            manager.save('amenities', str(i), {'id': str(i), 'name': 'Wi-Fi'})
+        self.assertEqual(manager.journal.records, 0)
+        self.assertTrue(os.path.exists(self.storage_file))
+        self.assertEqual(len(self.open_manager().get_all('amenities')), 3)
+
+    def test_torn_tail_record_is_dropped(self):
+        manager = self.open_manager()
+        manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        manager.journal.close()
+        with open(self.journal_file, 'ab') as f:
+            f.write(b'{"op":"put","type":"users","id":"u2","da')
+
+        reopened = self.open_manager()
+        self.assertIsNone(reopened.get('users', 'u2'))
+        reopened.save('users', 'u3', {'id': 'u3', 'email': 'c@example.com'})
+        reopened.journal.close()
+        records = list(Journal(self.journal_file).replay())
+        self.assertEqual([record[1] for record in records], ['u1', 'u3'])
+
+    def commit_concurrently(self, journal, writers):
+        barrier = threading.Barrier(writers)
+
+        def write(i):
+            barrier.wait()
+            journal.commit(journal.append('reviews', str(i), {'id': str(i)}))
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_always_durability_syncs_every_commit(self):
+        journal = Journal(self.journal_file, durability='always')
+        for i in range(3):
+            journal.commit(journal.append('users', str(i), {'id': str(i)}))
+        self.assertEqual(journal.syncs, 3)
+
+    def test_always_durability_syncs_every_concurrent_commit(self):
+        journal = Journal(self.journal_file, durability='always')
+        self.commit_concurrently(journal, 16)
+        self.assertEqual(journal.syncs, 16)
+        self.assertEqual(len(list(Journal(self.journal_file).replay())), 16)
+
+    def test_group_window_reaches_the_journal(self):
+        manager = self.open_manager(group_window=0.01)
+        self.assertEqual(manager.journal.group_window, 0.01)
+        manager.journal.close()
+
+    def test_batch_durability_groups_concurrent_commits(self):
+        journal = Journal(self.journal_file, durability='batch', group_window=0.01)
+        self.commit_concurrently(journal, 16)
+        self.assertLess(journal.syncs, 16)
+        self.assertEqual(len(list(Journal(self.journal_file).replay())), 16)
+
+    def test_interval_durability_flushes_in_background(self):
+        journal = Journal(self.journal_file, durability='interval', flush_interval=0.01)
+        journal.commit(journal.append('users', 'u1', {'id': 'u1'}))
+        journal._flusher.join(0.2)
+        self.assertEqual(len(list(Journal(self.journal_file).replay())), 1)
+
+    def test_unknown_durability_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Journal(self.journal_file, durability='never')
+
+
+def count_visits(storage_file, journal_file, visits):
+    """Run in a worker process: add visits to a shared counter with compare-and-set."""
+    manager = DataManager(storage_file, journal_file=journal_file, shared=True, compact_min_records=10)
+    for _ in range(visits):
+        while True:
+            counter = manager.get('places', 'p1')
+            try:
+                manager.update('places', 'p1', {'id': 'p1', 'visits': counter['visits'] + 1},
+                               expected_version=manager.get_version('places', 'p1').tag)
+                break
+            except VersionConflictError:
+                pass
+    manager.close()
+
+
+class TestSharedJournal(unittest.TestCase):
+    """Several managers on the same files, standing in for gunicorn workers."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+        self.journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        self.tmpdir.cleanup()
+
+    def open_manager(self, **kwargs):
+        manager = DataManager(self.storage_file, journal_file=self.journal_file, shared=True,
+                              sync_interval=0.01, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'write never became visible')
+            time.sleep(0.005)
+
+    def test_writes_become_visible_to_other_managers(self):
+        first, second = self.open_manager(), self.open_manager()
+        first.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        self.wait_for(lambda: second.get('users', 'u1') is not None)
+        second.delete('users', 'u1')
+        self.wait_for(lambda: first.get('users', 'u1') is None)
+        self.assertEqual(first.find('users', email='a@example.com'), [])
+
+    def test_unique_index_holds_across_managers(self):
+        first, second = self.open_manager(), self.open_manager()
+        second.find('users', email='a@example.com')
+        first.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        with self.assertRaises(DuplicateKeyError):
+            second.save('users', 'u2', {'id': 'u2', 'email': 'a@example.com'})
+
+    def test_versions_agree_across_managers(self):
+        first, second = self.open_manager(), self.open_manager()
+        first.save('places', 'p1', {'id': 'p1', 'name': 'Loft'})
+        self.wait_for(lambda: second.get('places', 'p1') is not None)
+        version = first.get_version('places', 'p1')
+        self.assertEqual(second.get_version('places', 'p1'), version)
+        self.assertEqual(second.get_version('places'), first.get_version('places'))
+        second.update('places', 'p1', {'id': 'p1', 'name': 'Attic'}, expected_version=version.tag)
+        with self.assertRaises(VersionConflictError):
+            first.update('places', 'p1', {'id': 'p1', 'name': 'Cellar'}, expected_version=version.tag)
+        self.assertEqual(first.get('places', 'p1')['name'], 'Attic')
+
+    def test_compaction_by_one_manager_is_picked_up_by_others(self):
+        first, second = self.open_manager(compact_min_records=3), self.open_manager(compact_min_records=3)
+        for i in range(5):
+            first.save('amenities', str(i), {'id': str(i), 'name': 'Wi-Fi'})
+        self.assertTrue(os.path.exists(self.storage_file))
+        self.wait_for(lambda: len(second.get_all('amenities')) == 5)
+        self.wait_for(lambda: second.get_version('amenities', '4') == first.get_version('amenities', '4'))
+        second.save('amenities', '5', {'id': '5', 'name': 'Pool'})
+        self.wait_for(lambda: first.get('amenities', '5') is not None)
+        self.assertEqual(len(self.open_manager().get_all('amenities')), 6)
+
+    def test_mapped_managers_read_snapshots_from_the_region_file(self):
+        first = self.open_manager(compact_min_records=3, mapped=True)
+        second = self.open_manager(compact_min_records=3, mapped=True)
+        for i in range(4):
+            first.save('places', str(i), {'id': str(i), 'price_per_night': i})
+        self.assertTrue(os.path.exists(first.region_file))
+        self.wait_for(lambda: len(second.get_all('places')) == 4)
+        self.assertEqual(second.get_json('places', '1'), b'{"id":"1","price_per_night":1}\n')
+        second.update('places', '1', {'id': '1', 'price_per_night': 10})
+        second.delete('places', '2')
+        self.wait_for(lambda: first.get('places', '2') is None)
+        self.assertEqual(first.get('places', '1')['price_per_night'], 10)
+        self.assertEqual([place['id'] for place in first.find('places', price_per_night__gte=3)], ['3', '1'])
+        self.assertEqual(len(self.open_manager(mapped=True).get_all('places')), 3)
+
+    def test_stale_region_file_is_rebuilt(self):
+        first = self.open_manager(compact_min_records=1, mapped=True)
+        first.save('users', 'u1', {'id': 'u1'})
+        first.close()
+        os.remove(first.region_file)
+        reopened = self.open_manager(mapped=True)
+        self.assertEqual(reopened.get('users', 'u1'), {'id': 'u1'})
+        self.assertTrue(os.path.exists(reopened.region_file))
+
+    def test_damaged_region_file_is_rebuilt(self):
+        first = self.open_manager(compact_min_records=1, mapped=True)
+        first.save('users', 'u1', {'id': 'u1'})
+        first.close()
+        with open(first.region_file, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'!!')
+        reopened = self.open_manager(mapped=True)
+        self.assertEqual(reopened.get('users', 'u1'), {'id': 'u1'})
+
+    def test_shared_mode_needs_a_journal(self):
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file, shared=True)
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file, journal_file=self.journal_file, mapped=True)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_processes_share_one_store(self):
+        manager = self.open_manager()
+        manager.save('places', 'p1', {'id': 'p1', 'visits': 0})
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=count_visits, args=(self.storage_file, self.journal_file, 25))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+        self.wait_for(lambda: manager.get('places', 'p1')['visits'] == 100)
+
+if __name__ == '__main__':
+    unittest.main()
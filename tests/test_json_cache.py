@@ -0,0 +1,51 @@
+import json
+import unittest
+from data_manager import DataManager
+from json_cache import JSONCache
+
+class TestJSONCache(unittest.TestCase):
+
+    def test_hits_misses_and_lru_eviction(self):
+        cache = JSONCache(max_bytes=10)
+        self.assertEqual(cache.get_or_build(('users', 'a'), lambda: b'aaaa'), b'aaaa')
+        self.assertEqual(cache.get_or_build(('users', 'b'), lambda: b'bbbb'), b'bbbb')
+        self.assertEqual(cache.get_or_build(('users', 'a'), lambda: b'stale'), b'aaaa')
+        cache.get_or_build(('users', 'c'), lambda: b'cccc')
+        self.assertEqual(cache.get_or_build(('users', 'b'), lambda: b'BBBB'), b'BBBB')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 4)
+        self.assertGreaterEqual(cache.stats['evictions'], 1)
+        self.assertLessEqual(cache.stats['bytes'], 10)
+
+    def test_oversized_bodies_are_not_cached(self):
+        cache = JSONCache(max_bytes=4)
+        cache.get_or_build(('places', None), lambda: b'too large')
+        self.assertEqual(cache.stats['entries'], 0)
+
+class TestDataManagerJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.data_manager = DataManager(None)
+        self.data_manager.save('places', 'p1', {'id': 'p1', 'name': 'Loft'})
+        self.data_manager.save('places', 'p2', {'id': 'p2', 'name': 'Cabin'})
+
+    def test_entity_body_is_cached_until_update(self):
+        body = self.data_manager.get_json('places', 'p1')
+        self.assertEqual(json.loads(body), {'id': 'p1', 'name': 'Loft'})
+        self.assertIs(self.data_manager.get_json('places', 'p1'), body)
+        self.data_manager.update('places', 'p1', {'id': 'p1', 'name': 'Attic'})
+        self.assertEqual(json.loads(self.data_manager.get_json('places', 'p1'))['name'], 'Attic')
+        self.data_manager.delete('places', 'p1')
+        self.assertIsNone(self.data_manager.get_json('places', 'p1'))
+
+    def test_collection_blob_is_rebuilt_only_after_a_change(self):
+        blob = self.data_manager.get_all_json('places')
+        self.assertIs(self.data_manager.get_all_json('places'), blob)
+        self.data_manager.get_json('places', 'p2')
+        self.assertIs(self.data_manager.get_all_json('places'), blob)
+        self.data_manager.save('places', 'p3', {'id': 'p3', 'name': 'Barn'})
+        places = json.loads(self.data_manager.get_all_json('places'))
+        self.assertEqual([place['id'] for place in places], ['p1', 'p2', 'p3'])
+
+if __name__ == '__main__':
+    unittest.main()
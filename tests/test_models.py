@@ -5,6 +5,7 @@ from models.review import Review
 from models.amenity import Amenity
 from models.city import City
 from models.country import Country
+from models import RECORD_TYPES
 
 class TestModels(unittest.TestCase):
 
@@ -34,5 +35,58 @@ class TestModels(unittest.TestCase):
         self.assertEqual(city.name, "Test city")
         self.assertEqual(city.country, country)
 
+class TestRecords(unittest.TestCase):
+
+    def test_records_have_no_instance_dict(self):
+        place = Place(name="Test Place", host=User(email="host@example.com", password="password"))
+        self.assertFalse(hasattr(place, '__dict__'))
+        with self.assertRaises(AttributeError):
+            place.nickname = "Loft"
+
+    def test_dict_round_trip_keeps_missing_and_extra_keys(self):
+        data = {'id': 'p1', 'name': 'Loft', 'price_per_night': 80, 'pets': True}
+        place = Place.from_dict(data)
+        self.assertEqual(place.to_dict(), data)
+        self.assertEqual(place.get('price_per_night'), 80)
+        self.assertEqual(place.get('pets'), True)
+        self.assertIsNone(place.get('description'))
+        self.assertEqual(place['name'], 'Loft')
+        with self.assertRaises(KeyError):
+            place['description']
+        self.assertEqual(place, data)
+
+    def test_constructed_records_store_ids_of_linked_objects(self):
+        user = User(email="reviewer@example.com", password="password")
+        place = Place(name="Test Place", host=user)
+        review = Review(user=user, place=place, rating=5)
+        self.assertEqual(review.to_dict()['place_id'], place.id)
+        self.assertEqual(place.to_dict()['host_id'], user.id)
+        self.assertNotIn('host', place.to_dict())
+        self.assertEqual(Review.from_dict(review.to_dict()), Review.from_dict(review.to_dict()))
+
+    def test_timestamps_are_stored_as_epoch_microseconds(self):
+        data = {'id': 'r1', 'created_at': '2024-06-14T09:30:12.345678', 'updated_at': '2024-06-14T00:00:00'}
+        review = Review.from_dict(data)
+        self.assertEqual(review.created_at, 1718357412345678)
+        self.assertEqual(review.updated_at, 1718323200000000)
+        self.assertEqual(review.get('created_at'), '2024-06-14T09:30:12.345678')
+        self.assertEqual(review.to_dict(), data)
+
+    def test_other_timestamp_values_round_trip_unchanged(self):
+        for value in ('2024-06-14T00:00:00+00:00', '2024-06-14T00:00:00.000000', '2024-06-14', 'soon', 1718323200, None):
+            review = Review.from_dict({'id': 'r1', 'created_at': value})
+            self.assertEqual(review.to_dict(), {'id': 'r1', 'created_at': value})
+            self.assertEqual(review['created_at'], value)
+
+    def test_foreign_keys_are_interned(self):
+        first = Review.from_dict({'place_id': ''.join(['p', '1']), 'user_id': ''.join(['u', '1'])})
+        second = Review.from_dict({'place_id': ''.join(['p', '1']), 'user_id': ''.join(['u', '1'])})
+        self.assertIs(first.place_id, second.place_id)
+        self.assertIs(first.user_id, second.user_id)
+
+    def test_every_record_type_round_trips_an_empty_dict(self):
+        for record in RECORD_TYPES.values():
+            self.assertEqual(record.from_dict({}).to_dict(), {})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+import random
+import unittest
+from bisect import bisect_left, bisect_right
+from persistent import CHUNK_SIZE, SORTED_CHUNK_SIZE, PersistentMap, PersistentSortedList
+
+class TestPersistentMap(unittest.TestCase):
+
+    def test_updates_leave_older_versions_untouched(self):
+        first = PersistentMap({'a': 1, 'b': 2})
+        second = first.set('c', 3).set('a', 10)
+        third = second.delete('b')
+        self.assertEqual(dict(first.items()), {'a': 1, 'b': 2})
+        self.assertEqual(list(second.items()), [('a', 10), ('b', 2), ('c', 3)])
+        self.assertEqual(list(third), ['a', 'c'])
+        self.assertIs(third.delete('missing'), third)
+        self.assertEqual(third.get('b', 'gone'), 'gone')
+        self.assertNotIn('b', third)
+        self.assertEqual(len(third), 2)
+
+    def test_matches_a_dict_through_growth_and_compaction(self):
+        rng = random.Random(7)
+        current, expected = PersistentMap(), {}
+        versions = []
+        for i in range(20 * CHUNK_SIZE):
+            key = rng.randrange(4 * CHUNK_SIZE)
+            if rng.random() < 0.6:
+                current = current.set(key, i)
+                expected[key] = i
+            else:
+                current = current.delete(key)
+                expected.pop(key, None)
+            if i % CHUNK_SIZE == 0:
+                versions.append((current, list(expected.items())))
+        self.assertEqual(list(current.items()), list(expected.items()))
+        self.assertEqual(current, expected)
+        for version, items in versions:
+            self.assertEqual(version.items(), items)
+
+class TestPersistentSortedList(unittest.TestCase):
+
+    def test_updates_leave_older_versions_untouched(self):
+        first = PersistentSortedList([3, 1, 2])
+        second = first.add(0).remove(2)
+        self.assertEqual(list(first), [1, 2, 3])
+        self.assertEqual(list(second), [0, 1, 3])
+        self.assertIs(second.remove(7), second)
+
+    def test_matches_a_sorted_list_across_chunk_splits(self):
+        random.seed(4)
+        items, sorted_list, versions = [], PersistentSortedList(), []
+        for step in range(6 * SORTED_CHUNK_SIZE):
+            item = random.randrange(SORTED_CHUNK_SIZE)
+            if random.random() < 0.7:
+                items.append(item)
+                items.sort()
+                sorted_list = sorted_list.add(item)
+            elif item in items:
+                items.remove(item)
+                sorted_list = sorted_list.remove(item)
+            if step % 500 == 0:
+                versions.append((sorted_list, list(items)))
+        self.assertGreater(len(sorted_list._chunks), 1)
+        self.assertEqual((list(sorted_list), len(sorted_list)), (items, len(items)))
+        for version, expected in versions:
+            self.assertEqual(list(version), expected)
+        for item in range(-1, SORTED_CHUNK_SIZE + 1, 7):
+            self.assertEqual(sorted_list.bisect_left(item), bisect_left(items, item))
+            self.assertEqual(sorted_list.bisect_right(item), bisect_right(items, item))
+            self.assertEqual(item in sorted_list, item in items)
+        for start, stop in ((0, 10), (500, 1700), (len(items) - 3, len(items) + 5), (40, 20)):
+            self.assertEqual(sorted_list[start:stop], items[start:stop])
+        self.assertEqual(sorted_list[-1], items[-1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import random
+import tempfile
+import unittest
+from json_cache import encode_json
+from persistent import LayeredMap
+from region import MAGIC, PREAMBLE, Region, write_region
+
+class TestRegion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'storage.region')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        places = {str(i): {'id': str(i), 'name': f"Place {i}", 'price_per_night': i} for i in range(1000)}
+        write_region(self.path, {'places': places, 'users': {}}, epoch='e1')
+        region = Region(self.path)
+        self.assertEqual(region.epoch, 'e1')
+        mapped = region.collections['places']
+        self.assertEqual(len(mapped), 1000)
+        self.assertEqual(mapped['42'], places['42'])
+        self.assertEqual(mapped.get_json('42'), encode_json(places['42']))
+        self.assertIsNone(mapped.get('1000'))
+        self.assertIsNone(mapped.get(42))
+        self.assertNotIn('missing', mapped)
+        self.assertEqual(list(mapped), list(places))
+        self.assertEqual(mapped.values(), list(places.values()))
+        self.assertEqual(len(region.collections['users']), 0)
+
+    def test_mapped_file_survives_being_replaced(self):
+        write_region(self.path, {'users': {'u1': {'id': 'u1'}}})
+        old = Region(self.path).collections['users']
+        write_region(self.path, {'users': {'u2': {'id': 'u2'}}})
+        self.assertEqual(old['u1'], {'id': 'u1'})
+        self.assertEqual(list(Region(self.path).collections['users']), ['u2'])
+
+    def test_damaged_record_is_rejected_when_read(self):
+        users = {'u1': {'id': 'u1', 'email': 'a@example.com'}, 'u2': {'id': 'u2'}}
+        write_region(self.path, {'users': users})
+        with open(self.path, 'r+b') as f:
+            content = f.read()
+            f.seek(content.index(b'a@example.com'))
+            f.write(b'b')
+        mapped = Region(self.path).collections['users']
+        self.assertEqual(mapped['u2'], {'id': 'u2'})
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch'):
+            mapped['u1']
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch'):
+            list(mapped)
+
+    def test_damaged_hash_table_is_rejected_on_first_lookup(self):
+        write_region(self.path, {'users': {'u1': {'id': 'u1'}}})
+        table = Region(self.path).collections['users']._table
+        with open(self.path, 'r+b') as f:
+            f.seek(table)
+            f.write(b'\xff')
+        mapped = Region(self.path).collections['users']
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch'):
+            mapped.get('u1')
+
+    def test_damaged_index_is_rejected_on_open(self):
+        write_region(self.path, {'users': {'u1': {'id': 'u1'}}}, epoch='e1')
+        with open(self.path, 'r+b') as f:
+            index_offset, _, _ = PREAMBLE.unpack_from(f.read(len(MAGIC) + PREAMBLE.size), len(MAGIC))
+            f.seek(index_offset + 2)
+            f.write(b'X')
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch'):
+            Region(self.path)
+
+    def test_layered_map_matches_a_dict(self):
+        base = {str(i): i for i in range(50)}
+        write_region(self.path, {'numbers': base})
+        rng = random.Random(3)
+        current, expected = LayeredMap(Region(self.path).collections['numbers']), dict(base)
+        for i in range(60):
+            key = str(rng.randrange(100))
+            if rng.random() < 0.5:
+                current = current.set(key, -i)
+                expected[key] = -i
+            else:
+                current = current.delete(key)
+                expected.pop(key, None)
+            self.assertEqual(len(current), len(expected))
+        self.assertEqual(dict(current.items()), expected)
+        self.assertEqual(set(current), set(expected))
+        self.assertEqual(sorted(current.values()), sorted(expected.values()))
+        unchanged = next(key for key in base if key not in current.changes)
+        self.assertEqual(current.get_json(unchanged), encode_json(base[unchanged]))
+        changed = next(key for key in current.changes if key in current)
+        self.assertIsNone(current.get_json(changed))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from data_manager import DataManager
+from persistent import LayeredMap
+from region import MAGIC, RegionMap
+from snapshot import BackgroundSaver, read_snapshot, write_snapshot
+
+class TestBackgroundSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+        self.journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_storage(self):
+        return read_snapshot(self.storage_file)
+
+    def test_bgsave_writes_point_in_time_copy(self):
+        manager = DataManager(self.storage_file, journal_file=self.journal_file, compact_min_records=100)
+        manager.save('users', 'u1', {'id': 'u1'})
+        self.assertTrue(manager.bgsave())
+        manager.save('users', 'u2', {'id': 'u2'})
+        manager.wait_bgsave()
+        manager.journal.close()
+        stats = manager.snapshot_stats
+        self.assertEqual(stats['snapshots'], 1)
+        self.assertFalse(stats['in_progress'])
+        self.assertIsNotNone(stats['last_pause'])
+        self.assertGreaterEqual(stats['last_duration'], stats['last_pause'])
+        self.assertEqual(list(self.read_storage()['users']), ['u1'])
+
+    def test_thread_fallback_when_fork_is_unavailable(self):
+        saver = BackgroundSaver(use_fork=False)
+        self.assertTrue(saver.start(self.storage_file, {'places': {'p1': {'id': 'p1'}}}))
+        saver.wait()
+        self.assertEqual(saver.stats['mode'], 'thread')
+        self.assertEqual(saver.stats['snapshots'], 1)
+        self.assertIn('p1', self.read_storage()['places'])
+
+    def test_wait_covers_on_complete_and_the_snapshots_it_starts(self):
+        calls = []
+
+        def on_complete(ok):
+            time.sleep(0.2)
+            calls.append(ok)
+            if len(calls) == 1:
+                saver.start(self.storage_file, {'places': {'p2': {'id': 'p2'}}})
+
+        saver = BackgroundSaver(on_complete=on_complete, use_fork=False)
+        saver.start(self.storage_file, {'places': {'p1': {'id': 'p1'}}})
+        time.sleep(0.1)  # the snapshot is written, on_complete still running
+        saver.wait()
+        self.assertEqual(calls, [True, True])
+        self.assertIn('p2', self.read_storage()['places'])
+
+    def test_checkpoint_during_bgsave_keeps_later_writes(self):
+        for use_fork in (False, True) if hasattr(os, 'fork') else (False,):
+            with self.subTest(use_fork=use_fork):
+                parent = os.getpid()
+
+                def slow_write(path, storage):
+                    if os.getpid() != parent or threading.current_thread() is not threading.main_thread():
+                        time.sleep(0.3)
+                    write_snapshot(path, storage)
+
+                manager = DataManager(self.storage_file, journal_file=self.journal_file, compact_min_records=100)
+                manager.snapshots.use_fork = use_fork
+                with mock.patch('data_manager.write_snapshot', slow_write):
+                    manager.save('users', 'u1', {'id': 'u1'})
+                    self.assertTrue(manager.bgsave())
+                    manager.save('users', 'u2', {'id': 'u2'})
+                    manager.checkpoint()
+                    manager.wait_bgsave()
+                manager.journal.close()
+                reopened = DataManager(self.storage_file, journal_file=self.journal_file)
+                self.assertEqual(reopened.get('users', 'u2'), {'id': 'u2'})
+                reopened.journal.close()
+
+    def test_background_compaction_keeps_journal_records(self):
+        manager = DataManager(self.storage_file, journal_file=self.journal_file,
+                              compact_min_records=2, background_snapshots=True)
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.save('users', 'u2', {'id': 'u2'})
+        manager.save('users', 'u3', {'id': 'u3'})
+        manager.wait_bgsave()
+        self.assertFalse(os.path.exists(manager.journal.rotated_file))
+        manager.journal.close()
+
+        reopened = DataManager(self.storage_file, journal_file=self.journal_file)
+        self.assertEqual(len(reopened.get_all('users')), 3)
+
+    def test_snapshot_without_journal_is_written_in_background(self):
+        manager = DataManager(self.storage_file, background_snapshots=True)
+        for i in range(5):
+            manager.save('amenities', str(i), {'id': str(i), 'name': 'Pool'})
+        manager.wait_bgsave()
+        self.assertEqual(len(self.read_storage()['amenities']), 5)
+
+class TestAtomicSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip_is_compact_with_checksum_footer(self):
+        storage = {'users': {'u1': {'id': 'u1', 'email': 'a@example.com'}}}
+        write_snapshot(self.storage_file, storage)
+        with open(self.storage_file, 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(b'#sha256:'))
+        self.assertEqual(read_snapshot(self.storage_file), storage)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['storage.json'])
+
+    def test_corrupted_snapshot_is_rejected(self):
+        write_snapshot(self.storage_file, {'users': {'u1': {'id': 'u1'}}})
+        with open(self.storage_file, 'r+b') as f:
+            f.seek(12)
+            f.write(b'X')
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file)
+
+    def test_plain_json_snapshot_is_still_readable(self):
+        with open(self.storage_file, 'w') as f:
+            json.dump({'countries': {'c1': {'code': 'US'}}}, f, indent=4)
+        self.assertEqual(DataManager(self.storage_file).get('countries', 'c1')['code'], 'US')
+
+class TestRegionSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.region')
+        self.journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open_manager(self, **kwargs):
+        return DataManager(self.storage_file, storage_format='region', **kwargs)
+
+    def test_loading_maps_the_file_without_decoding_it(self):
+        manager = self.open_manager()
+        manager.save_many('reviews', ((str(i), {'id': str(i), 'rating': i % 5}) for i in range(2000)))
+        with open(self.storage_file, 'rb') as f:
+            self.assertEqual(f.read(len(MAGIC)), MAGIC)
+
+        reviews = self.open_manager().storage['reviews']
+        self.assertIsInstance(reviews, LayeredMap)
+        self.assertIsInstance(reviews.base, RegionMap)
+        self.assertEqual(len(reviews), 2000)
+        self.assertEqual(reviews['1999'], {'id': '1999', 'rating': 4})
+
+    def test_collections_move_onto_each_new_snapshot(self):
+        manager = self.open_manager(journal_file=self.journal_file, compact_min_records=100)
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.save('places', 'p1', {'id': 'p1'})
+        manager.checkpoint()
+        self.assertEqual(len(manager.storage['users'].changes), 0)
+        manager.save('users', 'u2', {'id': 'u2'})
+        self.assertEqual(len(manager.storage['users'].changes), 1)
+        manager.checkpoint()
+        self.assertEqual(len(manager.storage['users'].changes), 0)
+        self.assertEqual(manager.get_all_json('users'), b'[{"id":"u1"},{"id":"u2"}]\n')
+        manager.delete('users', 'u1')
+        manager.journal.close()
+        self.assertEqual(self.open_manager(journal_file=self.journal_file).get_all('users'), [{'id': 'u2'}])
+
+    def test_background_snapshot_moves_collections_too(self):
+        manager = self.open_manager(background_snapshots=True)
+        manager.save('amenities', 'a1', {'id': 'a1', 'name': 'Pool'})
+        manager.wait_bgsave()
+        self.assertEqual(len(manager.storage['amenities'].changes), 0)
+        self.assertEqual(manager.get('amenities', 'a1')['name'], 'Pool')
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file, storage_format='xml')
+
+class TestSplitStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open_manager(self, **kwargs):
+        return DataManager(self.storage_file, split=True, **kwargs)
+
+    def collection_file(self, entity_type):
+        return os.path.join(self.tmpdir.name, f"storage.{entity_type}.json")
+
+    def test_collections_are_read_on_first_use(self):
+        manager = self.open_manager()
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.save('places', 'p1', {'id': 'p1'})
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['storage.places.json', 'storage.users.json'])
+
+        reopened = self.open_manager()
+        view = reopened.snapshot()
+        self.assertEqual(reopened.storage, {})
+        self.assertEqual(reopened.get('users', 'u1'), {'id': 'u1'})
+        self.assertEqual(list(reopened.storage), ['users'])
+        self.assertEqual(view.get_all('places'), [{'id': 'p1'}])
+        self.assertIsNone(reopened.get('reviews', 'r1'))
+
+    def test_writes_only_rewrite_their_own_collection(self):
+        manager = self.open_manager()
+        manager.save('places', 'p1', {'id': 'p1'})
+        before = os.stat(self.collection_file('places'))
+        manager.save('reviews', 'r1', {'id': 'r1', 'place_id': 'p1'})
+        after = os.stat(self.collection_file('places'))
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+        self.assertEqual(read_snapshot(self.collection_file('reviews')), {'r1': {'id': 'r1', 'place_id': 'p1'}})
+
+    def test_single_snapshot_file_is_split_on_startup(self):
+        write_snapshot(self.storage_file, {'users': {'u1': {'id': 'u1'}}, 'amenities': {'a1': {'id': 'a1'}}})
+        manager = self.open_manager()
+        self.assertFalse(os.path.exists(self.storage_file))
+        self.assertEqual(manager.get('amenities', 'a1'), {'id': 'a1'})
+        self.assertEqual(read_snapshot(self.collection_file('users')), {'u1': {'id': 'u1'}})
+
+    def test_journal_writes_load_only_their_collections(self):
+        self.open_manager().save('places', 'p1', {'id': 'p1'})
+        journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+        manager = self.open_manager(journal_file=journal_file)
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.journal.close()
+        reopened = self.open_manager(journal_file=journal_file)
+        self.assertEqual(list(reopened.storage), ['users'])
+        self.assertEqual(reopened.get_all('places'), [{'id': 'p1'}])
+
+    def test_restart_without_split_merges_the_collection_files(self):
+        journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+        manager = self.open_manager(journal_file=journal_file)
+        manager.save('places', 'p1', {'id': 'p1'})
+        manager.checkpoint()
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.journal.close()
+        reopened = DataManager(self.storage_file, journal_file=journal_file)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['storage.journal', 'storage.json'])
+        self.assertEqual(read_snapshot(self.storage_file), {'places': {'p1': {'id': 'p1'}}})
+        self.assertEqual(reopened.get_all('places'), [{'id': 'p1'}])
+        self.assertEqual(reopened.get_all('users'), [{'id': 'u1'}])
+        reopened.journal.close()
+
+        self.open_manager()
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file, journal_file=journal_file, shared=True)
+
+    def test_failed_checkpoint_keeps_its_collections_dirty(self):
+        journal_file = os.path.join(self.tmpdir.name, 'storage.journal')
+        manager = self.open_manager(journal_file=journal_file)
+        manager.save('places', 'p1', {'id': 'p1'})
+        with mock.patch('data_manager.write_snapshot', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                manager.checkpoint()
+        manager.save('users', 'u1', {'id': 'u1'})
+        manager.checkpoint()
+        manager.journal.close()
+        reopened = self.open_manager(journal_file=journal_file)
+        self.assertEqual(reopened.get_all('places'), [{'id': 'p1'}])
+        self.assertEqual(reopened.get_all('users'), [{'id': 'u1'}])
+
+if __name__ == '__main__':
+    unittest.main()
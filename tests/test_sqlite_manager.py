@@ -0,0 +1,58 @@
+import os
+import tempfile
+import threading
+import unittest
+from sqlite_manager import SQLiteManager
+
+class TestSQLiteManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_file = os.path.join(self.tmpdir.name, 'storage.db')
+        self.manager = SQLiteManager(self.database_file)
+
+    def tearDown(self):
+        self.manager.close()
+        self.tmpdir.cleanup()
+
+    def test_crud_round_trip(self):
+        self.manager.save('users', 'u1', {'id': 'u1', 'email': 'a@example.com'})
+        self.assertEqual(self.manager.get('users', 'u1')['email'], 'a@example.com')
+        self.assertTrue(self.manager.update('users', 'u1', {'id': 'u1', 'email': 'b@example.com'}))
+        self.assertEqual(self.manager.get_all('users'), [{'id': 'u1', 'email': 'b@example.com'}])
+        self.assertTrue(self.manager.delete('users', 'u1'))
+        self.assertIsNone(self.manager.get('users', 'u1'))
+        self.assertFalse(self.manager.update('users', 'u1', {'id': 'u1'}))
+        self.assertFalse(self.manager.delete('places', 'missing'))
+
+    def test_data_survives_reopen(self):
+        self.manager.save('places', 'p1', {'id': 'p1', 'name': 'Loft'})
+        reopened = SQLiteManager(self.database_file)
+        self.assertEqual(reopened.get('places', 'p1')['name'], 'Loft')
+        reopened.close()
+
+    def test_find_uses_expression_index(self):
+        for i in range(10):
+            self.manager.save('reviews', str(i), {'id': str(i), 'place_id': f"p{i % 3}", 'rating': i})
+        reviews = self.manager.find('reviews', place_id='p1')
+        self.assertEqual([review['id'] for review in reviews], ['1', '4', '7'])
+        plan = self.manager._connection().execute(
+            "EXPLAIN QUERY PLAN SELECT data FROM reviews WHERE json_extract(data, '$.place_id') = ?",
+            ('p1',)).fetchall()
+        self.assertIn('USING INDEX reviews_place_id', plan[0][-1])
+
+    def test_each_thread_gets_its_own_connection(self):
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(self.manager._connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.manager._connection())
+        mode = self.manager._connection().execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_invalid_entity_type_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.manager.save('users"; DROP TABLE users; --', 'x', {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from data_manager import DataManager
+from snapshot import write_snapshot
+from tiered import TieredMap, TieredStore, entity_bytes
+
+# Prints how much a manager's peak memory (VmHWM, in kB) grows while loading and checkpointing a snapshot.
+PEAK_GROWTH = '''
+import sys
+from data_manager import DataManager
+
+def peak():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+
+before = peak()
+budget = int(sys.argv[2]) if len(sys.argv) > 2 else None
+manager = DataManager(sys.argv[1], journal_file=sys.argv[1] + '.journal', memory_budget=budget)
+manager.checkpoint()
+print(peak() - before)
+'''
+
+def place(i):
+    return {'id': f"p{i}", 'name': f"Place {i}", 'amenity_ids': ['a1', 'a2']}
+
+class TestTieredStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = TieredStore(os.path.join(self.tmpdir.name, 'cold'), 3 * entity_bytes(place(0)))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_least_recently_used_entities_are_evicted_and_faulted_back(self):
+        places = TieredMap(self.store, ((f"p{i}", place(i)) for i in range(3)))
+        places['p0']
+        places = places.set('p3', place(3))
+        self.assertEqual(self.store.stats['evictions'], 1)
+        self.assertEqual(self.store.stats['resident'], 3)
+        self.assertLessEqual(self.store.stats['resident_bytes'], self.store.max_bytes)
+        self.assertIsNone(places.entries['p1'].data)
+        self.assertEqual(places['p1'], place(1))
+        self.assertEqual(self.store.stats['faults'], 1)
+        self.assertIsNotNone(places.entries['p1'].data)
+        self.assertLessEqual(self.store.stats['resident_bytes'], self.store.max_bytes)
+
+    def test_scans_do_not_make_entities_hot(self):
+        places = TieredMap(self.store, ((f"p{i}", place(i)) for i in range(10)))
+        hot = [key for key, entry in places.entries.items() if entry.data is not None]
+        self.assertEqual(list(places.values()), [place(i) for i in range(10)])
+        self.assertEqual(dict(places.items())['p0'], place(0))
+        self.assertEqual([key for key, entry in places.entries.items() if entry.data is not None], hot)
+        self.assertEqual(self.store.stats['faults'], 0)
+
+    def test_older_versions_keep_their_data(self):
+        first = TieredMap(self.store, ((f"p{i}", place(i)) for i in range(10)))
+        second = first.set('p0', {'id': 'p0', 'name': 'Renamed'}).delete('p1')
+        for i in range(10, 20):
+            second = second.set(f"p{i}", place(i))
+        self.assertEqual(first['p0'], place(0))
+        self.assertEqual(first['p1'], place(1))
+        self.assertEqual(second['p0'], {'id': 'p0', 'name': 'Renamed'})
+        self.assertNotIn('p1', second)
+
+    def test_cold_records_are_written_once(self):
+        places = TieredMap(self.store, ((f"p{i}", place(i)) for i in range(10)))
+        self.assertEqual(self.store.stats['cold'], 7)
+        for i in range(10):
+            places[f"p{i}"]
+        written = (self.store.stats['cold'], self.store.stats['cold_bytes'])
+        faults = self.store.stats['faults']
+        for i in range(10):
+            self.assertEqual(places[f"p{i}"], place(i))
+        self.assertEqual(self.store.stats['faults'], faults + 10)
+        self.assertEqual((self.store.stats['cold'], self.store.stats['cold_bytes']), written)
+
+class TestTieredDataManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage_file = os.path.join(self.tmpdir.name, 'storage.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_memory_stays_within_budget(self):
+        budget = 20 * entity_bytes(place(0))
+        manager = DataManager(self.storage_file, journal_file=f"{self.storage_file}.journal",
+                              memory_budget=budget)
+        manager.save_many('places', ((f"p{i}", place(i)) for i in range(200)))
+        self.assertLessEqual(manager.tier_stats['resident_bytes'], budget)
+        self.assertEqual(manager.get('places', 'p7'), place(7))
+        self.assertEqual(len(manager.find('places', name='Place 150')), 1)
+        manager.close()
+
+        reopened = DataManager(self.storage_file, journal_file=f"{self.storage_file}.journal",
+                               memory_budget=budget)
+        self.assertEqual(len(reopened.get_all('places')), 200)
+        self.assertLessEqual(reopened.tier_stats['resident_bytes'], budget)
+        self.assertGreater(reopened.tier_stats['cold'], 150)
+        reopened.close()
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs Linux')
+    def test_budget_bounds_peak_memory_of_startup_and_checkpoints(self):
+        write_snapshot(self.storage_file, {'reviews': {
+            f"r{i}": {'id': f"r{i}", 'place_id': f"p{i % 100}", 'comment': f"{i} " * 400} for i in range(30000)}})
+
+        def peak_growth(*budget):
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            result = subprocess.run([sys.executable, '-c', PEAK_GROWTH, self.storage_file, *budget],
+                                    cwd=root, capture_output=True, text=True, check=True)
+            return int(result.stdout)
+
+        everything = peak_growth()
+        self.assertLess(peak_growth(str(100 * 1024)), everything / 2)
+
+    def test_needs_json_snapshots(self):
+        with self.assertRaises(ValueError):
+            DataManager(None, memory_budget=1000)
+        with self.assertRaises(ValueError):
+            DataManager(self.storage_file, storage_format='region', memory_budget=1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import json
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from json_cache import encode_json
+from persistent import PersistentMap
+
+
+def entity_bytes(entity_data):
+    """Approximate memory held by an entity: the dict or record, its keys and values, and the items of list values."""
+    size = sys.getsizeof(entity_data)
+    for key, value in entity_data.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class Entry:
+    """One written version of an entity: its data while hot, and where its cold record is once written."""
+
+    # cold is offset << 32 | length in the cold file, one int rather than two.
+    __slots__ = ('data', 'cold')
+
+    def __init__(self, data):
+        self.data = data
+        self.cold = None
+
+
+class TieredStore:
+    """Entity data of tiered collections, hot in an LRU under max_bytes and cold in a file.
+
+    Every write stores a new Entry, so map versions that still refer to an
+    older entry keep reading what they saw. Entries released by the newest
+    version leave the LRU. An evicted entry is appended to the cold file,
+    once, and read back from there; records are never overwritten, so the
+    file only grows until it is started over on the next run. Bulk reads
+    load cold entries without making them hot, so one scan does not evict
+    everything else.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {'max_bytes': max_bytes, 'resident_bytes': 0, 'resident': 0, 'cold': 0, 'cold_bytes': 0,
+                      'evictions': 0, 'faults': 0}
+        # {entry: size}, least recently used first.
+        self._hot = OrderedDict()
+        self._cold = open(path, 'w+b')
+        self._lock = threading.Lock()
+
+    def add(self, entity_data):
+        """Store a new version of an entity as a hot Entry and return it."""
+        entry = Entry(entity_data)
+        size = entity_bytes(entity_data)
+        with self._lock:
+            self._hot[entry] = size
+            self.stats['resident_bytes'] += size
+            self._evict()
+        return entry
+
+    def release(self, entry):
+        """Stop keeping entry hot, once the newest version of its map no longer refers to it."""
+        with self._lock:
+            size = self._hot.pop(entry, None)
+            if size is not None:
+                self.stats['resident_bytes'] -= size
+            self.stats['resident'] = len(self._hot)
+
+    def fetch(self, entry, decode=None):
+        """Return an entry's data, faulting it back in and making it the most recently used.
+
+        decode, if given, turns the dict read back from disk into what was stored.
+        """
+        data = entry.data
+        with self._lock:
+            if data is None:
+                data = entry.data
+            if data is None:
+                data = entry.data = self._read(entry, decode)
+                self.stats['faults'] += 1
+                size = self._hot[entry] = entity_bytes(data)
+                self.stats['resident_bytes'] += size
+                self._evict()
+            elif entry in self._hot:
+                self._hot.move_to_end(entry)
+        return data
+
+    def peek(self, entry, decode=None):
+        """Return an entry's data without making it hot, for scans."""
+        data = entry.data
+        if data is None:
+            with self._lock:
+                data = entry.data
+                if data is None:
+                    data = self._read(entry, decode)
+        return data
+
+    def close(self):
+        with self._lock:
+            self._cold.close()
+
+    def _read(self, entry, decode):
+        self._cold.seek(entry.cold >> 32)
+        data = json.loads(self._cold.read(entry.cold & 0xFFFFFFFF))
+        return data if decode is None else decode(data)
+
+    def _evict(self):
+        """Called with the lock held: move the least recently used entries to disk until under max_bytes."""
+        while self.stats['resident_bytes'] > self.max_bytes and self._hot:
+            entry, size = self._hot.popitem(last=False)
+            if entry.cold is None:
+                body = encode_json(entry.data)
+                offset = self.stats['cold_bytes']
+                self._cold.seek(offset)
+                self._cold.write(body)
+                entry.cold = offset << 32 | len(body)
+                self.stats['cold'] += 1
+                self.stats['cold_bytes'] += len(body)
+            entry.data = None
+            self.stats['resident_bytes'] -= size
+            self.stats['evictions'] += 1
+        self.stats['resident'] = len(self._hot)
+
+
+class TieredMap(Mapping):
+    """An immutable mapping of entities kept in a TieredStore, with PersistentMap updates.
+
+    It maps keys to Entries, so versions share entries as PersistentMaps
+    share values, and reading a value fetches it from the store. Values
+    faulted back in are passed to decode, if given, such as a model
+    record's from_dict.
+    """
+
+    __slots__ = ('store', 'entries', 'decode')
+
+    def __init__(self, store, items=(), entries=None, decode=None):
+        self.store = store
+        self.entries = PersistentMap((key, store.add(value)) for key, value in items) if entries is None else entries
+        self.decode = decode
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        return default if entry is None else self.store.fetch(entry, self.decode)
+
+    def __getitem__(self, key):
+        return self.store.fetch(self.entries[key], self.decode)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def values(self):
+        """The values in insertion order, read one at a time."""
+        return (self.store.peek(entry, self.decode) for entry in self.entries.values())
+
+    def items(self):
+        """The (key, value) pairs in insertion order, read one at a time."""
+        return ((key, self.store.peek(entry, self.decode)) for key, entry in self.entries.items())
+
+    def set(self, key, value):
+        """Return a map where key maps to value; an existing key keeps its position."""
+        old = self.entries.get(key)
+        entries = self.entries.set(key, self.store.add(value))
+        if old is not None:
+            self.store.release(old)
+        return TieredMap(self.store, entries=entries, decode=self.decode)
+
+    def delete(self, key):
+        """Return a map without key, or this map if key is absent."""
+        old = self.entries.get(key)
+        if old is None:
+            return self
+        self.store.release(old)
+        return TieredMap(self.store, entries=self.entries.delete(key), decode=self.decode)